@@ -188,3 +188,105 @@ CORS_ALLOW_HEADERS = [
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
 ]
+
+# Face recognition
+# Approximate nearest-neighbour search for large galleries (faceapp/ann.py).
+# Build and persist the index with `python manage.py build_ann_index`.
+FACE_ANN_ENABLED = False
+FACE_ANN_INDEX_PATH = os.path.join(MEDIA_ROOT, 'ann_index.npz')
+# IVF cells scanned per query: higher = better recall, slower search
+FACE_ANN_NPROBE = 8
+# Load Facenet and run a dummy inference when a server worker starts;
+# /api/health/ reports 503 until it is done. gunicorn.conf.py always warms
+# its workers, this switch covers other servers (runserver, uwsgi, ...).
+FACE_WARMUP_ON_START = os.environ.get('FACE_WARMUP_ON_START', '0') == '1'
+# Largest number of frames accepted by /api/start/batch/
+FACE_BATCH_MAX_IMAGES = 16
+# Group concurrent single-frame inferences into one batched forward pass.
+# Only helps when a worker serves requests concurrently (gunicorn gthread
+# workers, ASGI). Stats are served at /api/metrics/.
+FACE_BATCHING_ENABLED = False
+FACE_BATCH_MAX_SIZE = 8
+FACE_BATCH_MAX_WAIT_MS = 10
+# Run the model and gallery in `python manage.py run_inference_server`
+# instead of every web worker: a Unix socket path (or host:port). Empty =
+# in-process inference.
+FACE_INFERENCE_SOCKET = os.environ.get('FACE_INFERENCE_SOCKET', '')
+FACE_INFERENCE_TIMEOUT = 30
+# Faces considered per frame in multi-face mode ({"multi": true} on /api/start/)
+FACE_MULTI_MAX_FACES = 10
+# Per-process LRU cache of embeddings keyed by image content (0 disables).
+# PHASH also matches near-identical frames by a 64-bit difference hash.
+FACE_EMBEDDING_CACHE_SIZE = 512
+FACE_EMBEDDING_CACHE_TTL = 300
+FACE_EMBEDDING_CACHE_PHASH = False
+# OpenCV cascade check that rejects frames without a face before Facenet
+# runs ("no_face" status). Per endpoint: start (/api/start/), start_batch,
+# start_file (multipart upload) and verify (/api/verify-face/).
+FACE_PREFILTER = {
+    'start': True,
+    'start_batch': True,
+    'start_file': True,
+    'verify': False,
+}
+# file name under cv2.data.haarcascades, or an absolute path (e.g. an LBP cascade)
+FACE_PREFILTER_CASCADE = 'haarcascade_frontalface_default.xml'
+# frames are downscaled so their longest side is at most this before detection
+FACE_PREFILTER_MAX_SIDE = 320
+FACE_PREFILTER_MIN_NEIGHBORS = 3
+# Uploaded frames are decoded straight to at most this many pixels on the
+# longest side (JPEG is scaled by libjpeg during decode); 0 = full size
+FACE_DECODE_MAX_SIDE = 640
+# Embeddings for new/changed photos are computed by
+# `python manage.py run_embedding_worker`; False = inline on save (dev only)
+FACE_EMBEDDING_ASYNC = True
+FACE_EMBEDDING_JOB_MAX_ATTEMPTS = 3
+# running jobs older than this (seconds) are assumed orphaned and retried
+FACE_EMBEDDING_JOB_TIMEOUT = 600
+# Kiosk searches scoped to a department/location (token "kiosk" claim or
+# department/location request parameter) retry against the whole company
+# when the local best match misses the threshold
+FACE_SCOPE_FALLBACK = True
+# Keep the brute-force gallery as "float16" or "int8" (per-row scale)
+# instead of float32: 1/2 or ~1/4 of the memory per worker, distances off
+# by the quantization error (see benchmark_gallery). '' = float32
+FACE_GALLERY_QUANTIZATION = ''
+# Map the gallery from the snapshot written by
+# `python manage.py write_gallery_snapshot` (shared by all workers) instead
+# of reading every embedding from the database on start
+FACE_GALLERY_SNAPSHOT = False
+FACE_GALLERY_SNAPSHOT_DIR = os.path.join(MEDIA_ROOT, 'gallery_snapshots')
+# seconds between checks for a newer snapshot version
+FACE_GALLERY_SNAPSHOT_CHECK = 5
+# Seconds between polls of the embedding change log; each process then
+# applies only the users changed elsewhere (None = never poll)
+FACE_GALLERY_SYNC_INTERVAL = 2
+# change log entries older than this are pruned by write_gallery_snapshot
+FACE_EMBEDDING_CHANGE_RETENTION_DAYS = 7
+# Seconds a validated bearer token -> user mapping is reused (0 disables);
+# a cached request costs one primary-key read of the revocation counter,
+# which logout bumps for every worker at once
+FACE_TOKEN_CACHE_TTL = 30
+FACE_TOKEN_CACHE_SIZE = 1024
+# Chance that a login also deletes one batch of expired/revoked API tokens
+# (in addition to `python manage.py prune_api_tokens`)
+FACE_TOKEN_PRUNE_PROBABILITY = 0.01
+# 0 = write each punch immediately. N > 0 buffers punch events per process
+# and writes them in one transaction every N events or
+# FACE_PUNCH_FLUSH_INTERVAL seconds: fewer write transactions, but a punch
+# on another worker before the flush is answered "login" again and
+# buffered events are lost if the process is killed (faceapp/attendance.py)
+FACE_PUNCH_BUFFER_SIZE = 0
+FACE_PUNCH_FLUSH_INTERVAL = 2.0
+# events kept for retry while flushes fail; the oldest beyond this are dropped
+FACE_PUNCH_MAX_PENDING = 10000
+# Local time after which a login is reported as late (/api/reports/...)
+FACE_LATE_AFTER = "09:30"
+# Rows fetched per database round trip by the streaming exports
+FACE_EXPORT_CHUNK_SIZE = 2000
+# Threads hashing passwords for /api/admin/enroll/, which leaves the photos
+# to run_embedding_worker (enroll_users takes --workers)
+FACE_ENROLL_WORKERS = 2
+# Most CSV rows one /api/admin/enroll/ request may import (each hashes a
+# password in the request); larger CSVs get 413, use enroll_users instead
+FACE_ENROLL_MAX_ROWS = 200
@@ -1,13 +1,13 @@
 # faceapp/admin.py
 
 from django.contrib import admin
-from .models import User, Attendance, Department
+from .models import User, Attendance, Department, EmbeddingJob, PunchEvent
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
-    list_display = ("name", "email", "department", "is_admin")
-    readonly_fields = ("created_at",)
-    fields = ("name", "email", "department", "is_admin", "password", "photo", "created_at")
+    list_display = ("name", "email", "department", "is_admin", "embedding_status")
+    readonly_fields = ("created_at", "embedding_status")
+    fields = ("name", "email", "department", "is_admin", "password", "photo", "embedding_status", "created_at")
     search_fields = ("name", "email")
 
     def save_model(self, request, obj, form, change):
@@ -26,9 +26,34 @@ class UserAdmin(admin.ModelAdmin):
 @admin.register(Department)
 class DepartmentAdmin(admin.ModelAdmin):
     list_display = ("department_name", "location", "total_employees")
+    readonly_fields = ("total_employees",)
 
 
 @admin.register(Attendance)
 class AttendanceAdmin(admin.ModelAdmin):
     list_display = ("user", "date", "login_time", "logout_time", "working_hours")
     list_filter = ("date",)
+
+
+@admin.register(EmbeddingJob)
+class EmbeddingJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "user", "status", "attempts", "created_at", "finished_at")
+    list_filter = ("status",)
+    readonly_fields = ("last_error",)
+
+
+@admin.register(PunchEvent)
+class PunchEventAdmin(admin.ModelAdmin):
+    list_display = ("user", "timestamp", "kiosk", "distance")
+    list_filter = ("date",)
+    search_fields = ("user__name", "user__email", "kiosk")
+
+    # append-only audit log
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
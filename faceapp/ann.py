@@ -0,0 +1,194 @@
+# faceapp/ann.py
+"""
+Approximate nearest-neighbour search over unit-length embeddings.
+
+``IVFIndex`` is an inverted-file index in plain NumPy: vectors are
+clustered with spherical k-means into ``nlist`` cells, and a query only
+scores the vectors in the ``nprobe`` cells whose centroids are closest to
+it. ``nprobe`` is the recall/latency knob: 1 is fastest, ``nlist`` is an
+exact (but slower than brute force) search.
+"""
+import numpy as np
+
+from .embeddings import EMBEDDING_DTYPE
+
+
+def kmeans(vectors, nlist, iters=20, seed=0):
+    """Spherical k-means; returns ``nlist`` unit-length centroids."""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    nlist = max(1, min(nlist, n))
+    centroids = vectors[rng.choice(n, nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        norms = np.linalg.norm(sums, axis=1)
+        empty = norms == 0
+        if empty.any():
+            # re-seed empty cells with random vectors
+            sums[empty] = vectors[rng.choice(n, int(empty.sum()), replace=False)]
+            norms[empty] = np.linalg.norm(sums[empty], axis=1)
+        centroids = (sums / norms[:, None]).astype(np.float32)
+    return centroids
+
+
+class _InvertedList:
+    """Growable (ids, vectors) storage for one IVF cell."""
+
+    def __init__(self, dim):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vecs = np.empty((0, dim), dtype=np.float32)
+        self.size = 0
+
+    def append(self, user_id, vec):
+        if self.size == len(self.ids):
+            cap = max(16, 2 * len(self.ids))
+            ids = np.empty(cap, dtype=np.int64)
+            vecs = np.empty((cap, self.vecs.shape[1]), dtype=np.float32)
+            ids[:self.size] = self.ids[:self.size]
+            vecs[:self.size] = self.vecs[:self.size]
+            self.ids, self.vecs = ids, vecs
+        self.ids[self.size] = user_id
+        self.vecs[self.size] = vec
+        self.size += 1
+        return self.size - 1
+
+    def pop(self, pos):
+        """Remove the entry at ``pos`` by moving the last one into it."""
+        last = self.size - 1
+        moved = None
+        if pos != last:
+            self.ids[pos] = self.ids[last]
+            self.vecs[pos] = self.vecs[last]
+            moved = int(self.ids[pos])
+        self.size = last
+        return moved
+
+
+class IVFIndex:
+    def __init__(self, centroids, nprobe=8):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nprobe = nprobe
+        # last EmbeddingChange version the vectors reflect (faceapp.gallery)
+        self.change_version = 0
+        self._lists = [_InvertedList(self.dim) for _ in range(self.nlist)]
+        self._where = {}  # user_id -> (list, position)
+
+    @property
+    def dim(self):
+        return self.centroids.shape[1]
+
+    @property
+    def nlist(self):
+        return self.centroids.shape[0]
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, user_id):
+        return user_id in self._where
+
+    def ids(self):
+        return list(self._where)
+
+    @classmethod
+    def train(cls, vectors, nlist=None, nprobe=8, iters=20, sample=None, seed=0):
+        """
+        Cluster ``vectors`` (N x D, unit length) into ``nlist`` cells.
+        ``nlist`` defaults to ~4*sqrt(N); training runs on at most
+        ``sample`` vectors (default 64 per cell).
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if nlist is None:
+            nlist = int(4 * np.sqrt(len(vectors)))
+        nlist = max(1, min(nlist, len(vectors)))
+        sample = sample or 64 * nlist
+        if len(vectors) > sample:
+            rng = np.random.default_rng(seed)
+            train_set = vectors[rng.choice(len(vectors), sample, replace=False)]
+        else:
+            train_set = vectors
+        return cls(kmeans(train_set, nlist, iters=iters, seed=seed), nprobe=nprobe)
+
+    def _assign(self, vectors):
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def add(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if not len(vectors):
+            return
+        for user_id, cell, vec in zip(ids, self._assign(vectors), vectors):
+            user_id = int(user_id)
+            if user_id in self._where:
+                self.remove(user_id)
+            pos = self._lists[cell].append(user_id, vec)
+            self._where[user_id] = (int(cell), pos)
+
+    def remove(self, user_id):
+        loc = self._where.pop(int(user_id), None)
+        if loc is None:
+            return False
+        cell, pos = loc
+        moved = self._lists[cell].pop(pos)
+        if moved is not None:
+            self._where[moved] = (cell, pos)
+        return True
+
+    def search(self, query, k=5, nprobe=None):
+        """Return up to ``k`` ``(user_id, similarity)`` pairs, best first."""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        q = np.asarray(query, dtype=np.float32)
+        cell_sims = self.centroids @ q
+        if nprobe < self.nlist:
+            cells = np.argpartition(-cell_sims, nprobe - 1)[:nprobe]
+        else:
+            cells = np.arange(self.nlist)
+
+        ids, sims = [], []
+        for cell in cells:
+            lst = self._lists[cell]
+            if lst.size:
+                ids.append(lst.ids[:lst.size])
+                sims.append(lst.vecs[:lst.size] @ q)
+        if not ids:
+            return []
+        ids = np.concatenate(ids)
+        sims = np.concatenate(sims)
+
+        k = min(k, len(ids))
+        top = np.argpartition(-sims, k - 1)[:k] if k < len(ids) else np.arange(len(ids))
+        top = top[np.argsort(-sims[top])]
+        return [(int(ids[i]), float(sims[i])) for i in top]
+
+    def save(self, path):
+        ids = np.empty(len(self), dtype=np.int64)
+        cells = np.empty(len(self), dtype=np.int32)
+        vecs = np.empty((len(self), self.dim), dtype=EMBEDDING_DTYPE)
+        pos = 0
+        for cell, lst in enumerate(self._lists):
+            end = pos + lst.size
+            ids[pos:end] = lst.ids[:lst.size]
+            cells[pos:end] = cell
+            vecs[pos:end] = lst.vecs[:lst.size]
+            pos = end
+        with open(path, "wb") as f:
+            np.savez(f, centroids=self.centroids, ids=ids, cells=cells, vectors=vecs,
+                     change_version=np.int64(self.change_version))
+
+    @classmethod
+    def load(cls, path, nprobe=8):
+        with np.load(path) as data:
+            index = cls(data["centroids"], nprobe=nprobe)
+            ids, cells, vecs = data["ids"], data["cells"], data["vectors"].astype(np.float32)
+            # files saved before the version was stored cannot be caught up
+            index.change_version = int(data["change_version"]) if "change_version" in data else -1
+        order = np.argsort(cells, kind="stable")
+        ids, cells, vecs = ids[order], cells[order], vecs[order]
+        bounds = np.searchsorted(cells, np.arange(index.nlist + 1))
+        for cell, lst in enumerate(index._lists):
+            lo, hi = bounds[cell], bounds[cell + 1]
+            lst.ids, lst.vecs, lst.size = ids[lo:hi].copy(), vecs[lo:hi].copy(), int(hi - lo)
+            for pos, user_id in enumerate(lst.ids.tolist()):
+                index._where[user_id] = (cell, pos)
+        return index
@@ -1,6 +1,23 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
 class FaceappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'faceapp'
+
+    def ready(self):
+        from .inference import start_warm_up, warm_up_enabled
+
+        if not warm_up_enabled():
+            return
+        # runserver's autoreloader imports the project twice; only the
+        # child process (RUN_MAIN=true) actually serves requests
+        if 'runserver' in sys.argv and os.environ.get('RUN_MAIN') != 'true':
+            return
+        # management commands other than the servers don't need the model
+        if 'manage.py' in os.path.basename(sys.argv[0]) and 'runserver' not in sys.argv:
+            return
+        start_warm_up()
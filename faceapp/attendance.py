@@ -0,0 +1,311 @@
+# faceapp/attendance.py
+"""
+Daily attendance punches.
+
+Every accepted punch is stored as an immutable ``PunchEvent`` (user,
+timestamp, kiosk, match distance). There is one ``Attendance`` row per
+user and day (unique ``(user, date)``), derived from the events: the
+first punch of the day is ``login_time``, the last one ``logout_time``.
+
+By default each punch is written immediately: the event insert and a
+single ``INSERT ... ON CONFLICT DO UPDATE`` of the day row (Postgres,
+SQLite; other backends lock the row with ``SELECT ... FOR UPDATE``), so
+concurrent kiosks never create a second row or lose an update, and the
+kiosk response reflects every committed punch.
+
+Setting ``FACE_PUNCH_BUFFER_SIZE`` opts into write-behind: events are
+buffered in-process and written every ``FACE_PUNCH_BUFFER_SIZE`` events
+or ``FACE_PUNCH_FLUSH_INTERVAL`` seconds, one transaction bulk-inserting
+the events and upserting the affected day rows. The trade-offs: the
+response only sees the stored day row plus this process's buffer, so a
+second punch on another worker before the flush is answered "login"
+again (the stored row is still right); events still buffered are lost
+if the process is killed; and flushes that keep failing hold at most
+``FACE_PUNCH_MAX_PENDING`` events, dropping the oldest beyond that
+(counted in ``stats()``).
+
+Both paths lock the User row, then adjust the summary tables
+(``faceapp.summaries``) by the old and new values of the day rows in the
+same transaction as the Attendance write.
+"""
+import atexit
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+LOGIN = "login"
+LOGOUT = "logout"
+
+# hours between the stored login_time and the new punch, per vendor
+_HOURS_SQL = {
+    "postgresql": "ROUND((EXTRACT(EPOCH FROM EXCLUDED.login_time - {t}.login_time) / 3600)::numeric, 2)::double precision",
+    "sqlite": "ROUND((julianday(excluded.login_time) - julianday({t}.login_time)) * 24, 2)",
+}
+
+_UPSERT_SQL = """
+INSERT INTO {t} (user_id, date, login_time) VALUES (%s, %s, %s)
+ON CONFLICT (user_id, date) DO UPDATE SET
+    login_time = COALESCE({t}.login_time, excluded.login_time),
+    logout_time = CASE WHEN {t}.login_time IS NULL THEN {t}.logout_time ELSE excluded.login_time END,
+    working_hours = CASE WHEN {t}.login_time IS NULL THEN {t}.working_hours ELSE {hours} END
+RETURNING working_hours, (logout_time IS NOT NULL AND logout_time = %s)
+"""
+
+
+def working_hours(login_time, logout_time):
+    return round((logout_time - login_time).total_seconds() / 3600, 2)
+
+
+def punch(user, now=None, kiosk="", distance=None):
+    """
+    Record a punch for ``user`` at ``now`` (default: the current time).
+    Returns ``(action, working_hours)``: ``("login", None)`` for the first
+    punch of the day, ``("logout", hours)`` afterwards.
+    """
+    from .models import Attendance, PunchEvent, User
+    from .summaries import apply_changes
+
+    now = now or timezone.now()
+    event = PunchEvent(user=user, timestamp=now, date=timezone.localdate(now), kiosk=kiosk or "", distance=distance)
+    buffer = get_punch_buffer()
+    if buffer is None:
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(pk=user.pk).values_list("pk", flat=True))
+            old = Attendance.objects.filter(user=user, date=event.date).values_list("login_time", "working_hours").first()
+            event.save()
+            action, hours = punch_day(user, now)
+            if action == LOGIN:
+                new = (now, old[1] if old else None)
+            else:
+                new = (old[0], hours)
+            apply_changes([(old and (user.pk, event.date, *old), (user.pk, event.date, *new))])
+            return action, hours
+
+    stored = Attendance.objects.filter(user=user, date=event.date).values_list("login_time", flat=True).first()
+    earlier = buffer.add(event)
+    first = min((t for t in (stored, earlier) if t is not None), default=None)
+    if first is None or first >= now:
+        return LOGIN, None
+    return LOGOUT, working_hours(first, now)
+
+
+def punch_day(user, now):
+    """Apply one punch to the day row directly; returns ``(action, hours)``."""
+    from .models import Attendance
+
+    today = timezone.localdate(now)
+    hours_sql = _HOURS_SQL.get(connection.vendor)
+    if hours_sql is None:
+        return _punch_locked(Attendance, user, today, now)
+
+    table = connection.ops.quote_name(Attendance._meta.db_table)
+    sql = _UPSERT_SQL.format(t=table, hours=hours_sql.format(t=table))
+    stamp = connection.ops.adapt_datetimefield_value(now)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user.pk, connection.ops.adapt_datefield_value(today), stamp, stamp])
+        hours, logged_out = cursor.fetchone()
+    return (LOGOUT, hours) if logged_out else (LOGIN, None)
+
+
+def _punch_locked(Attendance, user, today, now):
+    while True:
+        with transaction.atomic():
+            record = Attendance.objects.select_for_update().filter(user=user, date=today).first()
+            if record is None:
+                try:
+                    with transaction.atomic():
+                        Attendance.objects.create(user=user, date=today, login_time=now)
+                    return LOGIN, None
+                except IntegrityError:
+                    continue  # another kiosk created it first: lock that row
+            if record.login_time is None:
+                Attendance.objects.filter(pk=record.pk).update(login_time=now)
+                return LOGIN, None
+            hours = working_hours(record.login_time, now)
+            Attendance.objects.filter(pk=record.pk).update(logout_time=now, working_hours=hours)
+            return LOGOUT, hours
+
+
+def write_events(events):
+    """
+    Insert ``events`` and re-derive the Attendance rows of every
+    (user, date) they touch, in one transaction. Flushes that share a
+    user are serialised by locking the User rows, so each one sees the
+    events committed before it.
+    """
+    from .models import Attendance, PunchEvent, User
+    from .summaries import apply_changes, row_values
+
+    days = {(e.user_id, e.date) for e in events}
+    user_ids = sorted({user_id for user_id, _ in days})
+    dates = {date for _, date in days}
+    with transaction.atomic():
+        list(User.objects.select_for_update().filter(pk__in=user_ids).order_by("pk").values_list("pk", flat=True))
+        PunchEvent.objects.bulk_create(events)
+
+        spans = {
+            (row["user_id"], row["date"]): row
+            for row in PunchEvent.objects.filter(user_id__in=user_ids, date__in=dates)
+            .values("user_id", "date").annotate(first=Min("timestamp"), last=Max("timestamp"))
+        }
+        # rows written before the event log (or by the write-through path)
+        stored = {
+            (a.user_id, a.date): a
+            for a in Attendance.objects.filter(user_id__in=user_ids, date__in=dates)
+        }
+        rows = []
+        for key in days:
+            span = spans[key]
+            old = stored.get(key)
+            times = {span["first"], span["last"]}
+            if old is not None:
+                times.update(t for t in (old.login_time, old.logout_time) if t is not None)
+            times = sorted(times)
+            login, logout = times[0], (times[-1] if len(times) > 1 else None)
+            rows.append(Attendance(
+                user_id=key[0], date=key[1], login_time=login, logout_time=logout,
+                working_hours=working_hours(login, logout) if logout else None,
+            ))
+        Attendance.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=["user", "date"],
+            update_fields=["login_time", "logout_time", "working_hours"],
+        )
+        apply_changes(
+            (row_values(stored[(row.user_id, row.date)]) if (row.user_id, row.date) in stored else None,
+             row_values(row))
+            for row in rows
+        )
+
+
+class PunchBuffer:
+    """
+    Thread-safe write-behind buffer of PunchEvents. ``add`` flushes
+    synchronously once ``max_events`` are waiting; a daemon thread flushes
+    whatever is left every ``interval`` seconds, and again at exit. Events
+    of failed flushes are retried, keeping at most ``max_pending``.
+    """
+
+    def __init__(self, max_events=50, interval=2.0, max_pending=10000):
+        self.max_events = max_events
+        self.interval = interval
+        self.max_pending = max_pending
+        self._events = []
+        self._flushing = []  # taken by a flush that has not committed yet
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self.flushed = 0
+        self.flushes = 0
+        self.errors = 0
+        self.dropped = 0
+        self.last_error = None
+
+    def add(self, event):
+        """
+        Queue ``event``. Returns the earliest timestamp already waiting
+        (here or in a running flush) for the same user and day, or None.
+        """
+        with self._lock:
+            earlier = min(
+                (e.timestamp for e in self._flushing + self._events
+                 if e.user_id == event.user_id and e.date == event.date),
+                default=None,
+            )
+            self._events.append(event)
+            full = len(self._events) >= self.max_events
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="punch-flush", daemon=True)
+                self._thread.start()
+        if full:
+            self.flush()
+        return earlier
+
+    def flush(self):
+        """Write every waiting event now. Returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._events = self._events, []
+                self._flushing = batch
+            if not batch:
+                return 0
+            try:
+                write_events(batch)
+            except Exception as e:
+                # keep them for the next attempt, up to max_pending
+                batch = _retryable(batch)
+                with self._lock:
+                    events = batch + self._events
+                    overflow = max(0, len(events) - self.max_pending)
+                    self._events = events[overflow:]
+                    self._flushing = []
+                    self.errors += 1
+                    self.dropped += overflow
+                    self.last_error = f"{type(e).__name__}: {e}"
+                    pending = len(self._events)
+                print(f"Warning: could not write {len(batch)} punch events, {pending} pending:", e)
+                if overflow:
+                    print(f"Warning: dropped the {overflow} oldest punch events "
+                          f"(more than FACE_PUNCH_MAX_PENDING={self.max_pending} waiting)")
+                return 0
+            with self._lock:
+                self._flushing = []
+                self.flushed += len(batch)
+                self.flushes += 1
+            return len(batch)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            close_old_connections()
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._events) + len(self._flushing),
+                "max_events": self.max_events,
+                "max_pending": self.max_pending,
+                "interval": self.interval,
+                "flushed": self.flushed,
+                "flushes": self.flushes,
+                "errors": self.errors,
+                "dropped": self.dropped,
+                "last_error": self.last_error,
+            }
+
+
+def _retryable(events):
+    """Drop events of users deleted while they waited (they can never be written)."""
+    from .models import User
+
+    try:
+        alive = set(User.objects.filter(pk__in={e.user_id for e in events}).values_list("pk", flat=True))
+    except Exception:
+        return events
+    return [e for e in events if e.user_id in alive]
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_punch_buffer():
+    """The process-wide buffer, or None unless ``FACE_PUNCH_BUFFER_SIZE`` is set."""
+    global _buffer
+    if _buffer is None:
+        size = getattr(settings, "FACE_PUNCH_BUFFER_SIZE", 0)
+        if not size:
+            return None
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = PunchBuffer(
+                    max_events=size,
+                    interval=getattr(settings, "FACE_PUNCH_FLUSH_INTERVAL", 2.0),
+                    max_pending=getattr(settings, "FACE_PUNCH_MAX_PENDING", 10000),
+                )
+                atexit.register(_buffer.flush)
+    return _buffer
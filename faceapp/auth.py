@@ -1,16 +1,23 @@
 # faceapp/auth.py
 import jwt
 import datetime
+import hashlib
+import random
+import time
 from django.conf import settings
-from .models import User
+from django.db.models import Q
+from django.utils import timezone
+from .models import User, APIToken
 
 # Token lifetime (hours)
 ACCESS_TOKEN_HOURS = 24
 
-def create_token(user):
+def create_token(user, kiosk=None):
     """
     Create a JWT for the given user.
     Contains user_id and email, expires in ACCESS_TOKEN_HOURS.
+    ``kiosk`` ({"department": id} or {"location": name}) binds the token to
+    a site: face searches made with it are scoped to that shard first.
     """
     now = datetime.datetime.utcnow()
     exp = now + datetime.timedelta(hours=ACCESS_TOKEN_HOURS)
@@ -20,6 +27,8 @@ def create_token(user):
         "iat": now,
         "exp": exp
     }
+    if kiosk:
+        payload["kiosk"] = kiosk
     token = jwt.encode(payload, settings.SECRET_KEY, algorithm="HS256")
     # PyJWT >= 2.x returns a str; older returns bytes — ensure str
     if isinstance(token, bytes):
@@ -33,3 +42,40 @@ def decode_token(token):
     """
     payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
     return payload
+
+
+def token_digest(token):
+    """Fixed-size key for a token (cache keys, server-side lookups)."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def prune_tokens(batch_size=1000, max_batches=None, pause=0.0):
+    """
+    Delete expired and revoked APITokens in batches of ``batch_size`` rows,
+    each its own short statement, so no long lock is held on the table.
+    Returns the number of rows deleted.
+    """
+    deleted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        now = timezone.now()
+        ids = list(
+            APIToken.objects.filter(Q(expires_at__lt=now) | Q(revoked=True))
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        deleted += APIToken.objects.filter(id__in=ids).delete()[0]
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def maybe_prune_tokens():
+    """Called on login: now and then, delete one batch of dead tokens."""
+    if random.random() < getattr(settings, "FACE_TOKEN_PRUNE_PROBABILITY", 0.01):
+        try:
+            prune_tokens(batch_size=500, max_batches=1)
+        except Exception as e:
+            print("Warning: token pruning failed:", e)
@@ -0,0 +1,113 @@
+# faceapp/batching.py
+"""
+Dynamic micro-batching for model inference.
+
+Concurrent requests in one worker (gthread workers, ASGI) each call
+``MicroBatcher.submit()``. A single background thread collects whatever has
+queued up, up to ``max_batch_size`` items or ``max_wait_ms`` after the first
+one arrived, runs one batched call, and hands every caller its own result.
+"""
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    def __init__(self, fn, max_batch_size=8, max_wait_ms=10, name="micro-batcher"):
+        """``fn`` takes a list of items and returns a list of results in order."""
+        self._fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_depths = Counter()
+        self._requests = 0
+        self._batches = 0
+        self._errors = 0
+        self._wait_total = 0.0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item, timeout=None):
+        """Queue ``item`` and block until its result is ready."""
+        self._ensure_started()
+        fut = Future()
+        self._queue.put((item, fut, time.perf_counter()))
+        return fut.result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            with self._stats_lock:
+                self._batches += 1
+                self._requests += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._queue_depths[_bucket(self._queue.qsize())] += 1
+                self._wait_total += sum(started - queued for _, _, queued in batch)
+
+            try:
+                results = self._fn([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"batched call returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                with self._stats_lock:
+                    self._errors += 1
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut, _), result in zip(batch, results):
+                fut.set_result(result)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "queue_depth": self._queue.qsize(),
+                "requests": self._requests,
+                "batches": self._batches,
+                "errors": self._errors,
+                "avg_batch_size": round(self._requests / self._batches, 2) if self._batches else 0,
+                "avg_wait_ms": round(1000 * self._wait_total / self._requests, 2) if self._requests else 0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                # requests still queued when a batch was taken, bucketed
+                "queue_depth_histogram": {label: self._queue_depths[label] for label in _LABELS if label in self._queue_depths},
+            }
+
+
+_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+_LABELS = [f"<={upper}" for upper in _BUCKETS] + [f">{_BUCKETS[-1]}"]
+
+
+def _bucket(depth):
+    for upper, label in zip(_BUCKETS, _LABELS):
+        if depth <= upper:
+            return label
+    return _LABELS[-1]
@@ -0,0 +1,133 @@
+# faceapp/cache.py
+"""
+Bounded LRU/TTL cache of model output keyed by image content.
+
+Kiosks retry failed uploads and the replay tooling resubmits the same
+frames, so the same image bytes are often embedded more than once. Entries
+are keyed by a BLAKE2b digest of the decoded image bytes; optionally a
+64-bit difference hash (dHash) of the frame also catches re-encoded or
+slightly different copies of the same picture.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+
+def content_key(image_bytes):
+    return "b:" + hashlib.blake2b(image_bytes, digest_size=16).hexdigest()
+
+
+def perceptual_key(frame):
+    """dHash: compare neighbouring pixels of a 9x8 grayscale thumbnail."""
+    gray = cv2.cvtColor(np.ascontiguousarray(frame), cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return "p:" + np.packbits(bits).tobytes().hex()
+
+
+class EmbeddingCache:
+    def __init__(self, max_entries=512, ttl=300, use_perceptual_hash=False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.use_perceptual_hash = use_perceptual_hash
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _get(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < now:
+            del self._data[key]
+            self.expirations += 1
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def _put(self, key, value, now):
+        self._data[key] = (now + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, image_bytes, frame, compute):
+        """
+        Return the cached result for this image, or ``compute(frame)``
+        (stored under every key for the image). Results are shared between
+        callers and must not be mutated.
+        """
+        keys = [content_key(image_bytes)]
+        if self.use_perceptual_hash and frame is not None:
+            keys.append(perceptual_key(frame))
+
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                value = self._get(key, now)
+                if value is not None:
+                    self.hits += 1
+                    if key.startswith("p:"):
+                        self.perceptual_hits += 1
+                    return value
+            self.misses += 1
+
+        value = compute(frame)
+        if value:
+            with self._lock:
+                now = time.monotonic()
+                for key in keys:
+                    self._put(key, value, now)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "perceptual_hash": self.use_perceptual_hash,
+                "hits": self.hits,
+                "perceptual_hits": self.perceptual_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """The process-wide cache, or None when ``FACE_EMBEDDING_CACHE_SIZE`` is 0."""
+    global _cache
+    if _cache is None:
+        size = getattr(settings, "FACE_EMBEDDING_CACHE_SIZE", 512)
+        if not size:
+            return None
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache(
+                    max_entries=size,
+                    ttl=getattr(settings, "FACE_EMBEDDING_CACHE_TTL", 300),
+                    use_perceptual_hash=getattr(settings, "FACE_EMBEDDING_CACHE_PHASH", False),
+                )
+    return _cache
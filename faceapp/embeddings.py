@@ -0,0 +1,57 @@
+# faceapp/embeddings.py
+"""
+Helpers for the on-disk embedding format.
+
+Embeddings are stored in ``User.embedding`` as raw little-endian float32
+bytes, L2-normalised at write time, alongside their dimension and the name
+of the model that produced them. Reading one back is a zero-copy
+``np.frombuffer`` view over the column value.
+"""
+import hashlib
+
+import numpy as np
+
+EMBEDDING_DTYPE = np.dtype("<f4")
+MODEL_NAME = "Facenet"
+
+
+def normalize(vec):
+    """
+    Return ``vec`` as a unit-length float32 vector, or None if it is empty,
+    non-finite or all zeros.
+    """
+    arr = np.asarray(vec, dtype=np.float32).ravel()
+    if arr.size == 0 or not np.isfinite(arr).all():
+        return None
+    norm = np.linalg.norm(arr)
+    if norm == 0:
+        return None
+    return arr / norm
+
+
+def to_bytes(vec):
+    """Normalise ``vec`` and encode it for storage (None if invalid)."""
+    arr = normalize(vec)
+    if arr is None:
+        return None
+    return arr.astype(EMBEDDING_DTYPE, copy=False).tobytes()
+
+
+def from_bytes(buf, dim=None):
+    """
+    View stored bytes as a float32 vector without copying. The result is
+    read-only; returns None for empty or malformed values.
+    """
+    if not buf:
+        return None
+    if len(buf) % EMBEDDING_DTYPE.itemsize:
+        return None
+    arr = np.frombuffer(buf, dtype=EMBEDDING_DTYPE)
+    if dim is not None and arr.size != dim:
+        return None
+    return arr
+
+
+def photo_digest(data):
+    """SHA-256 of enrollment photo bytes, stored with the embedding it produced."""
+    return hashlib.sha256(data).hexdigest()
@@ -0,0 +1,352 @@
+# faceapp/enrollment.py
+"""
+Bulk enrollment: a CSV of people plus a zip archive or directory of photos.
+
+CSV columns (header row, case-insensitive): ``name``, ``email``, optional
+``department`` (id or name), ``photo`` (file name in the archive; default:
+the file whose name without extension is the email) and ``password``
+(default: the same as ``register_user``).
+
+``enroll`` validates every row, embeds the photos in parallel batches
+(one batched Facenet call per batch, ``workers`` batches at a time) and
+hashes passwords on the same thread pool, then creates the users with
+``bulk_create``, 500 per transaction together with their department
+counters and change-log entries. Rows that fail (bad data, duplicate
+email, unreadable photo, no face) are reported and skipped; the rest are
+imported. This process's gallery is synced once at the end.
+
+With ``queue=True`` (always, for ``/api/admin/enroll/``) photos are only
+checked to be readable images; the users are created with
+``embedding_status = pending`` and one ``EmbeddingJob`` each, in the same
+transaction, for ``run_embedding_worker``.
+
+Photos are read one at a time (or one embedding batch at a time per
+worker) and read again when they are stored, so memory does not grow
+with the archive. ``max_rows`` caps the CSV (``TooManyRows``); the
+endpoint uses ``FACE_ENROLL_MAX_ROWS`` and larger imports go through the
+``enroll_users`` command.
+
+Photo files are stored before their rows (the row holds the stored
+name); files of rows that are not committed, for any reason, are deleted
+again.
+"""
+import csv
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Lower
+
+from .embeddings import MODEL_NAME, photo_digest
+from .gallery import get_gallery, record_changes
+from .imaging import decode_image, image_size
+from .models import EMBEDDING_PENDING, Department, EmbeddingJob, User
+
+PHOTO_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+MAX_PHOTO_BYTES = 10 * 1024 * 1024
+
+
+class TooManyRows(ValueError):
+    """The CSV has more rows than the caller's ``max_rows``."""
+
+
+class PhotoSource:
+    """Photos by file name (case-insensitive, directories ignored) from a zip or a directory."""
+
+    def __init__(self, source):
+        self._zip = None
+        self._files = {}
+        if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+            for root, _, names in os.walk(source):
+                for name in names:
+                    self._files[name.lower()] = os.path.join(root, name)
+        else:
+            try:
+                self._zip = zipfile.ZipFile(source)
+            except zipfile.BadZipFile:
+                raise ValueError("photos must be a zip archive or a directory")
+            for info in self._zip.infolist():
+                if not info.is_dir():
+                    self._files[os.path.basename(info.filename).lower()] = info
+        self._stems = {}
+        for name in self._files:
+            stem, ext = os.path.splitext(name)
+            if ext in PHOTO_EXTENSIONS:
+                self._stems.setdefault(stem, name)
+
+    def find(self, photo, email):
+        """File name for a row: its ``photo`` column, else ``<email>.<ext>``."""
+        if photo:
+            name = os.path.basename(photo).lower()
+            return name if name in self._files else None
+        return self._stems.get(email.lower())
+
+    def read(self, name):
+        entry = self._files[name]
+        size = entry.file_size if self._zip is not None else os.path.getsize(entry)
+        if size > MAX_PHOTO_BYTES:
+            raise ValueError(f"photo larger than {MAX_PHOTO_BYTES // 2**20} MB")
+        if self._zip is not None:
+            return self._zip.read(entry)
+        with open(entry, "rb") as fh:
+            return fh.read()
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+def read_rows(csv_file):
+    """``(line, {column: value})`` for each CSV row; accepts a path, bytes or a file."""
+    if isinstance(csv_file, (str, os.PathLike)):
+        with open(csv_file, "rb") as fh:
+            data = fh.read()
+    elif isinstance(csv_file, bytes):
+        data = csv_file
+    else:
+        data = csv_file.read()
+    reader = csv.DictReader(io.StringIO(data.decode("utf-8-sig")))
+    if not reader.fieldnames or not {"name", "email"} <= {f.strip().lower() for f in reader.fieldnames}:
+        raise ValueError("CSV needs a header row with at least name and email columns")
+    for row in reader:
+        yield reader.line_num, {
+            (key or "").strip().lower(): (value or "").strip()
+            for key, value in row.items() if not isinstance(value, list)
+        }
+
+
+def embed_photos(items):
+    """
+    Runs on a worker thread. ``items`` are ``(key, bytes)``; returns
+    ``{key: (embedding or None, photo_digest, error or None)}``.
+    """
+    from .inference import represent, represent_batch
+
+    out, frames, keys = {}, [], []
+    for key, data in items:
+        try:
+            frames.append(decode_image(data))
+            keys.append(key)
+        except Exception as e:
+            out[key] = (None, "", f"could not decode photo: {e}")
+    if not frames:
+        return out
+    try:
+        reps = represent_batch(frames)
+    except Exception:
+        # find the bad photo instead of failing the whole batch
+        reps = []
+        for frame in frames:
+            try:
+                reps.append(represent(frame))
+            except Exception as e:
+                reps.append(e)
+    digests = dict(items)
+    for key, rep in zip(keys, reps):
+        digest = photo_digest(digests[key])
+        if isinstance(rep, Exception):
+            out[key] = (None, digest, f"{type(rep).__name__}: {rep}")
+        elif not rep or not isinstance(rep, list) or "embedding" not in rep[0]:
+            out[key] = (None, digest, "no face found in photo")
+        else:
+            out[key] = (rep[0]["embedding"], digest, None)
+    return out
+
+
+def _resolve_departments(values, create):
+    """Map CSV department values (id or name) to Department pks; unknown -> missing key."""
+    ids = {int(v) for v in values if v.isdigit()}
+    names = {v for v in values if v and not v.isdigit()}
+    found = {}
+    for pk in Department.objects.filter(pk__in=ids).values_list("pk", flat=True):
+        found[str(pk)] = pk
+    by_name = {}
+    for pk, name in Department.objects.values_list("pk", "department_name"):
+        by_name.setdefault(name.lower(), pk)
+    for name in names:
+        pk = by_name.get(name.lower())
+        if pk is None and create:
+            pk = Department.objects.create(department_name=name).pk
+            by_name[name.lower()] = pk
+        if pk is not None:
+            found[name] = pk
+    return found
+
+
+def enroll(csv_file, photos, create_departments=False, queue=False, workers=2, batch_size=32, max_rows=None,
+           log=print):
+    """
+    Import users from ``csv_file`` with photos from ``photos`` (zip path or
+    file object, or a directory). Returns ``{"created", "failed",
+    "user_ids", "failures": [{"line", "email", "error"}]}``. Raises
+    ``TooManyRows`` before any work if the CSV has more than ``max_rows``
+    rows.
+    """
+    failures = []
+
+    def fail(line, email, error):
+        failures.append({"line": line, "email": email, "error": error})
+
+    source = PhotoSource(photos)
+    try:
+        rows, seen = [], set()
+        for n, (line, row) in enumerate(read_rows(csv_file), 1):
+            if max_rows is not None and n > max_rows:
+                raise TooManyRows(f"at most {max_rows} rows per request; use the enroll_users command for more")
+            name, email = row.get("name", ""), row.get("email", "")
+            if not name or not email:
+                fail(line, email, "name and email are required")
+                continue
+            try:
+                validate_email(email)
+            except ValidationError:
+                fail(line, email, "invalid email")
+                continue
+            if email.lower() in seen:
+                fail(line, email, "duplicate email in CSV")
+                continue
+            seen.add(email.lower())
+            photo = source.find(row.get("photo"), email)
+            if photo is None:
+                fail(line, email, "photo not found in archive")
+                continue
+            rows.append({"line": line, "name": name, "email": email, "department": row.get("department", ""),
+                         "password": row.get("password") or email.split("@")[0] + "123", "photo": photo})
+
+        existing = set(
+            User.objects.annotate(email_lower=Lower("email"))
+            .filter(email_lower__in=[r["email"].lower() for r in rows]).values_list("email_lower", flat=True)
+        )
+        departments = _resolve_departments({r["department"] for r in rows}, create_departments)
+        valid = []
+        for r in rows:
+            if r["email"].lower() in existing:
+                fail(r["line"], r["email"], "user with this email already exists")
+            elif r["department"] and r["department"] not in departments:
+                fail(r["line"], r["email"], f"unknown department {r['department']!r}")
+            else:
+                valid.append(r)
+        log(f"{len(valid)} rows valid, {len(failures)} rejected; reading photos")
+
+        keys = []
+        if queue:
+            for i, r in enumerate(valid):
+                try:
+                    image_size(source.read(r["photo"]))  # readable image header
+                    keys.append(i)
+                except Exception as e:
+                    fail(r["line"], r["email"], f"could not read photo: {e}")
+        else:
+            keys = range(len(valid))
+
+        embedded = {}
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="enroll") as pool:
+            passwords = pool.map(make_password, [valid[i]["password"] for i in keys])
+            if not queue:
+                batches = [keys[n:n + batch_size] for n in range(0, len(keys), batch_size)]
+                pending = []
+                for n, batch in enumerate(batches, 1):
+                    items = []
+                    for i in batch:
+                        try:
+                            items.append((i, source.read(valid[i]["photo"])))
+                        except Exception as e:
+                            embedded[i] = (None, "", f"could not read photo: {e}")
+                    pending.append(pool.submit(embed_photos, items))
+                    # at most ``workers`` batches of photos in memory
+                    if len(pending) >= max(1, workers) or n == len(batches):
+                        for future in pending:
+                            embedded.update(future.result())
+                        pending = []
+                        log(f"embedded batch {n}/{len(batches)}")
+            passwords = dict(zip(keys, passwords))
+
+        photo_field = User._meta.get_field("photo")
+        users = []
+        for i in keys:
+            r = valid[i]
+            user = User(name=r["name"], email=r["email"], department_id=departments.get(r["department"]),
+                        password=passwords[i])
+            if queue:
+                user.embedding_status = EMBEDDING_PENDING
+            else:
+                embedding, digest, error = embedded[i]
+                if error or not user.set_embedding(embedding, model_name=MODEL_NAME, photo_hash=digest):
+                    fail(r["line"], r["email"], error or "DeepFace returned no embedding")
+                    continue
+            user._enroll_line = r["line"]
+            user._enroll_photo = r["photo"]
+            users.append(user)
+
+        created = []
+        try:
+            for user in users:
+                name = user._enroll_photo
+                user.photo = photo_field.storage.save(photo_field.generate_filename(user, name),
+                                                      ContentFile(source.read(name)))
+            _create_users(users, created, queue, fail)
+        finally:
+            committed = {id(u) for u in created}
+            for user in users:
+                if id(user) not in committed and user.photo:
+                    user.photo.storage.delete(user.photo.name)
+    finally:
+        source.close()
+    ids = [u.pk for u in created]
+    if created and not queue:
+        # one gallery refresh for the whole import
+        gallery = get_gallery()
+        if gallery.loaded:
+            gallery.sync()
+    failures.sort(key=lambda f: f["line"])
+    return {"created": len(created), "failed": len(failures), "user_ids": ids, "failures": failures}
+
+
+def _insert(users, queue):
+    """
+    Insert ``users`` with everything that depends on them, in the caller's
+    transaction: department counters (bulk_create skips ``User.save()``),
+    then an EmbeddingJob each (``queue``) or their change-log entries.
+    """
+    User.objects.bulk_create(users)
+    counts = {}
+    for u in users:
+        if u.department_id:
+            counts[u.department_id] = counts.get(u.department_id, 0) + 1
+    for department, n in sorted(counts.items()):
+        Department.objects.filter(pk=department).update(total_employees=F("total_employees") + n)
+    if queue:
+        EmbeddingJob.objects.bulk_create([EmbeddingJob(user_id=u.pk) for u in users])
+    else:
+        record_changes([u.pk for u in users])
+
+
+def _create_users(users, created, queue, fail):
+    """
+    Insert ``users`` 500 per transaction, appending the committed ones to
+    ``created``; if a batch collides with a concurrent insert, fall back
+    to one by one.
+    """
+    for n in range(0, len(users), 500):
+        batch = users[n:n + 500]
+        try:
+            with transaction.atomic():
+                _insert(batch, queue)
+            created.extend(batch)
+        except IntegrityError:
+            for user in batch:
+                user.pk = None
+                try:
+                    with transaction.atomic():
+                        _insert([user], queue)
+                    created.append(user)
+                except IntegrityError as e:
+                    user.pk = None
+                    fail(user._enroll_line, user.email, f"could not create user: {e}")
@@ -0,0 +1,107 @@
+# faceapp/exports.py
+"""
+Streaming CSV / JSON exports of users and attendance.
+
+Rows come from ``QuerySet.values_list().iterator(chunk_size=...)`` (a
+server-side cursor on Postgres) and are encoded into ~64 KB chunks as the
+response is sent, optionally through a streaming gzip compressor, so an
+export of millions of rows runs in constant memory.
+"""
+import csv
+import io
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import Attendance, User
+
+CHUNK_BYTES = 64 * 1024
+
+USER_HEADER = ["Name", "Email", "Department", "Created At"]
+ATTENDANCE_HEADER = ["Name", "Email", "Department", "Date", "Login Time", "Logout Time", "Working Hours"]
+
+
+def chunk_size():
+    return getattr(settings, "FACE_EXPORT_CHUNK_SIZE", 2000)
+
+
+def stamper():
+    """Formatter for aware datetimes in the current time zone (looked up once per export)."""
+    tz = timezone.get_current_timezone()
+    return lambda value: value.astimezone(tz).strftime("%Y-%m-%d %H:%M:%S") if value else ""
+
+
+def user_rows():
+    qs = (User.objects.order_by("pk")
+          .values_list("name", "email", "department__department_name", "created_at"))
+    local_stamp = stamper()
+    for name, email, department, created_at in qs.iterator(chunk_size=chunk_size()):
+        yield [name, email, department or "", local_stamp(created_at)]
+
+
+def attendance_rows(start, end, department=None):
+    qs = Attendance.objects.filter(date__range=(start, end))
+    if department is not None:
+        qs = qs.filter(user__department_id=department)
+    qs = qs.order_by("date", "user_id").values_list(
+        "user__name", "user__email", "user__department__department_name",
+        "date", "login_time", "logout_time", "working_hours",
+    )
+    local_stamp = stamper()
+    for name, email, department_name, day, login, logout, hours in qs.iterator(chunk_size=chunk_size()):
+        yield [name, email, department_name or "", day.isoformat(), local_stamp(login), local_stamp(logout),
+               "" if hours is None else hours]
+
+
+def csv_chunks(header, rows):
+    """CSV text of ``header`` + ``rows`` in chunks of about CHUNK_BYTES."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= CHUNK_BYTES:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def json_chunks(header, rows):
+    """A JSON array of ``{header: value}`` objects, in chunks."""
+    parts = ["["]
+    size = 1
+    first = True
+    for row in rows:
+        item = json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder)
+        parts.append(item if first else "," + item)
+        first = False
+        size += len(item) + 1
+        if size >= CHUNK_BYTES:
+            yield "".join(parts)
+            parts, size = [], 0
+    parts.append("]")
+    yield "".join(parts)
+
+
+def encode(chunks, compress=False):
+    """UTF-8 bytes of ``chunks``, gzip-compressed on the fly if ``compress``."""
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode("utf-8")
+        return
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        data = gz.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield gz.flush()
+
+
+FORMATS = {
+    "csv": (csv_chunks, "text/csv; charset=utf-8"),
+    "json": (json_chunks, "application/json"),
+}
@@ -0,0 +1,756 @@
+# faceapp/gallery.py
+"""
+Process-wide in-memory gallery of enrolled face embeddings.
+
+Every enrolled embedding is kept as one row of a single L2-normalised
+float32 matrix, with a parallel array of user ids. Identifying a probe is
+then one matrix-vector product plus a top-k selection, instead of loading
+and decoding every User row on each recognition request.
+
+With ``FACE_ANN_ENABLED`` the rows live in an IVF index (faceapp/ann.py)
+instead, and a search only scores the closest ``FACE_ANN_NPROBE`` cells.
+
+Searches can be scoped to a shard of the company, ``("department", id)``
+or ``("location", name)``: a kiosk in one building then only scores that
+building's staff. Shards are small, so each is a brute-force matrix read
+on first use and dropped when a user it holds, or who now belongs to its
+department or location, changes (or the department itself is saved).
+
+With ``FACE_GALLERY_QUANTIZATION`` ("float16" or "int8") the brute-force
+matrix is kept compact (faceapp/quantization.py) and scored directly;
+no float32 copy of it is kept.
+
+Every write that affects a gallery row is also logged as an
+``EmbeddingChange`` once its transaction commits. Each process polls the
+log at most every ``FACE_GALLERY_SYNC_INTERVAL`` seconds and applies only
+the changed users, so registrations and recomputes made by other workers
+(or the embedding worker) show up without reloading the gallery.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from .ann import IVFIndex
+from .embeddings import EMBEDDING_DTYPE, MODEL_NAME, normalize
+from .quantization import QuantizedMatrix, search_quantized
+from .snapshot import current_version, load_snapshot, snapshot_dir, snapshot_enabled
+
+
+def ann_enabled():
+    return getattr(settings, "FACE_ANN_ENABLED", False)
+
+
+def ann_index_path():
+    return getattr(settings, "FACE_ANN_INDEX_PATH", os.path.join(settings.MEDIA_ROOT, "ann_index.npz"))
+
+
+def ann_nprobe():
+    return getattr(settings, "FACE_ANN_NPROBE", 8)
+
+
+def quantization():
+    return getattr(settings, "FACE_GALLERY_QUANTIZATION", "") or None
+
+
+def sync_interval():
+    return getattr(settings, "FACE_GALLERY_SYNC_INTERVAL", 2)
+
+
+# more pending changes than this and a full reload is cheaper
+SYNC_MAX_CHANGES = 5000
+
+# Counter row holding the version of the newest EmbeddingChange
+CHANGE_COUNTER = "embedding-changes"
+
+
+def latest_change_version():
+    """Version of the newest committed change; every lower version is committed too."""
+    from .models import read_counter
+    return read_counter(CHANGE_COUNTER)
+
+
+def changes_missing(since):
+    """True if log entries after ``since`` may have been pruned already."""
+    from .models import EmbeddingChange
+    oldest = EmbeddingChange.objects.order_by("version").values_list("version", flat=True).first()
+    return oldest is not None and oldest > since + 1
+
+
+def record_changes(user_ids):
+    """
+    Log that the gallery rows of ``user_ids`` changed, for other processes.
+    All of them get the next version of ``CHANGE_COUNTER``, which stays
+    locked until the transaction commits: a version is only ever handed
+    out after every lower one is visible, so a worker that has applied up
+    to version N never misses a change that commits later.
+    Call it after the data change committed (``transaction.on_commit``) to
+    keep the lock short.
+    """
+    from .models import EmbeddingChange, bump_counter
+
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    with transaction.atomic():
+        version = bump_counter(CHANGE_COUNTER)
+        EmbeddingChange.objects.bulk_create(
+            [EmbeddingChange(user_id=user_id, version=version) for user_id in user_ids], batch_size=1000)
+
+
+def prune_changes(days=None):
+    """Delete change log entries older than ``FACE_EMBEDDING_CHANGE_RETENTION_DAYS``."""
+    import datetime
+    from django.utils import timezone
+    from .models import EmbeddingChange
+
+    days = getattr(settings, "FACE_EMBEDDING_CHANGE_RETENTION_DAYS", 7) if days is None else days
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    return EmbeddingChange.objects.filter(created_at__lt=cutoff).delete()[0]
+
+
+def enrolled_users():
+    """Users whose stored embedding the gallery can use."""
+    from .models import User
+    return User.objects.filter(embedding__isnull=False, embedding_model=MODEL_NAME)
+
+
+SCOPE_KINDS = ("department", "location")
+
+
+def scope_filter(scope):
+    """``User`` filter kwargs for a ``(kind, value)`` search scope."""
+    kind, value = scope
+    if kind == "department":
+        return {"department_id": value}
+    if kind == "location":
+        return {"department__location": value}
+    raise ValueError(f"unknown search scope {kind!r}")
+
+
+def read_embeddings(qs):
+    """
+    Read ``(ids, matrix)`` for the users in ``qs``. Rows are normalised at
+    write time, so the matrix is one join + frombuffer over the raw column
+    values. Rows whose dimension differs from the first one are skipped.
+    """
+    ids, chunks = [], []
+    dim = None
+    for user_id, raw, raw_dim in qs.values_list("id", "embedding", "embedding_dim").iterator(chunk_size=2000):
+        if not raw or not raw_dim:
+            continue
+        if dim is None:
+            dim = raw_dim
+        if raw_dim != dim or len(raw) != dim * EMBEDDING_DTYPE.itemsize:
+            continue
+        ids.append(user_id)
+        chunks.append(raw)
+
+    if not chunks:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+    matrix = np.frombuffer(b"".join(chunks), dtype=EMBEDDING_DTYPE).reshape(len(ids), dim)
+    return np.asarray(ids, dtype=np.int64), matrix
+
+
+def build_ann_index(nlist=None, iters=20):
+    """Train an IVF index on every enrolled embedding."""
+    # read the log position first: changes racing with the read are replayed
+    change_version = latest_change_version()
+    ids, matrix = read_embeddings(enrolled_users())
+    if not len(ids):
+        return None
+    index = IVFIndex.train(matrix, nlist=nlist, nprobe=ann_nprobe(), iters=iters)
+    index.add(ids, matrix)
+    index.change_version = change_version
+    return index
+
+
+def load_ann_index():
+    """
+    Load the persisted index and bring it in line with the User table:
+    users whose embedding changed since it was built (per the change log)
+    are re-read, users enrolled since are added, removed users dropped.
+    Falls back to training a fresh index when no file exists or the change
+    log no longer covers its version.
+    """
+    from .models import EmbeddingChange
+
+    path = ann_index_path()
+    if not os.path.exists(path):
+        print("Gallery: no ANN index at", path, "- training one (run build_ann_index to persist it)")
+        return build_ann_index()
+
+    index = IVFIndex.load(path, nprobe=ann_nprobe())
+    since = index.change_version
+    changes = EmbeddingChange.objects.filter(version__gt=since)
+    if since < 0 or changes_missing(since) or changes.count() > SYNC_MAX_CHANGES:
+        print(f"Gallery: ANN index at {path} is too old to catch up - training one (run build_ann_index)")
+        return build_ann_index()
+
+    changed = set(changes.values_list("user_id", flat=True))
+    for user_id in changed:
+        index.remove(user_id)
+    db_ids = set(enrolled_users().values_list("id", flat=True))
+    for user_id in [i for i in index.ids() if i not in db_ids]:
+        index.remove(user_id)
+    missing = [i for i in db_ids if i not in index]
+    for start in range(0, len(missing), 2000):
+        ids, matrix = read_embeddings(enrolled_users().filter(id__in=missing[start:start + 2000]))
+        if len(ids) and matrix.shape[1] == index.dim:
+            index.add(ids, matrix)
+    return index
+
+
+def _to_distances(sims):
+    # |a - b|^2 = 2 - 2 a.b for unit vectors
+    return np.sqrt(np.clip(2.0 - 2.0 * np.asarray(sims), 0.0, None))
+
+
+def _compact(matrix):
+    """The base for a float32 ``matrix``: quantized, or itself when quantization is off."""
+    kind = quantization()
+    if kind is None or not len(matrix):
+        return matrix
+    return QuantizedMatrix.encode(matrix, kind)
+
+
+def _exact_search(ids, matrix, qs, k, hidden=None):
+    """
+    Top-``k`` of normalised probes ``qs`` against ``matrix`` with one
+    product. Rows flagged in ``hidden`` are skipped.
+    """
+    results = [[] for _ in qs]
+    valid = [i for i, q in enumerate(qs) if q is not None and len(ids) and q.size == matrix.shape[1]]
+    if not valid:
+        return results
+
+    if isinstance(matrix, QuantizedMatrix):
+        top_ids, top_sims = search_quantized(ids, matrix, np.stack([qs[i] for i in valid]), k, hidden)
+        for i, user_ids, sims in zip(valid, top_ids, top_sims):
+            results[i] = [(user_id, float(d)) for user_id, d in zip(user_ids, _to_distances(sims))]
+        return results
+
+    sims = np.stack([qs[i] for i in valid]) @ matrix.T
+    if hidden is not None:
+        sims[:, hidden] = -np.inf
+    k = min(k, len(ids))
+    if k < len(ids):
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(len(ids)), (len(valid), len(ids)))
+    top_sims = np.take_along_axis(sims, top, axis=1)
+    order = np.argsort(-top_sims, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    top_sims = np.take_along_axis(top_sims, order, axis=1)
+    dists = _to_distances(top_sims)
+    for row, i in enumerate(valid):
+        results[i] = [(int(ids[j]), float(d)) for j, d, s in zip(top[row], dists[row], top_sims[row]) if s > -np.inf]
+    return results
+
+
+_EMPTY_IDS = np.empty(0, dtype=np.int64)
+_EMPTY_MATRIX = np.empty((0, 0), dtype=np.float32)
+
+# the overlay is folded into the base once it holds more than this many
+# live rows, or more than OVERLAY_COMPACT_RATIO of the base
+OVERLAY_COMPACT_MIN = 1024
+OVERLAY_COMPACT_RATIO = 0.25
+
+
+class _State:
+    """
+    One immutable gallery generation: the ``ids``/``matrix`` base (possibly
+    a read-only snapshot mapping, or a QuantizedMatrix), a ``hidden`` mask
+    of base rows that were replaced or removed since, and the overlay of
+    float32 rows written since: the first ``extra_count`` rows of the
+    ``extra_ids``/``extra_matrix``/``extra_hidden`` buffers.
+
+    The overlay buffers have spare capacity and are shared with the next
+    generation, which appends past ``extra_count``; rows a generation can
+    see are never written again (hiding one copies ``extra_hidden``), so
+    appends need no copy.
+    """
+    __slots__ = ("ids", "matrix", "hidden", "extra_ids", "extra_matrix", "extra_hidden", "extra_count",
+                 "version", "change_version")
+
+    def __init__(self, ids=_EMPTY_IDS, matrix=_EMPTY_MATRIX, hidden=None,
+                 extra_ids=_EMPTY_IDS, extra_matrix=_EMPTY_MATRIX, extra_hidden=None, extra_count=0,
+                 version=None, change_version=0):
+        self.ids = ids
+        self.matrix = matrix
+        self.hidden = hidden
+        self.extra_ids = extra_ids
+        self.extra_matrix = extra_matrix
+        self.extra_hidden = extra_hidden
+        self.extra_count = extra_count
+        self.version = version
+        # last EmbeddingChange version the base reflects
+        self.change_version = change_version
+
+    def replace(self, **changes):
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return _State(**fields)
+
+    @property
+    def overlay(self):
+        """``(ids, matrix, hidden)`` of the overlay rows this generation sees."""
+        n = self.extra_count
+        if not n:
+            return _EMPTY_IDS, _EMPTY_MATRIX, None
+        return self.extra_ids[:n], self.extra_matrix[:n], self.extra_hidden[:n]
+
+    @property
+    def overlay_live(self):
+        n = self.extra_count
+        return n - int(self.extra_hidden[:n].sum()) if n else 0
+
+    def __len__(self):
+        hidden = int(self.hidden.sum()) if self.hidden is not None else 0
+        return len(self.ids) - hidden + self.overlay_live
+
+    @property
+    def dim(self):
+        if len(self.ids):
+            return self.matrix.shape[1]
+        if self.extra_count:
+            return self.extra_matrix.shape[1]
+        return None
+
+
+def _hide(mask, size, rows):
+    """Copy of ``mask`` (None = nothing hidden) with ``rows`` set."""
+    mask = np.zeros(size, dtype=bool) if mask is None else mask.copy()
+    mask[rows] = True
+    return mask
+
+
+def _compact_overlay(state):
+    """Fold the live overlay rows into a new base without the hidden rows."""
+    keep = np.flatnonzero(~state.hidden) if state.hidden is not None else np.arange(len(state.ids))
+    extra_ids, extra_matrix, extra_hidden = state.overlay
+    live = np.flatnonzero(~extra_hidden) if extra_hidden is not None else _EMPTY_IDS
+    ids = np.concatenate([state.ids[keep], extra_ids[live]])
+    if isinstance(state.matrix, QuantizedMatrix):
+        matrix = QuantizedMatrix.concatenate([
+            state.matrix.take(keep), QuantizedMatrix.encode(extra_matrix[live], state.matrix.kind)])
+    elif len(keep):
+        matrix = np.concatenate([state.matrix[keep], extra_matrix[live]])
+    else:
+        matrix = _compact(extra_matrix[live].copy())
+    return _State(ids, matrix, version=state.version, change_version=state.change_version)
+
+
+class EmbeddingGallery:
+    """
+    Holds a base ``ids`` (int64, shape N) / ``matrix`` (float32, shape N x D)
+    pair plus a small overlay of rows written since it was loaded.
+
+    Readers take a reference to the current ``_State`` and never see it
+    mutated: writers hide the old base row and append to the overlay, then
+    swap the new state in under a lock, so brute-force search needs no
+    locking and the base (e.g. a shared snapshot mapping) is never copied.
+    Once the overlay outgrows ``OVERLAY_COMPACT_MIN`` rows (or a quarter of
+    the base) it is folded into a new base; snapshot bases are left to the
+    next snapshot instead, so their pages stay shared.
+    The IVF index is mutated in place, so in ANN mode search and writes
+    share the lock.
+
+    With ``FACE_GALLERY_SNAPSHOT`` the base is the current snapshot from
+    faceapp/snapshot.py, mapped read-only, and a newer snapshot is picked
+    up at most ``FACE_GALLERY_SNAPSHOT_CHECK`` seconds after it appears.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = _State()
+        self._rows = None  # see _row_maps
+        self._index = None
+        self._loaded = False
+        # scope -> (ids, matrix); the generation guards against storing a
+        # shard read that raced with an invalidation
+        self._shards = {}
+        self._generation = 0
+        self._snapshot_checked = 0.0
+        self._synced_version = 0
+        self._synced_at = 0.0
+        self._sync_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def version(self):
+        return self._state.version
+
+    @property
+    def synced_version(self):
+        return self._synced_version
+
+    def __len__(self):
+        if self._index is not None:
+            return len(self._index)
+        return len(self._state)
+
+    def _read_snapshot(self):
+        """``_State`` over the current snapshot, or None if unusable."""
+        from .models import EmbeddingChange
+
+        snap = load_snapshot()
+        if snap is None:
+            print("Gallery: no snapshot in", snapshot_dir(), "- reading embeddings from the database")
+            return None
+        meta, ids, matrix = snap
+        change_version = meta.get("change_version", 0)
+        # the change log must still cover everything written since
+        if changes_missing(change_version) or \
+                EmbeddingChange.objects.filter(version__gt=change_version).count() > SYNC_MAX_CHANGES:
+            print(f"Gallery: snapshot {meta['version']} is too old to catch up, reading the database "
+                  "(run write_gallery_snapshot)")
+            return None
+        # pages are shared with other workers: quantising would copy them
+        return _State(ids, matrix, version=meta["version"], change_version=change_version)
+
+    def load(self):
+        """(Re)build the whole gallery from the snapshot or the User table."""
+        # read the log position first: changes racing with the read are replayed
+        change_version = latest_change_version()
+        index = None
+        state = None
+        if ann_enabled():
+            index = load_ann_index()
+        elif snapshot_enabled():
+            state = self._read_snapshot()
+        if state is None:
+            state = _State(change_version=change_version)
+            if index is None:
+                ids, matrix = read_embeddings(enrolled_users())
+                state = _State(ids, _compact(matrix), change_version=change_version)
+
+        with self._lock:
+            self._state = state
+            self._rows = None
+            self._index = index
+            self._loaded = True
+            self._synced_version = state.change_version
+            self._synced_at = time.monotonic()
+            self._snapshot_checked = time.monotonic()
+            self._invalidate_shards()
+        if state.change_version < change_version:
+            self.sync()
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+            return
+        if snapshot_enabled() and self._index is None:
+            self._check_snapshot()
+        interval = sync_interval()
+        if interval is not None and time.monotonic() - self._synced_at >= interval:
+            self.sync()
+
+    def sync(self):
+        """
+        Apply gallery changes logged since the last load/sync: re-read just
+        those users' rows and upsert or remove them. Returns the number of
+        users applied; falls back to a full reload if the log has gaps or
+        too many entries.
+        """
+        from .models import EmbeddingChange
+
+        if not self._sync_lock.acquire(blocking=False):
+            return 0  # another thread is already syncing
+        try:
+            self._synced_at = time.monotonic()
+            since = self._synced_version
+            changes = list(
+                EmbeddingChange.objects.filter(version__gt=since).order_by("version")
+                .values_list("version", "user_id")[:SYNC_MAX_CHANGES + 1]
+            )
+            if not changes:
+                return 0
+            if len(changes) > SYNC_MAX_CHANGES or changes_missing(since):
+                print(f"Gallery: {len(changes)}+ changes since {since}, reloading")
+                self._sync_lock.release()
+                try:
+                    self.load()
+                finally:
+                    self._sync_lock.acquire()
+                return len(changes)
+
+            user_ids = {user_id for _, user_id in changes}
+            ids, matrix = read_embeddings(enrolled_users().filter(id__in=user_ids))
+            self.apply(upserts=dict(zip(ids.tolist(), matrix)), removals=user_ids - set(ids.tolist()))
+            self._synced_version = changes[-1][0]
+            return len(user_ids)
+        finally:
+            self._sync_lock.release()
+
+    def _check_snapshot(self):
+        """Reload when ``CURRENT`` names a newer snapshot than the one mapped."""
+        now = time.monotonic()
+        if now - self._snapshot_checked < getattr(settings, "FACE_GALLERY_SNAPSHOT_CHECK", 5):
+            return
+        self._snapshot_checked = now
+        version = current_version()
+        if version is not None and version != self._state.version:
+            print(f"Gallery: switching to snapshot {version}")
+            self.load()
+
+    def _invalidate_shards(self):
+        self._shards = {}
+        self._generation += 1
+
+    def invalidate_users(self, user_ids):
+        """
+        Drop the cached shards ``user_ids`` were in or now belong to (by
+        their current department and its location); the rest stay.
+        """
+        from .models import User
+
+        if not self._shards:
+            return
+        user_ids = np.fromiter((int(user_id) for user_id in user_ids), dtype=np.int64)
+        scopes = {scope for scope, (ids, _) in list(self._shards.items()) if np.isin(user_ids, ids).any()}
+        for department_id, location in User.objects.filter(id__in=user_ids.tolist()) \
+                .values_list("department_id", "department__location"):
+            if department_id is not None:
+                scopes.add(("department", department_id))
+            if location:
+                scopes.add(("location", location))
+        with self._lock:
+            for scope in scopes:
+                self._shards.pop(scope, None)
+            # a shard read in flight may predate the change
+            self._generation += 1
+
+    def shard(self, scope):
+        """``(ids, matrix)`` of the users in ``scope``, read on first use."""
+        state = self._shards.get(scope)
+        if state is not None:
+            return state
+        generation = self._generation
+        state = read_embeddings(enrolled_users().filter(**scope_filter(scope)))
+        with self._lock:
+            if generation == self._generation:
+                self._shards[scope] = state
+        return state
+
+    def upsert(self, user_id, embedding):
+        """
+        Insert or replace one user's embedding. A gallery that has not been
+        loaded yet is left alone: it will pick the row up when it loads.
+        """
+        self.apply(upserts={user_id: embedding})
+
+    def remove(self, user_id):
+        self.apply(removals=[user_id])
+
+    def apply(self, upserts=None, removals=()):
+        """
+        Insert or replace ``upserts`` (``{user_id: embedding}``) and drop
+        ``removals`` as one new generation: replaced rows are hidden and the
+        new ones appended to the overlay, whose buffers grow geometrically,
+        so applying N changes costs O(N) plus one mask copy per call.
+        """
+        # membership may have changed too (e.g. department moves)
+        self.invalidate_users(set(upserts or ()) | set(removals))
+        if not self._loaded:
+            return
+        removals = {int(user_id) for user_id in removals}
+        vecs = {}
+        for user_id, embedding in (upserts or {}).items():
+            vec = normalize(embedding)
+            if vec is None:
+                removals.add(int(user_id))
+            else:
+                vecs[int(user_id)] = vec
+                removals.discard(int(user_id))
+
+        with self._lock:
+            if self._index is not None:
+                for user_id in removals:
+                    self._index.remove(user_id)
+                for user_id, vec in vecs.items():
+                    if vec.size == self._index.dim:
+                        self._index.add([user_id], vec[None, :])
+                return
+
+            state = self._state
+            dim = state.dim
+            for user_id, vec in list(vecs.items()):
+                dim = vec.size if dim is None else dim
+                if vec.size != dim:
+                    print("Gallery: ignoring embedding with mismatched dimension for user", user_id)
+                    del vecs[user_id]
+
+            base_rows, extra_rows = self._row_maps(state)
+            touched = set(vecs) | removals
+            rows = [base_rows[user_id] for user_id in touched if user_id in base_rows]
+            if isinstance(state.matrix, np.ndarray):
+                # an unchanged base row stays where it is
+                unchanged = {row for row in rows if np.array_equal(state.matrix[row], vecs.get(int(state.ids[row])))}
+                for row in unchanged:
+                    del vecs[int(state.ids[row])]
+                rows = [row for row in rows if row not in unchanged]
+            stale = [user_id for user_id in touched if user_id in extra_rows]
+            if not rows and not stale and not vecs:
+                return
+
+            changes = {}
+            if rows:
+                changes["hidden"] = _hide(state.hidden, len(state.ids), rows)
+            if stale or vecs:
+                changes.update(self._overlay_with(state, dim, [extra_rows[u] for u in stale], vecs))
+            state = state.replace(**changes)
+
+            for row in rows:
+                del base_rows[int(state.ids[row])]
+            for user_id in stale:
+                del extra_rows[user_id]
+            extra_rows.update((user_id, state.extra_count - len(vecs) + i) for i, user_id in enumerate(vecs))
+
+            if state.version is None and state.overlay_live > max(OVERLAY_COMPACT_MIN,
+                                                                  OVERLAY_COMPACT_RATIO * len(state.ids)):
+                state = _compact_overlay(state)
+                self._rows = None
+            self._state = state
+
+    def _row_maps(self, state):
+        """
+        Writer-side ``{user_id: row}`` maps of the visible base and overlay
+        rows of the current generation, so a change does not scan the base.
+        Built once per base and kept current by ``apply``.
+        """
+        if self._rows is None or self._rows[0] is not state.ids:
+            hidden = state.hidden
+            base_rows = {user_id: row for row, user_id in enumerate(state.ids.tolist())
+                         if hidden is None or not hidden[row]}
+            extra_ids, _, extra_hidden = state.overlay
+            extra_rows = {user_id: row for row, user_id in enumerate(extra_ids.tolist()) if not extra_hidden[row]}
+            self._rows = (state.ids, base_rows, extra_rows)
+        return self._rows[1], self._rows[2]
+
+    @staticmethod
+    def _overlay_with(state, dim, stale, vecs):
+        """
+        Overlay buffer fields with the rows ``stale`` hidden and ``vecs``
+        appended after ``state.extra_count``. The buffers are reallocated at
+        twice the size when full; otherwise only a hide copies (the mask).
+        """
+        n, k = state.extra_count, len(vecs)
+        extra_ids, extra_matrix, extra_hidden = state.extra_ids, state.extra_matrix, state.extra_hidden
+        if n + k > len(extra_ids) or extra_matrix.shape[1] != dim:
+            capacity = max(16, 2 * (n + k))
+            extra_ids = np.empty(capacity, dtype=np.int64)
+            extra_matrix = np.empty((capacity, dim), dtype=np.float32)
+            extra_hidden = np.zeros(capacity, dtype=bool)
+            if n:
+                extra_ids[:n] = state.extra_ids[:n]
+                extra_matrix[:n] = state.extra_matrix[:n]
+                extra_hidden[:n] = state.extra_hidden[:n]
+        elif stale:
+            extra_hidden = extra_hidden.copy()
+        extra_hidden[stale] = True
+        if k:
+            extra_ids[n:n + k] = list(vecs)
+            extra_matrix[n:n + k] = np.stack(list(vecs.values()))
+            extra_hidden[n:n + k] = False
+        return {"extra_ids": extra_ids, "extra_matrix": extra_matrix, "extra_hidden": extra_hidden,
+                "extra_count": n + k}
+
+    def search(self, query, k=5, scope=None):
+        """
+        Return up to ``k`` ``(user_id, distance)`` pairs, nearest first.
+
+        ``distance`` is the euclidean distance between unit vectors, which
+        is what the recognition threshold is expressed in.
+        """
+        return self.search_batch([query], k, scope)[0]
+
+    def search_batch(self, queries, k=5, scope=None):
+        """
+        ``search()`` for several probes at once: the brute-force path scores
+        all of them with a single matrix product. Invalid probes (None,
+        zero, wrong dimension) get an empty result. With a ``scope`` only
+        that shard is searched (always exactly).
+        """
+        self.ensure_loaded()
+        qs = [normalize(q) if q is not None else None for q in queries]
+
+        if scope is not None:
+            ids, matrix = self.shard(tuple(scope))
+            return _exact_search(ids, matrix, qs, k)
+
+        if self._index is not None:
+            results = []
+            with self._lock:
+                for q in qs:
+                    if q is None or q.size != self._index.dim:
+                        results.append([])
+                        continue
+                    hits = self._index.search(q, k)
+                    dists = _to_distances([s for _, s in hits])
+                    results.append([(user_id, float(d)) for (user_id, _), d in zip(hits, dists)])
+            return results
+
+        state = self._state
+        results = _exact_search(state.ids, state.matrix, qs, k, state.hidden)
+        if state.extra_count:
+            extra = _exact_search(*state.overlay[:2], qs, k, state.overlay[2])
+            results = [sorted(a + b, key=lambda c: c[1])[:k] for a, b in zip(results, extra)]
+        return results
+
+
+_gallery = EmbeddingGallery()
+
+
+def get_gallery():
+    return _gallery
+
+
+def embedding_changed(user):
+    """
+    After ``user.embedding`` was written: once the transaction commits, log
+    the change and patch this process's gallery. A rolled-back write does
+    neither.
+    """
+    user_id = user.pk
+    vec = user.get_embedding()
+    if user.embedding_model != MODEL_NAME:
+        vec = None
+    transaction.on_commit(lambda: _changed(user_id, vec))
+
+
+def department_changed(department_id):
+    """
+    After a Department row was saved (its location may have moved): once
+    the transaction commits, log its users as changed so every process
+    drops the shards they were in or now belong to.
+    """
+    def changed():
+        user_ids = list(enrolled_users().filter(department_id=department_id).values_list("id", flat=True))
+        record_changes(user_ids)
+        _gallery.invalidate_users(user_ids)
+
+    transaction.on_commit(changed)
+
+
+def embedding_removed(user_id):
+    transaction.on_commit(lambda: _changed(user_id, None))
+
+
+def _changed(user_id, vec):
+    record_changes([user_id])
+    if vec is None:
+        _gallery.remove(user_id)
+    else:
+        _gallery.upsert(user_id, vec)
@@ -0,0 +1,84 @@
+# faceapp/imaging.py
+"""
+Shared image decode stage for recognition requests.
+
+Webcam frames arrive at full resolution, but Facenet only ever sees a
+160x160 face crop. ``decode_image`` therefore decodes straight into a BGR
+array no larger than ``FACE_DECODE_MAX_SIDE``: for JPEG, OpenCV's
+``IMREAD_REDUCED_*`` flags let libjpeg scale by 1/2, 1/4 or 1/8 during the
+DCT, so the full-size bitmap is never materialised and there is no separate
+RGB->BGR copy.
+"""
+import io
+
+import cv2
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+_REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+# request bodies with these content types are the image itself
+BINARY_CONTENT_TYPES = ("image/", "application/octet-stream")
+
+
+def max_side():
+    return getattr(settings, "FACE_DECODE_MAX_SIDE", 640)
+
+
+def image_size(data):
+    """(width, height) from the image header, without decoding pixels."""
+    with Image.open(io.BytesIO(data)) as img:
+        return img.size
+
+
+def reduction_factor(size, limit):
+    """Largest power of two (up to 8) that keeps the longest side >= ``limit``."""
+    longest = max(size)
+    factor = 1
+    while factor < 8 and longest // (factor * 2) >= limit:
+        factor *= 2
+    return factor
+
+
+def decode_image(data, limit=None):
+    """
+    Decode encoded image bytes into a BGR uint8 array whose longest side is
+    at most ``limit`` (default ``FACE_DECODE_MAX_SIDE``; 0 = full size).
+    Raises ValueError if the bytes are not a readable image.
+    """
+    limit = max_side() if limit is None else limit
+    if not data:
+        raise ValueError("empty image")
+
+    try:
+        size = image_size(data)
+    except Exception:
+        raise ValueError("unrecognised image format")
+
+    factor = reduction_factor(size, limit) if limit else 1
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), _REDUCED_FLAGS[factor])
+    if frame is None:
+        # formats OpenCV was built without: let PIL decode (draft mode
+        # gives the same DCT scaling for JPEG)
+        with Image.open(io.BytesIO(data)) as img:
+            if limit:
+                img.draft("RGB", (limit, limit))
+            rgb = np.asarray(img.convert("RGB"))
+        frame = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+    h, w = frame.shape[:2]
+    if limit and max(h, w) > limit:
+        scale = limit / float(max(h, w))
+        frame = cv2.resize(frame, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    return frame
+
+
+def is_binary_request(request):
+    content_type = (request.content_type or "").lower()
+    return content_type.startswith(BINARY_CONTENT_TYPES)
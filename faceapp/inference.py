@@ -0,0 +1,190 @@
+# faceapp/inference.py
+"""
+Single entry point for running the face recognition model.
+
+Views, models and management commands call ``represent()`` here instead of
+``DeepFace.represent`` directly, so model loading and warm-up happen in one
+place. ``warm_up()`` builds the Facenet model and runs a dummy inference so
+the first real request on a worker does not pay for loading TensorFlow.
+
+With ``FACE_INFERENCE_SOCKET`` set, the model and gallery live in the
+inference service (faceapp/inference_service.py) and these functions are
+thin RPC calls; DeepFace/TensorFlow are then never imported here.
+"""
+import importlib.util
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .batching import MicroBatcher
+from .embeddings import MODEL_NAME
+
+# checked without importing: importing deepface loads TensorFlow
+HAS_DEEPFACE = (
+    bool(getattr(settings, "FACE_INFERENCE_SOCKET", None))
+    or importlib.util.find_spec("deepface") is not None
+)
+
+# True inside inference service processes, which must run the model locally
+_serving = False
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+_warm_lock = threading.Lock()
+_warm_thread = None
+_ready = threading.Event()
+_status = {"state": "cold", "error": None, "seconds": None}
+
+
+def _deepface():
+    from deepface import DeepFace
+    return DeepFace
+
+
+def set_serving():
+    global _serving
+    _serving = True
+
+
+def remote_enabled():
+    return not _serving and bool(getattr(settings, "FACE_INFERENCE_SOCKET", None))
+
+
+def _remote(op, *args):
+    from .inference_service import get_client
+    return get_client().call(op, *args)
+
+
+def represent(img):
+    """
+    Run Facenet on one image (BGR array or path). Returns DeepFace's list of
+    ``{"embedding", "facial_area", "face_confidence"}`` dicts, one per face.
+
+    With ``FACE_BATCHING_ENABLED``, array inputs are queued on the
+    micro-batcher and share a forward pass with concurrent requests.
+    """
+    if remote_enabled():
+        return _remote("represent", img)
+    if batching_enabled() and isinstance(img, np.ndarray):
+        return get_batcher().submit(img)
+    return _deepface().represent(img, model_name=MODEL_NAME, enforce_detection=False)
+
+
+def represent_batch(images):
+    """
+    Run Facenet on several images with a single batched forward pass.
+    Returns one list of face dicts per input image, in order.
+    """
+    if not images:
+        return []
+    if remote_enabled():
+        return _remote("represent_batch", list(images))
+    reps = _deepface().represent(list(images), model_name=MODEL_NAME, enforce_detection=False)
+    # DeepFace unwraps the outer list for a single image
+    return [reps] if len(images) == 1 else reps
+
+
+def search(embeddings, k=5, scope=None):
+    """Gallery ``search_batch`` wherever the gallery lives."""
+    if remote_enabled():
+        return _remote("search", [np.asarray(e, dtype=np.float32) if e is not None else None for e in embeddings], k, scope)
+    from .gallery import get_gallery
+    return get_gallery().search_batch(embeddings, k, scope)
+
+
+def batching_enabled():
+    return getattr(settings, "FACE_BATCHING_ENABLED", False)
+
+
+def get_batcher():
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(
+                    represent_batch,
+                    max_batch_size=getattr(settings, "FACE_BATCH_MAX_SIZE", 8),
+                    max_wait_ms=getattr(settings, "FACE_BATCH_MAX_WAIT_MS", 10),
+                    name="face-inference-batcher",
+                )
+    return _batcher
+
+
+def batching_stats():
+    return _batcher.stats() if _batcher is not None else None
+
+
+def warm_up():
+    """
+    Build the model and push a dummy frame through detection and Facenet
+    so TensorFlow traces its graph. Also loads the embedding gallery.
+    Safe to call more than once; only the first call does the work.
+
+    Against a remote inference service this only waits until it answers.
+    """
+    if remote_enabled():
+        _status["state"] = "waiting for inference service"
+        while not _ready.is_set():
+            try:
+                _remote("ping")
+            except Exception as e:
+                _status["error"] = str(e)
+                time.sleep(1)
+                continue
+            _status.update(state="ready", error=None)
+            _ready.set()
+        return True
+    if not HAS_DEEPFACE:
+        _status.update(state="unavailable", error="DeepFace not installed")
+        return False
+    with _warm_lock:
+        if _ready.is_set():
+            return True
+        _status["state"] = "warming"
+        start = time.perf_counter()
+        try:
+            _deepface().build_model(MODEL_NAME)
+            represent(np.zeros((160, 160, 3), dtype=np.uint8))
+
+            from .gallery import get_gallery
+            get_gallery().ensure_loaded()
+        except Exception as e:
+            _status.update(state="failed", error=str(e))
+            print("Model warm-up failed:", e)
+            return False
+        _status.update(state="ready", error=None, seconds=round(time.perf_counter() - start, 2))
+        _ready.set()
+        print(f"Model warm-up finished in {_status['seconds']}s")
+        return True
+
+
+def start_warm_up():
+    """Run ``warm_up()`` in a daemon thread so worker boot is not blocked."""
+    global _warm_thread
+    with _warm_lock:
+        if _warm_thread is not None or _ready.is_set():
+            return
+        _warm_thread = threading.Thread(target=warm_up, name="face-warm-up", daemon=True)
+    _warm_thread.start()
+
+
+def warm_up_enabled():
+    return getattr(settings, "FACE_WARMUP_ON_START", False)
+
+
+def is_ready():
+    """
+    Whether this worker should receive recognition traffic. When warm-up is
+    neither enabled nor started (e.g. plain runserver) there is nothing to
+    wait for, so the worker counts as ready.
+    """
+    if _ready.is_set():
+        return True
+    return not warm_up_enabled() and _warm_thread is None
+
+
+def status():
+    return dict(_status, ready=is_ready())
@@ -0,0 +1,227 @@
+# faceapp/inference_service.py
+"""
+Out-of-process inference service.
+
+``python manage.py run_inference_server`` starts a fixed number of
+inference processes that own TensorFlow, the Facenet model and the
+embedding gallery. Django workers talk to them over a Unix socket (or TCP
+on platforms without one) with ``multiprocessing.connection``, so HTTP
+workers stay small and never block on model loading.
+
+Set ``FACE_INFERENCE_SOCKET`` and ``faceapp.inference`` routes
+``represent``/``represent_batch``/``search`` through ``InferenceClient``.
+"""
+import hashlib
+import os
+import signal
+import threading
+import time
+from multiprocessing import get_context
+from multiprocessing.connection import Client, Listener
+
+from django.conf import settings
+
+
+class InferenceError(Exception):
+    """Raised in the client when the service reports a failure."""
+
+
+def service_address():
+    """
+    ``FACE_INFERENCE_SOCKET`` as a ``multiprocessing.connection`` address:
+    a filesystem path for a Unix socket, or ``host:port`` for TCP.
+    """
+    address = getattr(settings, "FACE_INFERENCE_SOCKET", None)
+    if not address:
+        return None
+    if not address.startswith("/") and ":" in address:
+        host, port = address.rsplit(":", 1)
+        return (host, int(port))
+    return address
+
+
+def service_authkey():
+    # both sides share the Django secret; pickled messages from anyone
+    # else are refused during the handshake
+    return hashlib.sha256(b"faceapp-inference:" + settings.SECRET_KEY.encode()).digest()
+
+
+# ---------------------------
+# Client (Django workers)
+# ---------------------------
+class InferenceClient:
+    """One persistent connection per thread, reopened once on failure."""
+
+    def __init__(self, address, authkey, timeout=30):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.address, authkey=self.authkey)
+            self._local.conn = conn
+        return conn
+
+    def _drop(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def call(self, op, *args):
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.send((op, args))
+                answered = conn.poll(self.timeout)
+                if answered:
+                    ok, result = conn.recv()
+            except (EOFError, OSError):
+                # stale connection (service restarted): reconnect once
+                self._drop()
+                if attempt:
+                    raise
+                continue
+            if not answered:
+                self._drop()
+                raise TimeoutError(f"inference service did not answer {op!r} within {self.timeout}s")
+            break
+        if not ok:
+            raise InferenceError(result)
+        return result
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = InferenceClient(
+                    service_address(),
+                    service_authkey(),
+                    timeout=getattr(settings, "FACE_INFERENCE_TIMEOUT", 30),
+                )
+    return _client
+
+
+# ---------------------------
+# Server (inference processes)
+# ---------------------------
+def _handle_connection(conn):
+    from django.db import close_old_connections
+    from . import inference
+    from .gallery import get_gallery
+
+    ops = {
+        "ping": lambda: os.getpid(),
+        "represent": inference.represent,
+        "represent_batch": inference.represent_batch,
+        "search": inference.search,
+        "status": lambda: dict(inference.status(), pid=os.getpid(), gallery_size=len(get_gallery())),
+    }
+    try:
+        while True:
+            try:
+                op, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            # the gallery syncs itself from the change log on search
+            close_old_connections()
+            try:
+                fn = ops[op]
+            except KeyError:
+                conn.send((False, f"unknown operation {op!r}"))
+                continue
+            try:
+                conn.send((True, fn(*args)))
+            except Exception as e:
+                conn.send((False, f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def _worker_main(listener, cpus):
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            print(f"Inference worker: could not pin to CPUs {sorted(cpus)}: {e}")
+        # size TensorFlow's pools to the pinned cores before it is imported
+        os.environ.setdefault("TF_NUM_INTRAOP_THREADS", str(len(cpus)))
+        os.environ.setdefault("TF_NUM_INTEROP_THREADS", "1")
+        os.environ.setdefault("OMP_NUM_THREADS", str(len(cpus)))
+
+    from . import inference
+    inference.set_serving()
+    inference.warm_up()
+
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            # failed handshakes (bad authkey, port scanners) end up here
+            print("Inference worker: rejected connection:", e)
+            continue
+        threading.Thread(target=_handle_connection, args=(conn,), daemon=True).start()
+
+
+def split_cpus(cpus, workers):
+    """Spread ``cpus`` over ``workers`` as evenly as possible (empty = no pinning)."""
+    if not cpus:
+        return [None] * workers
+    return [set(cpus[i::workers]) or None for i in range(workers)]
+
+
+def serve(address, workers=1, cpus=None, log=print):
+    """
+    Bind ``address`` and keep ``workers`` inference processes accepting on
+    it, restarting any that die. Blocks until SIGINT/SIGTERM.
+    """
+    from django.db import connections
+
+    if isinstance(address, str) and os.path.exists(address):
+        os.unlink(address)
+    listener = Listener(address, authkey=service_authkey())
+    # children must not inherit live DB connections
+    connections.close_all()
+
+    ctx = get_context("fork")
+    plan = split_cpus(cpus, workers)
+    procs = {}
+
+    def spawn(slot):
+        p = ctx.Process(target=_worker_main, args=(listener, plan[slot]), name=f"inference-{slot}", daemon=True)
+        p.start()
+        procs[slot] = p
+        log(f"inference worker {slot} pid={p.pid} cpus={sorted(plan[slot]) if plan[slot] else 'any'}")
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    for slot in range(workers):
+        spawn(slot)
+    try:
+        while not stopping:
+            time.sleep(1)
+            for slot, p in list(procs.items()):
+                if not p.is_alive() and not stopping:
+                    log(f"inference worker {slot} exited with {p.exitcode}, restarting")
+                    spawn(slot)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs.values():
+            p.terminate()
+        for p in procs.values():
+            p.join(5)
+        listener.close()
@@ -0,0 +1,121 @@
+# faceapp/jobs.py
+"""
+DB-backed queue of embedding jobs.
+
+Saving a user with a new photo only inserts an ``EmbeddingJob`` row and
+marks ``User.embedding_status`` pending; ``python manage.py
+run_embedding_worker`` claims pending jobs in batches (``SELECT ... FOR
+UPDATE SKIP LOCKED`` on Postgres, so several workers can run), embeds the
+photos with one batched Facenet call, and saves the results, which also
+patches the in-memory gallery of that process.
+
+With ``FACE_EMBEDDING_ASYNC = False`` jobs run inline on save instead,
+for development setups without a worker.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .embeddings import photo_digest
+from .imaging import decode_image
+
+
+def async_enabled():
+    return getattr(settings, "FACE_EMBEDDING_ASYNC", True)
+
+
+def enqueue_embedding(user):
+    """Queue an embedding job for ``user`` unless one is already waiting."""
+    from .models import EmbeddingJob
+
+    if EmbeddingJob.objects.filter(user=user, status=EmbeddingJob.PENDING).exists():
+        return None
+    if async_enabled():
+        return EmbeddingJob.objects.create(user=user)
+    job = EmbeddingJob.objects.create(user=user, status=EmbeddingJob.RUNNING, attempts=1, started_at=timezone.now())
+    run_jobs([job])
+    return job
+
+
+def claim_jobs(limit=16):
+    """
+    Atomically take up to ``limit`` jobs: pending ones, plus running ones
+    whose worker has not finished them within ``FACE_EMBEDDING_JOB_TIMEOUT``
+    seconds (it probably died).
+    """
+    from .models import EmbeddingJob
+
+    now = timezone.now()
+    stale = now - datetime.timedelta(seconds=getattr(settings, "FACE_EMBEDDING_JOB_TIMEOUT", 600))
+    with transaction.atomic():
+        jobs = list(
+            EmbeddingJob.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=EmbeddingJob.PENDING) | Q(status=EmbeddingJob.RUNNING, started_at__lt=stale))
+            .order_by("id")[:limit]
+        )
+        for job in jobs:
+            job.status = EmbeddingJob.RUNNING
+            job.attempts += 1
+            job.started_at = now
+        EmbeddingJob.objects.bulk_update(jobs, ["status", "attempts", "started_at"])
+    return jobs
+
+
+def _finish(job, user, error=None):
+    from .models import EMBEDDING_FAILED, EmbeddingJob
+
+    job.finished_at = timezone.now()
+    if error is None:
+        job.status = EmbeddingJob.DONE
+        job.last_error = ""
+    else:
+        job.last_error = error
+        retry = job.attempts < getattr(settings, "FACE_EMBEDDING_JOB_MAX_ATTEMPTS", 3)
+        job.status = EmbeddingJob.PENDING if retry else EmbeddingJob.FAILED
+        if not retry and user is not None:
+            user.embedding_status = EMBEDDING_FAILED
+            user.save(update_fields=["embedding_status"])
+        print(f"Embedding job {job.pk} for user {job.user_id} failed (attempt {job.attempts}):", error)
+    job.save(update_fields=["status", "last_error", "finished_at"])
+
+
+def run_jobs(jobs):
+    """Embed the photos of ``jobs`` in one batched call and store the results."""
+    from .inference import represent_batch
+    from .models import User
+
+    users = User.objects.in_bulk([job.user_id for job in jobs])
+    frames, pending = [], []
+    for job in jobs:
+        user = users.get(job.user_id)
+        if user is None or not user.photo:
+            _finish(job, user, "user has no photo")
+            continue
+        try:
+            with open(user.photo.path, "rb") as fh:
+                data = fh.read()
+            frames.append(decode_image(data))
+            pending.append((job, user, photo_digest(data)))
+        except Exception as e:
+            _finish(job, user, f"could not read photo: {e}")
+
+    if not frames:
+        return
+    try:
+        reps = represent_batch(frames)
+    except Exception as e:
+        for job, user, _ in pending:
+            _finish(job, user, f"{type(e).__name__}: {e}")
+        return
+
+    for (job, user, digest), rep in zip(pending, reps):
+        embedding = rep[0].get("embedding") if rep and isinstance(rep, list) else None
+        if embedding is None or not user.set_embedding(embedding, photo_hash=digest):
+            _finish(job, user, "DeepFace returned no embedding")
+            continue
+        # saving the embedding fields patches this process's gallery
+        user.save(update_fields=User.EMBEDDING_FIELDS)
+        _finish(job, user)
@@ -0,0 +1,76 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from faceapp.ann import IVFIndex
+from faceapp.gallery import enrolled_users, read_embeddings
+
+
+def synthetic_gallery(n, dim, rng):
+    """
+    Unit vectors grouped around random "identity" centres, so the
+    neighbourhood structure looks like real face embeddings rather than
+    uniform noise (on which every ANN method degrades to brute force).
+    """
+    centres = rng.standard_normal((max(1, n // 50), dim)).astype(np.float32)
+    vectors = centres[rng.integers(len(centres), size=n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class Command(BaseCommand):
+    help = "Measure ANN recall and latency against exact brute-force search"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='use N synthetic embeddings instead of the enrolled gallery')
+        parser.add_argument('--dim', type=int, default=128)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--nlist', type=int, default=None)
+        parser.add_argument('--nprobe', default='1,2,4,8,16,32',
+                            help='comma-separated nprobe values to sweep')
+        parser.add_argument('--noise', type=float, default=0.06,
+                            help='per-dimension probe noise (0.06 ~ cosine 0.8 to the enrolled vector)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        if options['synthetic']:
+            matrix = synthetic_gallery(options['synthetic'], options['dim'], rng)
+            ids = np.arange(len(matrix), dtype=np.int64)
+        else:
+            ids, matrix = read_embeddings(enrolled_users())
+        if not len(ids):
+            self.stdout.write(self.style.WARNING('No embeddings to benchmark (try --synthetic 100000)'))
+            return
+
+        k = min(options['k'], len(ids))
+        # probes: gallery vectors with noise, like a new photo of an enrolled face
+        picks = rng.integers(len(matrix), size=options['queries'])
+        queries = matrix[picks] + options['noise'] * rng.standard_normal((len(picks), matrix.shape[1])).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        start = time.perf_counter()
+        index = IVFIndex.train(matrix, nlist=options['nlist'])
+        index.add(ids, matrix)
+        self.stdout.write(f"{len(ids)} vectors, dim {matrix.shape[1]}, nlist {index.nlist}, "
+                          f"build {time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        exact = []
+        for q in queries:
+            sims = matrix @ q
+            top = np.argpartition(-sims, k - 1)[:k] if k < len(sims) else np.arange(len(sims))
+            exact.append(ids[top[np.argsort(-sims[top])]])
+        exact_ms = 1000 * (time.perf_counter() - start) / len(queries)
+        self.stdout.write(f"{'exact':>8}  recall@1 1.000  recall@{k} 1.000  {exact_ms:8.3f} ms/query")
+
+        for nprobe in [int(x) for x in options['nprobe'].split(',') if x]:
+            start = time.perf_counter()
+            results = [index.search(q, k, nprobe=nprobe) for q in queries]
+            ms = 1000 * (time.perf_counter() - start) / len(queries)
+            r1 = np.mean([bool(res) and res[0][0] == ex[0] for res, ex in zip(results, exact)])
+            rk = np.mean([len({i for i, _ in res} & set(ex.tolist())) / k for res, ex in zip(results, exact)])
+            self.stdout.write(f"{'nprobe=' + str(nprobe):>8}  recall@1 {r1:.3f}  recall@{k} {rk:.3f}  "
+                              f"{ms:8.3f} ms/query  ({exact_ms / ms:.1f}x)")
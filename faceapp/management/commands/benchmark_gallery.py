@@ -0,0 +1,80 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from faceapp.gallery import enrolled_users, read_embeddings
+from faceapp.management.commands.benchmark_ann import synthetic_gallery
+from faceapp.quantization import BLOCK_ROWS, KINDS, QuantizedMatrix, search_quantized
+
+
+class Command(BaseCommand):
+    help = "Compare float32 / float16 / int8 gallery memory, latency and accuracy against exact search"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, default=0,
+                            help='use N synthetic embeddings instead of the enrolled gallery')
+        parser.add_argument('--dim', type=int, default=128)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--noise', type=float, default=0.06,
+                            help='per-dimension probe noise (0.06 ~ cosine 0.8 to the enrolled vector)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        if options['synthetic']:
+            matrix = synthetic_gallery(options['synthetic'], options['dim'], rng)
+            ids = np.arange(len(matrix), dtype=np.int64)
+        else:
+            ids, matrix = read_embeddings(enrolled_users())
+        if not len(ids):
+            self.stdout.write(self.style.WARNING('No embeddings to benchmark (try --synthetic 100000)'))
+            return
+
+        n, dim = matrix.shape
+        k = min(options['k'], n)
+        picks = rng.integers(n, size=options['queries'])
+        queries = matrix[picks] + options['noise'] * rng.standard_normal((len(picks), dim)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        # exact reference, one probe at a time like recognize_face_from_frame
+        start = time.perf_counter()
+        exact_ids, exact_sims = [], []
+        for q in queries:
+            sims = matrix @ q
+            top = np.argpartition(-sims, k - 1)[:k] if k < n else np.arange(n)
+            top = top[np.argsort(-sims[top])]
+            exact_ids.append(ids[top].tolist())
+            exact_sims.append(sims[top])
+        exact_ms = 1000 * (time.perf_counter() - start) / len(queries)
+
+        # everything a worker keeps per layout: the ids plus the matrix (the
+        # quantized gallery keeps no float32 copy), and the float32 block
+        # converted while scoring
+        per_100k = 100000 / n
+        self.stdout.write(f"{n} vectors, dim {dim}, {len(queries)} queries, k={k}")
+        self.stdout.write(f"{'layout':>8}  {'MB/worker':>9}  {'MB/100k':>8}  {'ms/query':>9}  "
+                          f"{'r@1':>6}  r@{k:<4}  max |d - exact|")
+        resident = ids.nbytes + matrix.nbytes
+        self.stdout.write(f"{'float32':>8}  {resident / 2**20:9.2f}  {resident * per_100k / 2**20:8.2f}  "
+                          f"{exact_ms:9.3f}  {1.0:6.3f}  {1.0:5.3f}  0")
+
+        for kind in KINDS:
+            compact = QuantizedMatrix.encode(matrix, kind)
+            resident = ids.nbytes + compact.nbytes + min(BLOCK_ROWS, n) * dim * 4
+
+            start = time.perf_counter()
+            results = [search_quantized(ids, compact, q[None, :], k) for q in queries]
+            ms = 1000 * (time.perf_counter() - start) / len(queries)
+
+            got_ids = [r[0][0] for r in results]
+            got_sims = [r[1][0] for r in results]
+            r1 = np.mean([bool(g) and g[0] == ex[0] for g, ex in zip(got_ids, exact_ids)])
+            rk = np.mean([len(set(g) & set(ex)) / k for g, ex in zip(got_ids, exact_ids)])
+            # distance error of the reported best match
+            to_dist = lambda s: np.sqrt(np.clip(2.0 - 2.0 * s, 0.0, None))
+            err = max(abs(float(to_dist(g[0]) - to_dist(e[0]))) for g, e in zip(got_sims, exact_sims) if len(g))
+
+            self.stdout.write(f"{kind:>8}  {resident / 2**20:9.2f}  {resident * per_100k / 2**20:8.2f}  "
+                              f"{ms:9.3f}  {r1:6.3f}  {rk:5.3f}  {err:.2e}")
@@ -0,0 +1,33 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from faceapp.gallery import ann_index_path, build_ann_index
+
+
+class Command(BaseCommand):
+    help = "Train the approximate nearest-neighbour index over all enrolled embeddings and save it"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nlist', type=int, default=None,
+                            help='number of IVF cells (default ~4*sqrt(N))')
+        parser.add_argument('--iters', type=int, default=20, help='k-means iterations')
+        parser.add_argument('--output', default=None, help='index file (default FACE_ANN_INDEX_PATH)')
+
+    def handle(self, *args, **options):
+        path = options['output'] or ann_index_path()
+        start = time.perf_counter()
+        index = build_ann_index(nlist=options['nlist'], iters=options['iters'])
+        if index is None:
+            self.stdout.write(self.style.WARNING('No enrolled embeddings, nothing to index'))
+            return
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = path + '.tmp'
+        index.save(tmp)
+        os.replace(tmp, path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {len(index)} embeddings into {index.nlist} cells in "
+            f"{time.perf_counter() - start:.1f}s -> {path}"
+        ))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from faceapp.enrollment import enroll
+from faceapp.inference import HAS_DEEPFACE
+
+
+class Command(BaseCommand):
+    help = "Bulk-enroll users from a CSV (name, email, department[, photo, password]) and a zip/directory of photos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv', help='CSV file with a header row')
+        parser.add_argument('photos', help='zip archive or directory of photos')
+        parser.add_argument('--create-departments', action='store_true',
+                            help='create departments named in the CSV that do not exist yet')
+        parser.add_argument('--queue', action='store_true',
+                            help='leave embeddings to run_embedding_worker instead of computing them now')
+        parser.add_argument('--workers', type=int, default=2, help='photo batches embedded concurrently')
+        parser.add_argument('--batch-size', type=int, default=32, help='photos per Facenet call')
+
+    def handle(self, *args, **options):
+        if not options['queue'] and not HAS_DEEPFACE:
+            raise CommandError('DeepFace not installed (use --queue to leave embeddings to the worker)')
+        started = time.perf_counter()
+        try:
+            result = enroll(
+                options['csv'], options['photos'],
+                create_departments=options['create_departments'], queue=options['queue'],
+                workers=options['workers'], batch_size=max(1, options['batch_size']), log=self.stdout.write,
+            )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for failure in result['failures']:
+            self.stdout.write(self.style.WARNING(f"line {failure['line']} {failure['email']}: {failure['error']}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result['created']} users, {result['failed']} rows failed "
+            f"in {time.perf_counter() - started:.1f}s"
+        ))
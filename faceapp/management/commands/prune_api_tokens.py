@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from faceapp.auth import prune_tokens
+
+
+class Command(BaseCommand):
+    help = "Delete expired and revoked API tokens in small batches (safe to run from cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows deleted per statement')
+        parser.add_argument('--pause', type=float, default=0.05, help='seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        deleted = prune_tokens(batch_size=options['batch_size'], pause=options['pause'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} expired/revoked tokens in {time.perf_counter() - start:.1f}s"
+        ))
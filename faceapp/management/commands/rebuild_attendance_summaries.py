@@ -0,0 +1,39 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from faceapp.models import Attendance
+from faceapp.summaries import rebuild, recount_employees
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily/monthly attendance summary tables and Department.total_employees"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', help='first date (YYYY-MM-DD); default: first attendance')
+        parser.add_argument('--to', dest='end', help='last date (YYYY-MM-DD); default: today')
+
+    def parse(self, value, name):
+        try:
+            return datetime.date.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f"--{name} must be YYYY-MM-DD")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        end = self.parse(options['end'], 'to') if options['end'] else timezone.localdate()
+        if options['start']:
+            start = self.parse(options['start'], 'from')
+        else:
+            start = Attendance.objects.order_by('date').values_list('date', flat=True).first() or end
+        if start > end:
+            raise CommandError("--from must not be after --to")
+
+        written = rebuild(start, end, log=self.stdout.write)
+        departments = recount_employees()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {start:%Y-%m} .. {end:%Y-%m}: {written} summary rows, "
+            f"{departments} department counters corrected in {time.perf_counter() - started:.1f}s"
+        ))
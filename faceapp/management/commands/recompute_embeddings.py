@@ -1,38 +1,177 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
+
+from faceapp.embeddings import MODEL_NAME, photo_digest
+from faceapp.gallery import record_changes
+from faceapp.imaging import decode_image
+from faceapp.inference import HAS_DEEPFACE, represent, represent_batch
 from faceapp.models import User
-from PIL import Image
-import numpy as np
-import json
 
-try:
-    from deepface import DeepFace
-    HAS_DEEPFACE = True
-except Exception:
-    HAS_DEEPFACE = False
+
+def first_embedding(rep):
+    if not rep or not isinstance(rep, list) or 'embedding' not in rep[0]:
+        return None
+    return rep[0]['embedding']
+
+
+def embed_batch(rows, force=False):
+    """
+    Runs on a worker thread (no DB access). ``rows`` are
+    ``(pk, photo_path, photo_hash, embedding_model, has_embedding)`` tuples;
+    returns ``(pk, status, embedding, photo_hash)`` per row where status is
+    updated / unchanged / no_photo / no_embedding / error.
+    """
+    results, frames, pending = [], [], []
+    for pk, path, old_hash, model, has_embedding in rows:
+        if not path:
+            results.append((pk, 'no_photo', None, ''))
+            continue
+        try:
+            with open(path, 'rb') as fh:
+                data = fh.read()
+            digest = photo_digest(data)
+            if not force and has_embedding and model == MODEL_NAME and digest == old_hash:
+                results.append((pk, 'unchanged', None, digest))
+                continue
+            frames.append(decode_image(data))
+            pending.append((pk, digest))
+        except Exception as e:
+            results.append((pk, 'error', str(e), ''))
+
+    if frames:
+        try:
+            reps = represent_batch(frames)
+        except Exception:
+            # find the bad photo instead of failing the whole batch
+            reps = []
+            for frame in frames:
+                try:
+                    reps.append(represent(frame))
+                except Exception as e:
+                    reps.append(e)
+        for (pk, digest), rep in zip(pending, reps):
+            if isinstance(rep, Exception):
+                results.append((pk, 'error', str(rep), digest))
+                continue
+            embedding = first_embedding(rep)
+            results.append((pk, 'updated' if embedding is not None else 'no_embedding', embedding, digest))
+    return results
 
 
 class Command(BaseCommand):
-    help = "Recompute face embeddings for all users from their photo files"
+    help = "Recompute face embeddings from user photos (only photos that changed since the last run)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='batches embedded concurrently (match the inference service worker count)')
+        parser.add_argument('--batch-size', type=int, default=32, help='photos per Facenet call and per bulk_update')
+        parser.add_argument('--force', action='store_true', help='re-embed even if the photo hash and model are unchanged')
+        parser.add_argument('--checkpoint', default=os.path.join(settings.MEDIA_ROOT, 'recompute_embeddings.json'),
+                            help='file recording the last finished user id')
+        parser.add_argument('--resume', action='store_true', help='continue after the id in --checkpoint')
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as fh:
+                state = json.load(fh)
+        except (OSError, ValueError):
+            return 0
+        if state.get('model') != MODEL_NAME:
+            self.stdout.write(self.style.WARNING(f"checkpoint is for model {state.get('model')!r}, starting over"))
+            return 0
+        return int(state.get('last_id') or 0)
+
+    def write_checkpoint(self, path, last_id):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump({'model': MODEL_NAME, 'last_id': last_id}, fh)
+        os.replace(tmp, path)
 
     def handle(self, *args, **options):
         if not HAS_DEEPFACE:
             self.stdout.write(self.style.ERROR('DeepFace not installed'))
             return
 
-        users = User.objects.all()
-        for u in users:
-            if not u.photo:
-                self.stdout.write(f"skip {u.id} no photo")
-                continue
-            try:
-                img = Image.open(u.photo.path).convert('RGB')
-                frame = np.array(img)[:, :, ::-1]
-                rep = DeepFace.represent(frame, model_name='Facenet', enforce_detection=False)
-                if rep and isinstance(rep, list) and 'embedding' in rep[0]:
-                    u.embedding = json.dumps(rep[0]['embedding'])
-                    u.save(update_fields=['embedding'])
-                    self.stdout.write(f"updated {u.id} {u.email}")
-                else:
-                    self.stdout.write(f"no embedding for {u.id}")
-            except Exception as e:
-                self.stdout.write(f"error for {u.id}: {e}")
+        workers = max(1, options['workers'])
+        batch_size = max(1, options['batch_size'])
+        checkpoint = options['checkpoint']
+        start_after = self.read_checkpoint(checkpoint) if options['resume'] else 0
+        if start_after:
+            self.stdout.write(f"resuming after user id {start_after}")
+
+        qs = (User.objects.filter(pk__gt=start_after).order_by('pk')
+              .values_list('pk', 'photo', 'photo_hash', 'embedding_model', 'embedding_dim'))
+        total = qs.count()
+
+        def rows():
+            batch = []
+            for pk, photo, digest, model, dim in qs.iterator(chunk_size=2000):
+                path = os.path.join(settings.MEDIA_ROOT, photo) if photo else None
+                batch.append((pk, path, digest, model, dim is not None))
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        counts = dict.fromkeys(['updated', 'unchanged', 'no_photo', 'no_embedding', 'error'], 0)
+        done = 0
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recompute') as pool:
+            in_flight = deque()
+            batches = rows()
+            exhausted = False
+            while True:
+                # keep a couple of batches queued per worker, not the whole table
+                while not exhausted and len(in_flight) < workers * 2:
+                    try:
+                        batch = next(batches)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    in_flight.append((batch[-1][0], pool.submit(embed_batch, batch, options['force'])))
+                if not in_flight:
+                    break
+
+                # finish batches in id order so the checkpoint never skips one
+                last_id, future = in_flight.popleft()
+                changed = []
+                for pk, status, value, digest in future.result():
+                    counts[status] += 1
+                    if status == 'updated':
+                        u = User(pk=pk)
+                        if u.set_embedding(value, photo_hash=digest):
+                            changed.append(u)
+                    elif status == 'error':
+                        self.stdout.write(f"error for {pk}: {value}")
+                if changed:
+                    User.objects.bulk_update(changed, User.EMBEDDING_FIELDS)
+                    # bulk_update skips save(): tell the running workers
+                    record_changes([u.pk for u in changed])
+                self.write_checkpoint(checkpoint, last_id)
+
+                done = sum(counts.values())
+                elapsed = time.perf_counter() - started
+                rate = done / elapsed if elapsed else 0
+                eta = (total - done) / rate if rate else 0
+                self.stdout.write(
+                    f"[{done}/{total}] updated={counts['updated']} unchanged={counts['unchanged']} "
+                    f"errors={counts['error']} {rate:.1f} photos/s eta {eta:.0f}s"
+                )
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {done} users in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.1f}/s): "
+            + ", ".join(f"{k}={v}" for k, v in counts.items())
+        ))
+        if counts['updated']:
+            self.stdout.write("Embeddings changed: running workers pick them up from the change log; "
+                              "rebuild the ANN index (build_ann_index) / snapshot when convenient.")
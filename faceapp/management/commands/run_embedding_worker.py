@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from faceapp.inference import HAS_DEEPFACE
+from faceapp.jobs import claim_jobs, run_jobs
+
+
+class Command(BaseCommand):
+    help = "Process queued embedding jobs (new or changed user photos)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=16, help='jobs claimed and embedded per Facenet call')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='seconds to sleep when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='exit when the queue is empty')
+
+    def handle(self, *args, **options):
+        if not HAS_DEEPFACE:
+            self.stdout.write(self.style.ERROR('DeepFace not installed'))
+            return
+
+        processed = 0
+        self.stdout.write("embedding worker started")
+        try:
+            while True:
+                close_old_connections()
+                jobs = claim_jobs(options['batch_size'])
+                if not jobs:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                start = time.perf_counter()
+                run_jobs(jobs)
+                processed += len(jobs)
+                self.stdout.write(f"embedded {len(jobs)} photos in {time.perf_counter() - start:.2f}s ({processed} total)")
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} embedding jobs"))
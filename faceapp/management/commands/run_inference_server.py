@@ -0,0 +1,50 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from faceapp.inference_service import serve, service_address
+
+
+def parse_cpus(spec):
+    """'0-3,6' -> [0, 1, 2, 3, 6]"""
+    cpus = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            lo, hi = part.split('-', 1)
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+class Command(BaseCommand):
+    help = "Run the inference service that owns the Facenet model and the embedding gallery"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=None,
+                            help='socket path or host:port (default FACE_INFERENCE_SOCKET)')
+        parser.add_argument('--workers', type=int, default=1, help='number of inference processes')
+        parser.add_argument('--cpus', default='',
+                            help="CPUs to pin inference processes to, e.g. '0-7'; split evenly between workers")
+
+    def handle(self, *args, **options):
+        if options['socket']:
+            settings.FACE_INFERENCE_SOCKET = options['socket']
+        address = service_address()
+        if address is None:
+            raise CommandError('Set FACE_INFERENCE_SOCKET or pass --socket')
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        cpus = parse_cpus(options['cpus'])
+        if cpus and hasattr(os, 'sched_getaffinity'):
+            unknown = set(cpus) - os.sched_getaffinity(0)
+            if unknown:
+                raise CommandError(f"CPUs not available to this process: {sorted(unknown)}")
+
+        self.stdout.write(f"Inference service listening on {address}")
+        serve(address, workers=options['workers'], cpus=cpus, log=self.stdout.write)
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from faceapp.gallery import enrolled_users, latest_change_version, prune_changes, read_embeddings
+from faceapp.snapshot import snapshot_dir, write_snapshot
+
+
+class Command(BaseCommand):
+    help = "Write a memory-mappable snapshot of all enrolled embeddings for the web workers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='snapshot directory (default FACE_GALLERY_SNAPSHOT_DIR)')
+        parser.add_argument('--keep', type=int, default=3, help='number of versions to keep on disk')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or snapshot_dir()
+        start = time.perf_counter()
+        # taken before reading: later changes are replayed by the workers
+        change_version = latest_change_version()
+        ids, matrix = read_embeddings(enrolled_users())
+        version = write_snapshot(ids, matrix, directory, keep=options['keep'], change_version=change_version)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote snapshot {version}: {len(ids)} embeddings, {matrix.nbytes / 2**20:.1f} MB in "
+            f"{time.perf_counter() - start:.1f}s -> {directory}"
+        ))
+        pruned = prune_changes()
+        if pruned:
+            self.stdout.write(f"Pruned {pruned} old embedding change log entries")
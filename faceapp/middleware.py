@@ -4,7 +4,8 @@ from django.conf import settings
 from django.http import JsonResponse
 from django.utils import timezone
 from .models import User, APIToken
-from .auth import decode_token
+from .auth import decode_token, token_digest
+from .token_cache import get_token_cache, revocation_version
 
 class JWTAuthenticationMiddleware:
     """
@@ -47,11 +48,22 @@ class JWTAuthenticationMiddleware:
                 except Exception:
                     return JsonResponse({"error": "Invalid token"}, status=401)
 
+                # Recently validated token: only the revocation version is
+                # read (see faceapp/token_cache.py)
+                key = token_digest(token)
+                tokens = get_token_cache()
+                version = revocation_version() if tokens is not None else None
+                user = tokens.get(key, version) if tokens is not None else None
+                if user is not None:
+                    request.user = user
+                    request.token_claims = payload
+                    return self.get_response(request)
+
                 # Load user
                 try:
                     user = User.objects.get(id=payload.get("user_id"))
                     # Check server-side token store for revocation/expiry
-                    token_obj = APIToken.objects.filter(key=token).first()
+                    token_obj = APIToken.objects.filter(key_hash=key).first()
                     if token_obj and not token_obj.is_valid():
                         return JsonResponse({"error": "Token revoked or expired"}, status=401)
 
@@ -59,7 +71,10 @@ class JWTAuthenticationMiddleware:
                     if token_obj is None:
                         return JsonResponse({"error": "Token not recognized"}, status=401)
 
+                    if tokens is not None:
+                        tokens.put(key, user, expires_at=token_obj.expires_at, version=version)
                     request.user = user
+                    request.token_claims = payload
                 except User.DoesNotExist:
                     return JsonResponse({"error": "User not found"}, status=401)
             else:
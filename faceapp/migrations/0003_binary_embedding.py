@@ -0,0 +1,79 @@
+# Store embeddings as raw normalised float32 bytes instead of JSON text.
+
+import json
+
+import numpy as np
+from django.db import migrations, models
+
+
+def json_to_binary(apps, schema_editor):
+    User = apps.get_model('faceapp', 'User')
+    batch = []
+    for u in User.objects.exclude(embedding=None).exclude(embedding="").iterator(chunk_size=500):
+        try:
+            arr = np.asarray(json.loads(u.embedding), dtype=np.float32).ravel()
+        except Exception:
+            continue
+        if arr.size == 0 or not np.isfinite(arr).all():
+            continue
+        norm = np.linalg.norm(arr)
+        if norm == 0:
+            continue
+        u.embedding_bin = (arr / norm).astype('<f4').tobytes()
+        u.embedding_dim = arr.size
+        u.embedding_model = 'Facenet'
+        batch.append(u)
+        if len(batch) >= 500:
+            User.objects.bulk_update(batch, ['embedding_bin', 'embedding_dim', 'embedding_model'])
+            batch = []
+    if batch:
+        User.objects.bulk_update(batch, ['embedding_bin', 'embedding_dim', 'embedding_model'])
+
+
+def binary_to_json(apps, schema_editor):
+    User = apps.get_model('faceapp', 'User')
+    batch = []
+    for u in User.objects.exclude(embedding_bin=None).iterator(chunk_size=500):
+        arr = np.frombuffer(u.embedding_bin, dtype='<f4')
+        u.embedding = json.dumps(arr.tolist())
+        batch.append(u)
+        if len(batch) >= 500:
+            User.objects.bulk_update(batch, ['embedding'])
+            batch = []
+    if batch:
+        User.objects.bulk_update(batch, ['embedding'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faceapp', '0002_alter_user_options_apitoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='embedding_bin',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='embedding_dim',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='embedding_model',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.RunPython(json_to_binary, binary_to_json),
+        migrations.RemoveField(
+            model_name='user',
+            name='embedding',
+        ),
+        migrations.RenameField(
+            model_name='user',
+            old_name='embedding_bin',
+            new_name='embedding',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faceapp', '0003_binary_embedding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='photo_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
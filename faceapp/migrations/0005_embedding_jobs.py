@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def set_initial_status(apps, schema_editor):
+    User = apps.get_model('faceapp', 'User')
+    EmbeddingJob = apps.get_model('faceapp', 'EmbeddingJob')
+    User.objects.filter(embedding__isnull=False).update(embedding_status='ready')
+    # photos that never got an embedding go to the worker
+    missing = User.objects.filter(embedding__isnull=True).exclude(photo='').exclude(photo__isnull=True)
+    EmbeddingJob.objects.bulk_create(
+        [EmbeddingJob(user_id=pk) for pk in missing.values_list('pk', flat=True).iterator()],
+        batch_size=500,
+    )
+    missing.update(embedding_status='pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faceapp', '0004_user_photo_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='embedding_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='EmbeddingJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='embedding_jobs', to='faceapp.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'id'], name='faceapp_emb_status_c160bb_idx')],
+            },
+        ),
+        migrations.RunPython(set_initial_status, migrations.RunPython.noop),
+    ]
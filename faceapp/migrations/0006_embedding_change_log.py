@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faceapp', '0005_embedding_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmbeddingChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('user_id', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Store a SHA-256 digest of each API token instead of the full JWT.
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_keys(apps, schema_editor):
+    APIToken = apps.get_model('faceapp', 'APIToken')
+    batch = []
+    for t in APIToken.objects.only('id', 'key').iterator(chunk_size=1000):
+        t.key_hash = hashlib.sha256(t.key.encode('utf-8')).hexdigest()
+        batch.append(t)
+        if len(batch) >= 1000:
+            APIToken.objects.bulk_update(batch, ['key_hash'])
+            batch = []
+    if batch:
+        APIToken.objects.bulk_update(batch, ['key_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faceapp', '0006_embedding_change_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apitoken',
+            name='key_hash',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        # hashing is one-way: existing tokens cannot be restored on rollback
+        migrations.RunPython(hash_keys, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='apitoken',
+            name='key',
+        ),
+        migrations.AlterField(
+            model_name='apitoken',
+            name='key_hash',
+            field=models.CharField(max_length=64, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='apitoken',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='apitoken',
+            index=models.Index(condition=models.Q(('revoked', True)), fields=['revoked'], name='faceapp_apitoken_revoked_idx'),
+        ),
+    ]
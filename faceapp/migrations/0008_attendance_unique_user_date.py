@@ -0,0 +1,37 @@
+# Merge duplicate daily attendance rows, then make (user, date) unique.
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicates(apps, schema_editor):
+    Attendance = apps.get_model('faceapp', 'Attendance')
+    dupes = (Attendance.objects.values('user_id', 'date')
+             .annotate(n=Count('id')).filter(n__gt=1))
+    for key in dupes.iterator():
+        rows = list(Attendance.objects.filter(user_id=key['user_id'], date=key['date']).order_by('id'))
+        keep = rows[0]
+        logins = [r.login_time for r in rows if r.login_time]
+        logouts = [r.logout_time for r in rows if r.logout_time]
+        keep.login_time = min(logins) if logins else None
+        keep.logout_time = max(logouts) if logouts else None
+        keep.working_hours = None
+        if keep.login_time and keep.logout_time:
+            keep.working_hours = round((keep.logout_time - keep.login_time).total_seconds() / 3600, 2)
+        keep.save()
+        Attendance.objects.filter(id__in=[r.id for r in rows[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faceapp', '0007_hashed_api_tokens'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(fields=('user', 'date'), name='faceapp_attendance_user_date_uniq'),
+        ),
+    ]
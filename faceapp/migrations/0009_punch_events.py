@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faceapp', '0008_attendance_unique_user_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PunchEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('timestamp', models.DateTimeField()),
+                ('date', models.DateField()),
+                ('kiosk', models.CharField(blank=True, max_length=150)),
+                ('distance', models.FloatField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='faceapp.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'date'], name='faceapp_punch_user_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faceapp', '0009_punch_events'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['date'], name='faceapp_attendance_date_idx'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.7 on 2026-10-18 21:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def count_employees(apps, schema_editor):
+    # total_employees used to be set by hand: start the counter from the real value
+    Department = apps.get_model('faceapp', 'Department')
+    User = apps.get_model('faceapp', 'User')
+    for department in Department.objects.all():
+        department.total_employees = User.objects.filter(department=department).count()
+        department.save(update_fields=['total_employees'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faceapp', '0010_attendance_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepartmentDaySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('department_id', models.IntegerField()),
+                ('present', models.IntegerField(default=0)),
+                ('late', models.IntegerField(default=0)),
+                ('total_hours', models.FloatField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'department_id'), name='faceapp_deptday_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DepartmentMonthSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('department_id', models.IntegerField()),
+                ('days', models.IntegerField(default=0)),
+                ('present', models.IntegerField(default=0)),
+                ('late', models.IntegerField(default=0)),
+                ('total_hours', models.FloatField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('month', 'department_id'), name='faceapp_deptmonth_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='UserMonthSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('days', models.IntegerField(default=0)),
+                ('late', models.IntegerField(default=0)),
+                ('total_hours', models.FloatField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='faceapp.user')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['month', 'user'], name='faceapp_usermonth_month_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'month'), name='faceapp_usermonth_uniq')],
+            },
+        ),
+        migrations.RunPython(count_employees, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-18 21:33
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_existing_changes(apps, schema_editor):
+    # existing entries keep their ids as versions, so snapshots and
+    # running workers (which tracked ids) carry on where they were
+    EmbeddingChange = apps.get_model('faceapp', 'EmbeddingChange')
+    Counter = apps.get_model('faceapp', 'Counter')
+    EmbeddingChange.objects.update(version=F('id'))
+    latest = EmbeddingChange.objects.aggregate(latest=Max('id'))['latest'] or 0
+    Counter.objects.update_or_create(name='embedding-changes', defaults={'value': latest})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faceapp', '0011_attendance_summaries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='embeddingchange',
+            name='version',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(number_existing_changes, migrations.RunPython.noop),
+    ]
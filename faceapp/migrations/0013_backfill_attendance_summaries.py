@@ -0,0 +1,61 @@
+import datetime
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, FloatField, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+
+
+def backfill_summaries(apps, schema_editor):
+    # 0011 created the summary tables empty, and the write path only
+    # applies deltas: compute them once from the existing Attendance rows.
+    # Self-contained on purpose (historical models, no faceapp imports),
+    # so later changes to faceapp.summaries cannot change this migration.
+    Attendance = apps.get_model('faceapp', 'Attendance')
+    DepartmentDaySummary = apps.get_model('faceapp', 'DepartmentDaySummary')
+    DepartmentMonthSummary = apps.get_model('faceapp', 'DepartmentMonthSummary')
+    UserMonthSummary = apps.get_model('faceapp', 'UserMonthSummary')
+
+    late = Q(login_time__time__gt=datetime.time.fromisoformat(getattr(settings, 'FACE_LATE_AFTER', '09:30')))
+    zero = Value(0.0, output_field=FloatField())
+    attendance = Attendance.objects.order_by()
+
+    DepartmentDaySummary.objects.all().delete()
+    DepartmentMonthSummary.objects.all().delete()
+    UserMonthSummary.objects.all().delete()
+
+    DepartmentDaySummary.objects.bulk_create([
+        DepartmentDaySummary(**row)
+        for row in attendance.annotate(department_id=Coalesce('user__department_id', Value(0)))
+        .values('date', 'department_id')
+        .annotate(present=Count('id'), late=Count('id', filter=late),
+                  total_hours=Coalesce(Sum('working_hours'), zero))
+        .iterator()
+    ], batch_size=1000)
+    DepartmentMonthSummary.objects.bulk_create([
+        DepartmentMonthSummary(**row)
+        for row in DepartmentDaySummary.objects.order_by().annotate(month=TruncMonth('date'))
+        .values('month', 'department_id')
+        .annotate(days=Count('id'), present=Sum('present'), late=Sum('late'),
+                  total_hours=Coalesce(Sum('total_hours'), zero))
+        .iterator()
+    ], batch_size=1000)
+    UserMonthSummary.objects.bulk_create([
+        UserMonthSummary(**row)
+        for row in attendance.annotate(month=TruncMonth('date'))
+        .values('user_id', 'month')
+        .annotate(days=Count('id'), late=Count('id', filter=late),
+                  total_hours=Coalesce(Sum('working_hours'), zero))
+        .iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('faceapp', '0012_commit_ordered_change_log'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_summaries, migrations.RunPython.noop),
+    ]
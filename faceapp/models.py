@@ -1,25 +1,58 @@
 # faceapp/models.py
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.contrib.auth.hashers import make_password, check_password
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from datetime import timedelta
+
+from .embeddings import EMBEDDING_DTYPE, MODEL_NAME, from_bytes, to_bytes
+from .gallery import department_changed, embedding_changed, embedding_removed
+
 class Department(models.Model):
     department_id = models.AutoField(primary_key=True)
     department_name = models.CharField(max_length=100)
     location = models.CharField(max_length=100, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # maintained by User.save() / delete; recount with rebuild_attendance_summaries
     total_employees = models.IntegerField(default=0)
 
     def __str__(self):
         return self.department_name
 
 
+def adjust_employee_counts(old_department, new_department):
+    """Move one user between ``Department.total_employees`` counters (ids or None)."""
+    if old_department:
+        Department.objects.filter(pk=old_department).update(total_employees=models.F("total_employees") - 1)
+    if new_department:
+        Department.objects.filter(pk=new_department).update(total_employees=models.F("total_employees") + 1)
+
+
+# User.embedding_status
+EMBEDDING_PENDING = "pending"
+EMBEDDING_READY = "ready"
+EMBEDDING_FAILED = "failed"
+EMBEDDING_STATUS_CHOICES = [
+    (EMBEDDING_PENDING, "Pending"),
+    (EMBEDDING_READY, "Ready"),
+    (EMBEDDING_FAILED, "Failed"),
+]
+
+
 class User(models.Model):
     name = models.CharField(max_length=255)
     email = models.EmailField(unique=True)
     department = models.ForeignKey(Department, on_delete=models.SET_NULL, null=True, blank=True)
     photo = models.ImageField(upload_to='photos/', null=True, blank=True)
-    embedding = models.TextField(null=True, blank=True)
+    # L2-normalised little-endian float32 vector, see faceapp/embeddings.py
+    embedding = models.BinaryField(null=True, blank=True)
+    embedding_dim = models.PositiveSmallIntegerField(null=True, blank=True)
+    embedding_model = models.CharField(max_length=50, blank=True, default="")
+    # photo_digest() of the photo the embedding was computed from
+    photo_hash = models.CharField(max_length=64, blank=True, default="")
+    # blank until a photo is uploaded, then set by the embedding job
+    embedding_status = models.CharField(max_length=10, choices=EMBEDDING_STATUS_CHOICES, blank=True, default="")
     created_at = models.DateTimeField(auto_now_add=True)
 
     password = models.CharField(max_length=255, default="")
@@ -33,6 +66,30 @@ class User(models.Model):
             return False
         return check_password(raw, self.password)
 
+    # pass as update_fields when only the embedding changed
+    EMBEDDING_FIELDS = ["embedding", "embedding_dim", "embedding_model", "photo_hash", "embedding_status"]
+
+    def set_embedding(self, vec, model_name=MODEL_NAME, photo_hash=""):
+        """Normalise and encode ``vec`` into the embedding columns."""
+        data = to_bytes(vec)
+        if data is None:
+            self.embedding = None
+            self.embedding_dim = None
+            self.embedding_model = ""
+            self.photo_hash = ""
+            self.embedding_status = EMBEDDING_FAILED
+            return False
+        self.embedding = data
+        self.embedding_dim = len(data) // EMBEDDING_DTYPE.itemsize
+        self.embedding_model = model_name
+        self.photo_hash = photo_hash
+        self.embedding_status = EMBEDDING_READY
+        return True
+
+    def get_embedding(self):
+        """Stored embedding as a read-only float32 view, or None."""
+        return from_bytes(self.embedding, self.embedding_dim)
+
     def __str__(self):
         return f"{self.name} ({'Admin' if self.is_admin else 'Employee'})"
 
@@ -40,34 +97,148 @@ class User(models.Model):
         verbose_name = "Face App User"
         verbose_name_plural = "Face App Users"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember stored values so save() can tell what actually changed
+        if "photo" in field_names:
+            instance._loaded_photo = values[field_names.index("photo")]
+        if "embedding" in field_names:
+            raw = values[field_names.index("embedding")]
+            instance._loaded_embedding = bytes(raw) if raw is not None else None
+        if "department_id" in field_names:
+            instance._loaded_department = values[field_names.index("department_id")]
+        return instance
+
+    def _gallery_fields_changed(self):
+        """True if the embedding or department differ from what was loaded."""
+        if not hasattr(self, "_loaded_embedding"):
+            return True
+        current = bytes(self.embedding) if self.embedding is not None else None
+        return current != self._loaded_embedding or self.department_id != getattr(self, "_loaded_department", None)
+
     def save(self, *args, **kwargs):
         creating = self.pk is None
-        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        photo_written = update_fields is None or "photo" in update_fields
+        photo_changed = bool(self.photo) and self.photo.name != getattr(self, "_loaded_photo", None)
+
+        # Embedding is computed by a background job (faceapp/jobs.py)
+        needs_embedding = photo_written and bool(self.photo) and (creating or photo_changed or not self.embedding)
+        if needs_embedding and self.embedding_status != EMBEDDING_PENDING:
+            self.embedding_status = EMBEDDING_PENDING
+            if update_fields is not None:
+                kwargs["update_fields"] = list(update_fields) + ["embedding_status"]
+
+        gallery_fields_written = update_fields is None or "embedding" in update_fields or "department" in update_fields
+        if creating:
+            gallery_changed = gallery_fields_written and self.embedding is not None
+        else:
+            gallery_changed = gallery_fields_written and self._gallery_fields_changed()
+        department_written = update_fields is None or "department" in update_fields
+        if creating:
+            old_department = None
+        else:
+            old_department = getattr(self, "_loaded_department", self.department_id)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if department_written and old_department != self.department_id:
+                adjust_employee_counts(old_department, self.department_id)
+                if not creating:
+                    # existing attendance counts for the new department from now on
+                    from .summaries import move_user
+                    move_user(self.pk, old_department, self.department_id)
+        self._loaded_photo = self.photo.name if self.photo else None
+        self._loaded_embedding = bytes(self.embedding) if self.embedding is not None else None
+        self._loaded_department = self.department_id
+
+        if needs_embedding:
+            from .jobs import enqueue_embedding
+            enqueue_embedding(self)
+
+        if gallery_changed:
+            embedding_changed(self)
+
+
+class EmbeddingJob(models.Model):
+    """Queued request to (re)compute a user's embedding from their photo."""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(PENDING, "Pending"), (RUNNING, "Running"), (DONE, "Done"), (FAILED, "Failed")]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="embedding_jobs")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "id"])]
+
+    def __str__(self):
+        return f"embedding job {self.pk} for user {self.user_id} ({self.status})"
+
+
+class EmbeddingChange(models.Model):
+    """
+    Append-only log of users whose gallery row changed (embedding written,
+    department moved, user deleted). Workers poll for versions above the
+    last one they applied; see EmbeddingGallery.sync().
+    """
+    id = models.BigAutoField(primary_key=True)
+    # not a foreign key: deletions are logged too
+    user_id = models.IntegerField()
+    # from the "embedding-changes" Counter: unlike ids, versions become
+    # visible in the order they were assigned (see gallery.record_changes)
+    version = models.BigIntegerField(default=0, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"change {self.version} user {self.user_id}"
+
+
+class Counter(models.Model):
+    """Named counter shared by every worker process."""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+def bump_counter(name):
+    """
+    Increment counter ``name`` and return its new value. The row stays
+    locked until the surrounding transaction ends, so concurrent callers
+    get their values in commit order.
+    """
+    if not Counter.objects.filter(pk=name).update(value=models.F("value") + 1):
+        Counter.objects.get_or_create(pk=name)
+        Counter.objects.filter(pk=name).update(value=models.F("value") + 1)
+    return Counter.objects.values_list("value", flat=True).get(pk=name)
+
 
-        # Auto-generate embedding only if photo exists
-        if self.photo and (creating or not self.embedding):
-            try:
-                from deepface import DeepFace
-                import numpy as np, json
-                from PIL import Image
+def read_counter(name):
+    return Counter.objects.filter(pk=name).values_list("value", flat=True).first() or 0
 
-                img = Image.open(self.photo.path).convert("RGB")
-                frame = np.array(img)[:, :, ::-1]
 
-                rep = DeepFace.represent(
-                    frame,
-                    model_name='Facenet',
-                    enforce_detection=False
-                )
+@receiver(post_save, sender=Department)
+def _refresh_department_shards(sender, instance, created, **kwargs):
+    if not created:
+        department_changed(instance.pk)
 
-                if rep and "embedding" in rep[0]:
-                    self.embedding = json.dumps(rep[0]['embedding'])
-                    super().save(update_fields=["embedding"])
-                else:
-                    print("❌ DeepFace returned no embedding")
 
-            except Exception as e:
-                print("❌ Embedding creation failed:", e)
+@receiver(post_delete, sender=User)
+def _remove_from_gallery(sender, instance, **kwargs):
+    embedding_removed(instance.pk)
+    adjust_employee_counts(instance.department_id, None)
+    # drop the deleted user's cached tokens everywhere
+    from .token_cache import bump_revocation_version
+    bump_revocation_version()
 
 
 class Attendance(models.Model):
@@ -79,29 +250,140 @@ class Attendance(models.Model):
     # Do not access the DB at import time (avoids startup warnings and errors).
     # If you need diagnostics, run a management command or log inside views/ready().
 
+    class Meta:
+        constraints = [
+            # one row per user and day; punches upsert into it (faceapp.attendance)
+            models.UniqueConstraint(fields=["user", "date"], name="faceapp_attendance_user_date_uniq"),
+        ]
+        indexes = [
+            # date-range reports across all users (faceapp.reports)
+            models.Index(fields=["date"], name="faceapp_attendance_date_idx"),
+        ]
+
     def calculate_working_hours(self):
         if self.login_time and self.logout_time:
             delta = self.logout_time - self.login_time
             self.working_hours = round(delta.total_seconds() / 3600, 2)
             self.save()
 
+    def save(self, *args, **kwargs):
+        # keep the summary tables in step (also for a day moved by an admin edit)
+        from .summaries import apply_changes, row_values
+        with transaction.atomic():
+            list(User.objects.select_for_update().filter(pk=self.user_id).values_list("pk", flat=True))
+            old = Attendance.objects.filter(pk=self.pk).first() if self.pk else None
+            super().save(*args, **kwargs)
+            apply_changes([(old and row_values(old), row_values(self))])
+
     def __str__(self):
         name = self.user.name if self.user else "Unknown"
         return f"{name} | {self.date}"
 
 
+class PunchEvent(models.Model):
+    """
+    Append-only log of accepted punches (audit trail). The daily
+    ``Attendance`` row is derived from these: first punch = login,
+    last punch = logout. Written in batches by ``faceapp.attendance``.
+    """
+    id = models.BigAutoField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    timestamp = models.DateTimeField()
+    date = models.DateField()  # local date of timestamp, the Attendance day
+    kiosk = models.CharField(max_length=150, blank=True)  # account that submitted the frame
+    distance = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["user", "date"], name="faceapp_punch_user_date_idx")]
+
+    def __str__(self):
+        return f"{self.user_id} @ {self.timestamp}"
+
+
+class DepartmentDaySummary(models.Model):
+    """
+    Attendance totals per department and day, kept current by
+    ``faceapp.summaries`` whenever Attendance rows are written.
+    """
+    date = models.DateField()
+    # not a foreign key: 0 = users without a department
+    department_id = models.IntegerField()
+    present = models.IntegerField(default=0)
+    late = models.IntegerField(default=0)
+    total_hours = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["date", "department_id"], name="faceapp_deptday_uniq"),
+        ]
+
+    def __str__(self):
+        return f"department {self.department_id} | {self.date}"
+
+
+class DepartmentMonthSummary(models.Model):
+    """Per-department totals by month (``month`` = first day), from the day summaries."""
+    month = models.DateField()
+    department_id = models.IntegerField()
+    days = models.IntegerField(default=0)  # days with any attendance
+    present = models.IntegerField(default=0)  # person-days
+    late = models.IntegerField(default=0)
+    total_hours = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["month", "department_id"], name="faceapp_deptmonth_uniq"),
+        ]
+
+    def __str__(self):
+        return f"department {self.department_id} | {self.month:%Y-%m}"
+
+
+class UserMonthSummary(models.Model):
+    """Per-user totals by month (payroll), kept current with the Attendance rows."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    month = models.DateField()
+    days = models.IntegerField(default=0)
+    late = models.IntegerField(default=0)
+    total_hours = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "month"], name="faceapp_usermonth_uniq"),
+        ]
+        indexes = [models.Index(fields=["month", "user"], name="faceapp_usermonth_month_idx")]
+
+    def __str__(self):
+        return f"{self.user_id} | {self.month:%Y-%m}"
+
+
 class APIToken(models.Model):
     """
     Optional server-side token store. Saves issued JWTs so they can be
     revoked or audited. Storing tokens in the DB is useful for logout
     / revocation, short-lived refresh tokens, and administration.
+
+    Only the SHA-256 of the JWT is stored (``faceapp.auth.token_digest``):
+    a fixed 64-char unique key instead of the token itself. Expired and
+    revoked rows are removed by ``python manage.py prune_api_tokens``.
     """
-    key = models.CharField(max_length=512, unique=True)
+    key_hash = models.CharField(max_length=64, unique=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
-    expires_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
     revoked = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # only revoked rows are ever looked up by this flag (pruning)
+            models.Index(fields=["revoked"], condition=models.Q(revoked=True), name="faceapp_apitoken_revoked_idx"),
+        ]
+
+    @classmethod
+    def for_token(cls, token):
+        from .auth import token_digest
+        return cls.objects.filter(key_hash=token_digest(token))
+
     def is_valid(self):
         if self.revoked:
             return False
@@ -111,3 +393,9 @@ class APIToken(models.Model):
 
     def __str__(self):
         return f"APIToken(user={self.user.email}, revoked={self.revoked})"
+
+
+@receiver(post_delete, sender=Attendance)
+def _refresh_summaries(sender, instance, **kwargs):
+    from .summaries import apply_changes, row_values
+    apply_changes([(row_values(instance), None)])
@@ -0,0 +1,67 @@
+# faceapp/prefilter.py
+"""
+Cheap face-presence check run before Facenet.
+
+Recognition calls DeepFace with ``enforce_detection=False``, so empty
+frames (ceiling, someone walking away) still pay for a full Facenet pass
+and gallery search. A Haar/LBP cascade on a small grayscale copy of the
+frame rejects those in a few milliseconds.
+"""
+import os
+import threading
+
+import cv2
+import numpy as np
+from django.conf import settings
+
+_local = threading.local()
+
+
+def prefilter_enabled(endpoint):
+    """``FACE_PREFILTER`` maps endpoint names to on/off."""
+    return bool(getattr(settings, "FACE_PREFILTER", {}).get(endpoint, False))
+
+
+def _cascade():
+    # CascadeClassifier is not safe to share between threads
+    cascade = getattr(_local, "cascade", None)
+    if cascade is None:
+        name = getattr(settings, "FACE_PREFILTER_CASCADE", "haarcascade_frontalface_default.xml")
+        path = name if os.path.isabs(name) else os.path.join(cv2.data.haarcascades, name)
+        cascade = cv2.CascadeClassifier(path)
+        if cascade.empty():
+            raise RuntimeError(f"could not load face cascade {path}")
+        _local.cascade = cascade
+    return cascade
+
+
+def face_present(frame):
+    """True if the cascade finds at least one face in the BGR ``frame``."""
+    max_side = getattr(settings, "FACE_PREFILTER_MAX_SIDE", 320)
+    h, w = frame.shape[:2]
+    scale = min(1.0, max_side / float(max(h, w)))
+
+    gray = cv2.cvtColor(np.ascontiguousarray(frame), cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    if scale < 1.0:
+        gray = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    gray = cv2.equalizeHist(gray)
+
+    faces = _cascade().detectMultiScale(
+        gray,
+        scaleFactor=1.1,
+        minNeighbors=getattr(settings, "FACE_PREFILTER_MIN_NEIGHBORS", 3),
+        minSize=(20, 20),
+    )
+    return len(faces) > 0
+
+
+def rejects(frame, endpoint):
+    """True when the pre-filter is on for ``endpoint`` and finds no face."""
+    if not prefilter_enabled(endpoint):
+        return False
+    try:
+        return not face_present(frame)
+    except Exception as e:
+        # never block recognition because the pre-filter broke
+        print("Face pre-filter error:", e)
+        return False
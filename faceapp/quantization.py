@@ -0,0 +1,114 @@
+# faceapp/quantization.py
+"""
+Compact gallery matrices for brute-force search.
+
+A ``QuantizedMatrix`` keeps the gallery rows as float16, or as int8 codes
+with one float32 scale per row (``row ~= codes * scale``), i.e. 1/2 or
+~1/4 of the float32 memory. Scoring converts one block of rows at a time
+to float32 (into one reused buffer) for the BLAS product, so no float32
+copy of the gallery is kept anywhere: the compact rows are all a worker
+holds. Similarities are those of the dequantized rows, so the reported
+distances carry the quantization error (about 1e-3 for float16, a few
+1e-3 for int8, more right next to distance 0); ``benchmark_gallery``
+measures it. Converting float16 is slow in numpy, so int8 is usually
+both smaller and faster.
+"""
+import numpy as np
+
+KINDS = ("float16", "int8")
+
+# rows converted to float32 per block while scoring (~4 MB at dim 128)
+BLOCK_ROWS = 8192
+
+
+def _encode_rows(rows, kind):
+    rows = np.asarray(rows, dtype=np.float32)
+    if kind == "float16":
+        return rows.astype(np.float16), None
+    if kind == "int8":
+        scales = np.abs(rows).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.rint(rows / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"unknown quantization {kind!r}")
+
+
+class QuantizedMatrix:
+    """Immutable N x D matrix of quantized unit vectors."""
+
+    def __init__(self, kind, codes, scales=None):
+        self.kind = kind
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def encode(cls, matrix, kind):
+        codes, scales = _encode_rows(matrix, kind)
+        return cls(kind, codes, scales)
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Rows of ``parts`` (same kind) stacked into one matrix."""
+        parts = [p for p in parts if len(p)]
+        kind = parts[0].kind
+        scales = np.concatenate([p.scales for p in parts]) if parts[0].scales is not None else None
+        return cls(kind, np.concatenate([p.codes for p in parts]), scales)
+
+    def take(self, rows):
+        return QuantizedMatrix(self.kind, self.codes[rows], self.scales[rows] if self.scales is not None else None)
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def decode(self, rows=slice(None)):
+        block = self.codes[rows].astype(np.float32)
+        if self.scales is not None:
+            block *= self.scales[rows, None]
+        return block
+
+    def scores(self, queries):
+        """Approximate ``queries @ matrix.T`` (Q x N, float32)."""
+        queries = np.asarray(queries, dtype=np.float32)
+        out = np.empty((len(queries), len(self)), dtype=np.float32)
+        block = np.empty((min(BLOCK_ROWS, len(self)), self.shape[1]), dtype=np.float32)
+        for start in range(0, len(self), BLOCK_ROWS):
+            stop = min(start + BLOCK_ROWS, len(self))
+            rows = block[:stop - start]
+            np.copyto(rows, self.codes[start:stop], casting="unsafe")
+            np.matmul(queries, rows.T, out=out[:, start:stop])
+            if self.scales is not None:
+                out[:, start:stop] *= self.scales[start:stop]
+        return out
+
+
+def search_quantized(ids, compact, queries, k, hidden=None):
+    """
+    Top-``k`` of ``compact`` for each row of ``queries``, scored against
+    the dequantized rows. Rows flagged in ``hidden`` are skipped. Returns
+    ``(top_ids, top_sims)`` lists per query, best first.
+    """
+    sims = compact.scores(queries)
+    if hidden is not None:
+        sims[:, hidden] = -np.inf
+    n = len(ids)
+    k = min(k, n)
+    if k < n:
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(n), (len(queries), n))
+
+    out_ids, out_sims = [], []
+    for row, cand in zip(sims, top):
+        cand = cand[np.argsort(-row[cand])]
+        cand = cand[row[cand] > -np.inf]
+        out_ids.append(ids[cand].tolist())
+        out_sims.append(row[cand])
+    return out_ids, out_sims
@@ -0,0 +1,228 @@
+# faceapp/reports.py
+"""
+Attendance reports for the dashboards.
+
+Per-user history and the late/absent lists are computed by the database
+(``values()`` + ``Count`` / ``Sum``), never by loading Attendance rows
+into Python; department and monthly totals come from the summary tables
+maintained by ``faceapp.summaries``. Lists are paged with keyset
+cursors: the cursor is the sort key of the last row returned, so page N
+costs the same as page 1 (no OFFSET scan). Queries filter on
+``Attendance.date`` and ``(user, date)``, both indexed.
+
+The list functions return ``(rows, next_cursor)`` (``user_history`` also
+returns totals for the whole range); ``next_cursor`` is None on the last
+page.
+"""
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum
+from django.utils import timezone
+
+from .models import (Attendance, Department, DepartmentDaySummary, DepartmentMonthSummary,
+                     User, UserMonthSummary)
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+MAX_DAYS = 366
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor, *types):
+    """
+    Inverse of ``encode_cursor`` for a cursor of ``len(types)`` values,
+    each parsed with its type (``datetime.date`` or ``int``). Raises
+    ValueError on anything else.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError
+        return [_parse_cursor_value(value, kind) for value, kind in zip(values, types)]
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _parse_cursor_value(value, kind):
+    if kind is datetime.date:
+        if not isinstance(value, str):
+            raise ValueError
+        return datetime.date.fromisoformat(value)
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError
+    return int(value)
+
+
+def page_limit(value):
+    try:
+        limit = int(value) if value else DEFAULT_LIMIT
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def late_after():
+    """Local time after which a login counts as late (``FACE_LATE_AFTER``)."""
+    return datetime.time.fromisoformat(getattr(settings, "FACE_LATE_AFTER", "09:30"))
+
+
+def late_q():
+    """
+    Rows whose login, in local time, is after ``late_after()``. A per-row
+    comparison: callers narrow the rows by the indexed ``date`` first.
+    """
+    return Q(login_time__time__gt=late_after())
+
+
+def _page(rows, limit, key):
+    """Trim the probe row fetched past ``limit`` and build the next cursor."""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
+
+
+def user_history(user_id, start, end, limit=DEFAULT_LIMIT, cursor=None):
+    """Daily rows of one user, newest first, plus totals for the range."""
+    qs = Attendance.objects.filter(user_id=user_id, date__range=(start, end))
+    totals = qs.aggregate(
+        days=Count("id"),
+        hours=Sum("working_hours"),
+        late=Count("id", filter=late_q()),
+    )
+    if cursor:
+        (last_date,) = decode_cursor(cursor, datetime.date)
+        qs = qs.filter(date__lt=last_date)
+    rows = list(
+        qs.order_by("-date")
+        .values("date", "login_time", "logout_time", "working_hours")[:limit + 1]
+    )
+    rows, next_cursor = _page(rows, limit, lambda r: [r["date"].isoformat()])
+    return rows, totals, next_cursor
+
+
+def headcounts():
+    """Employees per department id (0 = no department), from the maintained counters."""
+    counts = dict(Department.objects.values_list("department_id", "total_employees"))
+    counts[0] = User.objects.filter(department__isnull=True).count()
+    return counts
+
+
+def department_daily(start, end, department=None, limit=DEFAULT_LIMIT, cursor=None):
+    """
+    One row per (date, department) with attendance: employees present,
+    late logins, absences, total and average working hours. Read from
+    ``DepartmentDaySummary`` (see faceapp/summaries.py). Users without a
+    department are reported under department 0.
+    """
+    qs = DepartmentDaySummary.objects.filter(date__range=(start, end))
+    if department is not None:
+        qs = qs.filter(department_id=department)
+    if cursor:
+        last_date, last_department = decode_cursor(cursor, datetime.date, int)
+        qs = qs.filter(Q(date__gt=last_date) | Q(date=last_date, department_id__gt=last_department))
+    rows = list(
+        qs.order_by("date", "department_id")
+        .values("date", "department_id", "present", "late", "total_hours")[:limit + 1]
+    )
+    rows, next_cursor = _page(rows, limit, lambda r: [r["date"].isoformat(), r["department_id"]])
+    employees = headcounts()
+    for row in rows:
+        row["average_hours"] = round(row["total_hours"] / row["present"], 2) if row["present"] else None
+        row["employees"] = employees.get(row["department_id"], 0)
+        row["absent"] = max(0, row["employees"] - row["present"])
+    return rows, next_cursor
+
+
+def department_monthly(start, end, department=None, limit=DEFAULT_LIMIT, cursor=None):
+    """Per-department month totals for the months touching ``start`` .. ``end``."""
+    qs = DepartmentMonthSummary.objects.filter(month__range=(start.replace(day=1), end))
+    if department is not None:
+        qs = qs.filter(department_id=department)
+    if cursor:
+        last_month, last_department = decode_cursor(cursor, datetime.date, int)
+        qs = qs.filter(Q(month__gt=last_month) | Q(month=last_month, department_id__gt=last_department))
+    rows = list(
+        qs.order_by("month", "department_id")
+        .values("month", "department_id", "days", "present", "late", "total_hours")[:limit + 1]
+    )
+    rows, next_cursor = _page(rows, limit, lambda r: [r["month"].isoformat(), r["department_id"]])
+    employees = headcounts()
+    for row in rows:
+        row["employees"] = employees.get(row["department_id"], 0)
+    return rows, next_cursor
+
+
+def user_monthly(month, department=None, limit=DEFAULT_LIMIT, cursor=None):
+    """Per-user totals for one month (payroll), by user id."""
+    qs = UserMonthSummary.objects.filter(month=month.replace(day=1))
+    if department is not None:
+        qs = qs.filter(user__department_id=department)
+    if cursor:
+        (last_user,) = decode_cursor(cursor, int)
+        qs = qs.filter(user_id__gt=last_user)
+    rows = list(
+        qs.order_by("user_id")
+        .values("user_id", "days", "late", "total_hours",
+                name=F("user__name"), email=F("user__email"), department_id=F("user__department_id"))[:limit + 1]
+    )
+    return _page(rows, limit, lambda r: [r["user_id"]])
+
+
+def late_list(day, department=None, limit=DEFAULT_LIMIT, cursor=None):
+    """Users who logged in after ``late_after()`` on ``day``, by user id."""
+    qs = Attendance.objects.filter(late_q(), date=day)
+    if department is not None:
+        qs = qs.filter(user__department_id=department)
+    if cursor:
+        (last_user,) = decode_cursor(cursor, int)
+        qs = qs.filter(user_id__gt=last_user)
+    rows = list(
+        qs.order_by("user_id")
+        .values("user_id", "login_time", "logout_time", "working_hours",
+                name=F("user__name"), email=F("user__email"), department_id=F("user__department_id"))[:limit + 1]
+    )
+    return _page(rows, limit, lambda r: [r["user_id"]])
+
+
+def absent_list(day, department=None, limit=DEFAULT_LIMIT, cursor=None):
+    """Users with no attendance row on ``day``, by user id."""
+    qs = User.objects.filter(~Exists(Attendance.objects.filter(user=OuterRef("pk"), date=day)))
+    if department is not None:
+        qs = qs.filter(department_id=department)
+    if cursor:
+        (last_user,) = decode_cursor(cursor, int)
+        qs = qs.filter(pk__gt=last_user)
+    rows = list(
+        qs.order_by("pk").values("name", "email", "department_id", user_id=F("pk"))[:limit + 1]
+    )
+    return _page(rows, limit, lambda r: [r["user_id"]])
+
+
+def date_range(params, default_days=31, max_days=MAX_DAYS):
+    """
+    ``from`` / ``to`` query parameters (ISO dates); default: the last month.
+    ``max_days=None`` allows any span (streaming exports).
+    """
+    end = _parse_date(params.get("to")) or timezone.localdate()
+    start = _parse_date(params.get("from")) or end - datetime.timedelta(days=default_days - 1)
+    if start > end:
+        raise ValueError("from must not be after to")
+    if max_days and (end - start).days >= max_days:
+        raise ValueError(f"At most {max_days} days per report")
+    return start, end
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid date {value!r}, expected YYYY-MM-DD")
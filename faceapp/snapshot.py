@@ -0,0 +1,105 @@
+# faceapp/snapshot.py
+"""
+Versioned, memory-mappable gallery snapshots.
+
+``python manage.py write_gallery_snapshot`` writes every enrolled
+embedding to ``<FACE_GALLERY_SNAPSHOT_DIR>/v<N>/`` as ``ids.npy`` (int64)
+and ``matrix.npy`` (L2-normalised float32), then atomically points the
+``CURRENT`` file at it. Workers ``np.load(..., mmap_mode="r")`` the
+current version: the pages come from the OS page cache and are shared by
+every process on the host, and a worker starts without reading the
+embedding column from Postgres.
+"""
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .embeddings import EMBEDDING_DTYPE, MODEL_NAME
+
+CURRENT = "CURRENT"
+
+
+def snapshot_enabled():
+    return getattr(settings, "FACE_GALLERY_SNAPSHOT", False)
+
+
+def snapshot_dir():
+    return getattr(settings, "FACE_GALLERY_SNAPSHOT_DIR", os.path.join(settings.MEDIA_ROOT, "gallery_snapshots"))
+
+
+def current_version(directory=None):
+    """Name of the current snapshot (e.g. ``"v000012"``), or None."""
+    try:
+        with open(os.path.join(directory or snapshot_dir(), CURRENT)) as fh:
+            return fh.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_snapshot(ids, matrix, directory=None, keep=3, change_version=0):
+    """
+    Write a new version and make it current. ``change_version`` is the
+    last EmbeddingChange version reflected in the rows; loaders replay changes
+    after it. Older versions beyond the newest ``keep`` are deleted
+    (processes that still map them keep their pages until they reload).
+    Returns the new version name.
+    """
+    directory = directory or snapshot_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    previous = current_version(directory)
+    number = int(previous[1:]) + 1 if previous else 1
+    version = f"v{number:06d}"
+    tmp = os.path.join(directory, version + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    np.save(os.path.join(tmp, "ids.npy"), np.ascontiguousarray(ids, dtype=np.int64))
+    np.save(os.path.join(tmp, "matrix.npy"), np.ascontiguousarray(matrix, dtype=EMBEDDING_DTYPE))
+    with open(os.path.join(tmp, "meta.json"), "w") as fh:
+        json.dump({
+            "version": version,
+            "model": MODEL_NAME,
+            "count": int(len(ids)),
+            "dim": int(matrix.shape[1]) if len(ids) else 0,
+            "change_version": int(change_version),
+            "created_at": time.time(),
+        }, fh)
+    os.rename(tmp, os.path.join(directory, version))
+
+    pointer = os.path.join(directory, CURRENT + ".tmp")
+    with open(pointer, "w") as fh:
+        fh.write(version)
+    os.replace(pointer, os.path.join(directory, CURRENT))
+
+    versions = sorted(d for d in os.listdir(directory) if d.startswith("v") and not d.endswith(".tmp"))
+    for old in versions[:-keep] if keep else []:
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    return version
+
+
+def load_snapshot(directory=None):
+    """
+    Map the current snapshot read-only: ``(meta, ids, matrix)``, or None
+    when there is none or it was written for another model.
+    """
+    directory = directory or snapshot_dir()
+    version = current_version(directory)
+    if version is None:
+        return None
+    path = os.path.join(directory, version)
+    with open(os.path.join(path, "meta.json")) as fh:
+        meta = json.load(fh)
+    if meta.get("model") != MODEL_NAME:
+        print(f"Gallery: snapshot {version} is for model {meta.get('model')!r}, ignoring it")
+        return None
+    if not meta.get("count"):
+        return meta, np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+    ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+    matrix = np.load(os.path.join(path, "matrix.npy"), mmap_mode="r")
+    # plain ndarray views over the mapping
+    return meta, np.asarray(ids), np.asarray(matrix)
@@ -0,0 +1,266 @@
+# faceapp/summaries.py
+"""
+Incrementally maintained attendance summaries.
+
+``DepartmentDaySummary``, ``DepartmentMonthSummary`` and
+``UserMonthSummary`` hold the totals payroll and the dashboards read, so
+reports never scan the Attendance table. Every code path that writes
+Attendance rows (the write-through punch, punch flushes, ``save()`` and
+``calculate_working_hours``, deletes) calls ``apply_changes`` with the
+old and new values of the rows it wrote, in the same transaction. Each
+summary row is adjusted by the difference (``present = present + 1``,
+``total_hours = total_hours + <hours>``), one UPDATE per affected row, in
+key order; the update's row lock serialises concurrent writers. Nothing
+is re-aggregated on the write path.
+
+Those writers lock the User row first, so the old values they read for
+a user's day cannot change before their write. Departments are taken
+from each user's current department; ``User.save()`` moves a user's
+existing day and month contributions with ``move_user`` when the
+department changes, in the same transaction. A delta that finds no
+summary row to take from is logged as drift. After that, or after bulk
+changes that bypass the ORM, run
+``python manage.py rebuild_attendance_summaries`` for the affected range;
+``rebuild`` is the only full recompute.
+"""
+import datetime
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, FloatField, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from .models import (Attendance, Department, DepartmentDaySummary, DepartmentMonthSummary,
+                     User, UserMonthSummary)
+from .reports import late_after, late_q
+
+ZERO_HOURS = Value(0.0, output_field=FloatField())
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def month_end(day):
+    return (month_start(day) + datetime.timedelta(days=32)).replace(day=1) - datetime.timedelta(days=1)
+
+
+def row_values(row):
+    """The ``(user_id, date, login_time, working_hours)`` an Attendance row adds to the summaries."""
+    return row.user_id, row.date, row.login_time, row.working_hours
+
+
+def _contribution(values, late):
+    """``(present, late, hours)`` of one Attendance row (``row_values``), or zeros for None."""
+    if values is None:
+        return 0, 0, 0.0
+    _, _, login_time, hours = values
+    is_late = login_time is not None and timezone.localtime(login_time).time() > late
+    return 1, int(is_late), hours or 0.0
+
+
+def apply_changes(changes):
+    """
+    Adjust the summaries for Attendance rows that went from ``old`` to
+    ``new`` (``row_values`` tuples, None for a row that did not exist /
+    no longer exists), given as ``(old, new)`` pairs.
+    """
+    changes = [(old, new) for old, new in changes if old != new]
+    if not changes:
+        return
+    user_ids = {values[0] for change in changes for values in change if values is not None}
+    departments = {
+        pk: department or 0
+        for pk, department in User.objects.filter(pk__in=user_ids).values_list("pk", "department_id")
+    }
+    late = late_after()
+
+    day = defaultdict(lambda: [0, 0, 0.0])
+    user_month = defaultdict(lambda: [0, 0, 0.0])
+    for old, new in changes:
+        for values, sign in ((old, -1), (new, 1)):
+            if values is None:
+                continue
+            user_id, date = values[:2]
+            for totals in (day[(date, departments.get(user_id, 0))], user_month[(user_id, month_start(date))]):
+                for i, value in enumerate(_contribution(values, late)):
+                    totals[i] += sign * value
+    _apply(day, user_month)
+
+
+def move_user(user_id, old_department, new_department):
+    """
+    Move the department day/month totals of every Attendance row of
+    ``user_id`` from ``old_department`` to ``new_department`` (None = no
+    department). Call it in the transaction that changes the department.
+    """
+    late = late_after()
+    day = defaultdict(lambda: [0, 0, 0.0])
+    rows = Attendance.objects.filter(user_id=user_id).values_list("user_id", "date", "login_time", "working_hours")
+    for values in rows.iterator(chunk_size=2000):
+        for department, sign in ((old_department or 0, -1), (new_department or 0, 1)):
+            totals = day[(values[1], department)]
+            for i, value in enumerate(_contribution(values, late)):
+                totals[i] += sign * value
+    _apply(day, {})
+
+
+def _apply(day, user_month):
+    """
+    Add the ``(present, late, hours)`` deltas of ``day`` (by ``(date,
+    department)``) and ``(days, late, hours)`` of ``user_month`` (by
+    ``(user_id, month)``) to the summary rows, deriving the department
+    month totals.
+    """
+    with transaction.atomic():
+        month = defaultdict(lambda: [0, 0, 0, 0.0])
+        for (date, department), (present, n_late, hours) in sorted(day.items()):
+            key = {"date": date, "department_id": department}
+            now_present = _add(DepartmentDaySummary, key, "present",
+                               present=present, late=n_late, total_hours=hours)
+            totals = month[(month_start(date), department)]
+            if present:
+                # the day starts or stops counting towards the month's days
+                totals[0] += (now_present > 0) - (now_present - present > 0)
+            totals[1] += present
+            totals[2] += n_late
+            totals[3] += hours
+        for (first, department), (days, present, n_late, hours) in sorted(month.items()):
+            _add(DepartmentMonthSummary, {"month": first, "department_id": department}, "days",
+                 days=days, present=present, late=n_late, total_hours=hours)
+        for (user_id, first), (days, n_late, hours) in sorted(user_month.items()):
+            _add(UserMonthSummary, {"user_id": user_id, "month": first}, "days",
+                 days=days, late=n_late, total_hours=hours)
+
+
+def _add(model, key, count_field, **deltas):
+    """
+    ``field = field + delta`` on the summary row ``key``, creating it if
+    the change adds to it and deleting it once ``count_field`` reaches 0.
+    Returns the new ``count_field`` (0 when there is no row) if it
+    changed, else None.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return None
+    rows = model.objects.filter(**key)
+    while not rows.update(**{field: F(field) + delta for field, delta in deltas.items()}):
+        if deltas.get(count_field, 0) <= 0:
+            # nothing to take away from: the summaries had drifted already
+            print(f"Warning: {model.__name__} {key} missing, dropped {deltas} "
+                  "(run rebuild_attendance_summaries)")
+            return 0
+        # missing, or deleted by a writer that emptied it: create and retry
+        model.objects.bulk_create([model(**key)], ignore_conflicts=True)
+    if count_field not in deltas:
+        return None
+    count = rows.values_list(count_field, flat=True).first() or 0
+    if count <= 0:
+        rows.delete()
+    return count
+
+
+def _department_day_totals(qs):
+    return {
+        (row["date"], row["department_id"]): {
+            "present": row["present"], "late": row["late"], "total_hours": row["total_hours"],
+        }
+        for row in qs.annotate(department_id=Coalesce("user__department_id", Value(0)))
+        .values("date", "department_id")
+        .annotate(
+            present=Count("id"),
+            late=Count("id", filter=late_q()),
+            total_hours=Coalesce(Sum("working_hours"), ZERO_HOURS),
+        )
+        .order_by()
+    }
+
+
+def _department_month_totals(qs):
+    return {
+        (row["month"], row["department_id"]): {
+            "days": row["days"], "present": row["present"], "late": row["late"], "total_hours": row["total_hours"],
+        }
+        for row in qs.annotate(month=TruncMonth("date"))
+        .values("month", "department_id")
+        .annotate(
+            days=Count("id"),
+            present=Coalesce(Sum("present"), 0),
+            late=Coalesce(Sum("late"), 0),
+            total_hours=Coalesce(Sum("total_hours"), ZERO_HOURS),
+        )
+        .order_by()
+    }
+
+
+def _user_month_totals(qs):
+    return {
+        (row["user_id"], row["month"]): {
+            "days": row["days"], "late": row["late"], "total_hours": row["total_hours"],
+        }
+        for row in qs.annotate(month=TruncMonth("date"))
+        .values("user_id", "month")
+        .annotate(
+            days=Count("id"),
+            late=Count("id", filter=late_q()),
+            total_hours=Coalesce(Sum("working_hours"), ZERO_HOURS),
+        )
+        .order_by()
+    }
+
+
+def rebuild(start, end, log=None):
+    """
+    Recompute all summaries for the whole months covering ``start`` ..
+    ``end``, one month per transaction, with grouped inserts instead of
+    per-row deltas. Returns the number of summary rows written.
+    """
+    written = 0
+    month = month_start(start)
+    while month <= end:
+        last = month_end(month)
+        with transaction.atomic():
+            DepartmentDaySummary.objects.filter(date__range=(month, last)).delete()
+            DepartmentMonthSummary.objects.filter(month=month).delete()
+            UserMonthSummary.objects.filter(month=month).delete()
+
+            attendance = Attendance.objects.filter(date__range=(month, last))
+            day_rows = [
+                DepartmentDaySummary(date=day, department_id=department, **totals)
+                for (day, department), totals in _department_day_totals(attendance).items()
+            ]
+            DepartmentDaySummary.objects.bulk_create(day_rows, batch_size=1000)
+            month_rows = [
+                DepartmentMonthSummary(month=m, department_id=department, **totals)
+                for (m, department), totals in
+                _department_month_totals(DepartmentDaySummary.objects.filter(date__range=(month, last))).items()
+            ]
+            DepartmentMonthSummary.objects.bulk_create(month_rows, batch_size=1000)
+            user_rows = [
+                UserMonthSummary(user_id=user_id, month=m, **totals)
+                for (user_id, m), totals in _user_month_totals(attendance).items()
+            ]
+            UserMonthSummary.objects.bulk_create(user_rows, batch_size=1000)
+        count = len(day_rows) + len(month_rows) + len(user_rows)
+        written += count
+        if log:
+            log(f"{month:%Y-%m}: {count} summary rows")
+        month = last + datetime.timedelta(days=1)
+    return written
+
+
+def recount_employees():
+    """Reset ``Department.total_employees`` from the User table. Returns departments changed."""
+    counts = dict(
+        User.objects.filter(department__isnull=False).values("department_id")
+        .annotate(n=Count("id")).values_list("department_id", "n")
+    )
+    changed = []
+    for department in Department.objects.only("department_id", "total_employees"):
+        n = counts.get(department.department_id, 0)
+        if department.total_employees != n:
+            department.total_employees = n
+            changed.append(department)
+    Department.objects.bulk_update(changed, ["total_employees"], batch_size=1000)
+    return len(changed)
@@ -1,3 +1,1750 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import gzip
+import importlib
+import io
+import json
+import os
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Listener
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.apps import apps as django_apps
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import (attendance, enrollment, exports, gallery, inference, inference_service, jobs, prefilter, reports,
+               summaries, token_cache, utils, views)
+from .ann import IVFIndex
+from .auth import create_token, maybe_prune_tokens, prune_tokens, token_digest
+from .batching import MicroBatcher
+from .cache import EmbeddingCache
+from .imaging import decode_image, reduction_factor
+from .quantization import QuantizedMatrix
+from .snapshot import current_version, write_snapshot
+from .embeddings import EMBEDDING_DTYPE, MODEL_NAME, from_bytes, normalize, to_bytes
+from .gallery import EmbeddingGallery, enrolled_users, read_embeddings
+from .management.commands import recompute_embeddings, run_embedding_worker
+from .models import (EMBEDDING_FAILED, EMBEDDING_PENDING, EMBEDDING_READY, APIToken, Attendance, Counter,
+                     Department, DepartmentDaySummary, DepartmentMonthSummary, EmbeddingChange, EmbeddingJob,
+                     PunchEvent, User, UserMonthSummary, bump_counter, read_counter)
+
+
+def random_embeddings(n, dim=128, seed=0):
+    rng = np.random.default_rng(seed)
+    vecs = rng.standard_normal((n, dim)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def create_user(name, embedding=None, **fields):
+    user = User(name=name, email=f"{name}@example.com", **fields)
+    if embedding is not None:
+        user.set_embedding(embedding)
+    user.save()
+    return user
+
+
+def clustered_embeddings(n, dim=128, seed=0):
+    """Unit vectors around a few centres, like real faces (see benchmark_ann)."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(1, n // 50), dim)).astype(np.float32)
+    vecs = centres[rng.integers(len(centres), size=n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def create_user_with_photo(name, value, **fields):
+    """User whose photo is a plain JPEG of grey level ``value`` (see ``embed_by_grey``)."""
+    user = User(name=name, email=f"{name}@example.com", **fields)
+    user.photo.save(f"{name}.jpg", ContentFile(jpeg(value)), save=False)
+    user.save()
+    return user
+
+
+def embed_by_grey(vectors):
+    """Fake ``represent_batch``: each frame's embedding is ``vectors[grey level]``."""
+    def represent_batch(frames):
+        return [faces(vectors[int(round(frame.mean()))]) for frame in frames]
+    return represent_batch
+
+
+def bearer(user, kiosk=None):
+    """Request headers carrying a stored token for ``user``."""
+    token = create_token(user, kiosk=kiosk)
+    APIToken.objects.create(key_hash=token_digest(token), user=user,
+                            expires_at=timezone.now() + datetime.timedelta(hours=1))
+    return {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+
+def jpeg(value=128, size=(48, 64)):
+    ok, data = cv2.imencode(".jpg", np.full(size + (3,), value, dtype=np.uint8))
+    return data.tobytes()
+
+
+def data_url(image_bytes):
+    return "data:image/jpeg;base64," + base64.b64encode(image_bytes).decode("ascii")
+
+
+def faces(*vectors):
+    """DeepFace ``represent`` output for one frame."""
+    return [{"embedding": list(map(float, vec)), "facial_area": {"x": 0, "y": 0, "w": 10 + i, "h": 10 + i},
+             "face_confidence": 0.99} for i, vec in enumerate(vectors)]
+
+
+def brute_force(ids, matrix, query, k):
+    """Reference top-k as (id, distance), nearest first."""
+    q = query / np.linalg.norm(query)
+    sims = matrix @ q
+    order = np.argsort(-sims)[:k]
+    return [(int(ids[i]), float(np.sqrt(max(0.0, 2 - 2 * sims[i])))) for i in order]
+
+
+@override_settings(FACE_GALLERY_SYNC_INTERVAL=None, FACE_GALLERY_QUANTIZATION="")
+class EmbeddingGalleryTests(TestCase):
+    def setUp(self):
+        self.vecs = random_embeddings(40)
+        self.users = [create_user(f"user{i}", vec) for i, vec in enumerate(self.vecs)]
+        self.gallery = EmbeddingGallery()
+        self.gallery.load()
+
+    def assertMatches(self, results, expected):
+        self.assertEqual([uid for uid, _ in results], [uid for uid, _ in expected])
+        np.testing.assert_allclose([d for _, d in results], [d for _, d in expected], atol=1e-5)
+
+    def test_search_matches_brute_force(self):
+        ids = np.array([u.pk for u in self.users])
+        probes = random_embeddings(10, seed=1)
+        for probe, results in zip(probes, self.gallery.search_batch(list(probes), k=5)):
+            self.assertMatches(results, brute_force(ids, self.vecs, probe, 5))
+
+    def test_invalid_probes_get_no_results(self):
+        results = self.gallery.search_batch([None, np.zeros(128), np.ones(64)], k=3)
+        self.assertEqual(results, [[], [], []])
+
+    def test_upsert_replaces_base_row(self):
+        user = self.users[3]
+        new = random_embeddings(1, seed=7)[0]
+        self.gallery.upsert(user.pk, new)
+
+        self.assertEqual(len(self.gallery), 40)
+        self.assertEqual(self.gallery.search(new, k=1)[0][0], user.pk)
+        # the old vector no longer finds the user with distance 0
+        best = self.gallery.search(self.vecs[3], k=1)[0]
+        self.assertFalse(best[0] == user.pk and best[1] < 1e-3)
+
+    def test_remove_hides_base_and_overlay_rows(self):
+        moved, removed = self.users[0], self.users[1]
+        self.gallery.upsert(moved.pk, random_embeddings(1, seed=9)[0])
+        self.gallery.remove(moved.pk)
+        self.gallery.remove(removed.pk)
+
+        self.assertEqual(len(self.gallery), 38)
+        found = {uid for results in self.gallery.search_batch(list(self.vecs), k=40) for uid, _ in results}
+        self.assertNotIn(moved.pk, found)
+        self.assertNotIn(removed.pk, found)
+
+    def test_overlay_appends_share_buffers(self):
+        extra = random_embeddings(5, seed=3)
+        self.gallery.upsert(10**6, extra[0])
+        first = self.gallery._state
+        for i, vec in enumerate(extra[1:], 1):
+            self.gallery.upsert(10**6 + i, vec)
+        last = self.gallery._state
+
+        # appended in place of spare capacity, older generation unaffected
+        self.assertIs(first.extra_matrix, last.extra_matrix)
+        self.assertEqual(first.extra_count, 1)
+        self.assertEqual(last.extra_count, 5)
+        self.assertEqual(self.gallery.search(extra[4], k=1)[0][0], 10**6 + 4)
+
+    def test_apply_many_changes_then_compact(self):
+        ids = [u.pk for u in self.users]
+        new = random_embeddings(40, seed=5)
+        with mock.patch.object(gallery, "OVERLAY_COMPACT_MIN", 8):
+            self.gallery.apply(upserts=dict(zip(ids[:5], new[:5])))
+            self.assertEqual(self.gallery._state.extra_count, 5)
+            # past the threshold the overlay is folded into the base
+            self.gallery.apply(upserts=dict(zip(ids[5:20], new[5:20])), removals=[ids[39]])
+
+        state = self.gallery._state
+        self.assertEqual(state.extra_count, 0)
+        self.assertIsNone(state.hidden)
+        self.assertEqual(len(self.gallery), 39)
+
+        expected_ids = np.array(ids[:39])
+        expected = np.concatenate([new[:20], self.vecs[20:39]])
+        for probe in random_embeddings(5, seed=6):
+            self.assertMatches(self.gallery.search(probe, k=5), brute_force(expected_ids, expected, probe, 5))
+
+    def test_random_changes_match_reference(self):
+        model = {u.pk: vec for u, vec in zip(self.users, self.vecs)}
+        user_ids = list(model) + [10**6 + i for i in range(20)]
+        rng = np.random.default_rng(2)
+        with mock.patch.object(gallery, "OVERLAY_COMPACT_MIN", 10), \
+                mock.patch.object(gallery, "OVERLAY_COMPACT_RATIO", 0.1):
+            for step in range(200):
+                user_id = int(rng.choice(user_ids))
+                if rng.random() < 0.7:
+                    model[user_id] = random_embeddings(1, seed=100 + step)[0]
+                    self.gallery.upsert(user_id, model[user_id])
+                else:
+                    model.pop(user_id, None)
+                    self.gallery.remove(user_id)
+
+                self.assertEqual(len(self.gallery), len(model))
+                ids = np.array(sorted(model))
+                probe = random_embeddings(1, seed=1000 + step)[0]
+                expected = brute_force(ids, np.stack([model[i] for i in ids]), probe, 5)
+                self.assertMatches(self.gallery.search(probe, k=5), expected)
+
+    def test_upsert_before_load_is_ignored(self):
+        fresh = EmbeddingGallery()
+        fresh.upsert(self.users[0].pk, self.vecs[1])
+        self.assertFalse(fresh.loaded)
+        self.assertEqual(len(fresh), 0)
+
+
+class BinaryEmbeddingTests(TestCase):
+    def test_bytes_round_trip_is_normalised_float32(self):
+        vec = np.arange(1, 129, dtype=np.float64)
+        data = to_bytes(vec)
+        self.assertEqual(len(data), 128 * EMBEDDING_DTYPE.itemsize)
+        back = from_bytes(data, 128)
+        np.testing.assert_allclose(back, vec / np.linalg.norm(vec), rtol=1e-6)
+        self.assertFalse(back.flags.writeable)
+
+    def test_invalid_vectors_are_rejected(self):
+        self.assertIsNone(normalize([]))
+        self.assertIsNone(normalize(np.zeros(128)))
+        self.assertIsNone(to_bytes([1.0, float("nan")]))
+        self.assertIsNone(from_bytes(b""))
+        self.assertIsNone(from_bytes(b"abc"))
+        self.assertIsNone(from_bytes(to_bytes(np.ones(128)), dim=64))
+
+    def test_embedding_survives_database_round_trip(self):
+        vec = random_embeddings(1)[0] * 3
+        user = create_user("stored", vec)
+        user = User.objects.get(pk=user.pk)
+        self.assertEqual(user.embedding_dim, 128)
+        self.assertEqual(user.embedding_model, MODEL_NAME)
+        self.assertEqual(user.embedding_status, EMBEDDING_READY)
+        np.testing.assert_allclose(user.get_embedding(), vec / np.linalg.norm(vec), rtol=1e-6)
+
+    def test_set_embedding_clears_invalid_vector(self):
+        user = create_user("broken", random_embeddings(1)[0])
+        self.assertFalse(user.set_embedding(np.zeros(128)))
+        user.save()
+        user = User.objects.get(pk=user.pk)
+        self.assertIsNone(user.get_embedding())
+        self.assertEqual(user.embedding_status, EMBEDDING_FAILED)
+
+    def test_read_embeddings_skips_other_dimensions(self):
+        vecs = random_embeddings(3)
+        users = [create_user(f"u{i}", vec) for i, vec in enumerate(vecs)]
+        create_user("short", random_embeddings(1, dim=64)[0])
+        ids, matrix = read_embeddings(enrolled_users().order_by("pk"))
+        self.assertEqual(ids.tolist(), [u.pk for u in users])
+        np.testing.assert_allclose(matrix, vecs, rtol=1e-6)
+
+
+class IVFIndexTests(TestCase):
+    def setUp(self):
+        self.vecs = clustered_embeddings(2000)
+        self.ids = np.arange(1, 2001, dtype=np.int64)
+        self.index = IVFIndex.train(self.vecs, nprobe=8)
+        self.index.add(self.ids, self.vecs)
+        rng = np.random.default_rng(1)
+        picks = rng.integers(len(self.vecs), size=100)
+        probes = self.vecs[picks] + 0.06 * rng.standard_normal((100, 128)).astype(np.float32)
+        self.probes = probes / np.linalg.norm(probes, axis=1, keepdims=True)
+
+    def recall(self, index, k=5, nprobe=None):
+        hits = 0
+        for probe in self.probes:
+            exact = {uid for uid, _ in brute_force(self.ids, self.vecs, probe, k)}
+            hits += len(exact & {uid for uid, _ in index.search(probe, k=k, nprobe=nprobe)})
+        return hits / (k * len(self.probes))
+
+    def test_recall_against_exact_search(self):
+        self.assertGreaterEqual(self.recall(self.index), 0.9)
+
+    def test_probing_every_cell_is_exact(self):
+        for probe in self.probes[:10]:
+            results = self.index.search(probe, k=5, nprobe=self.index.nlist)
+            expected = brute_force(self.ids, self.vecs, probe, 5)
+            self.assertEqual([uid for uid, _ in results], [uid for uid, _ in expected])
+            np.testing.assert_allclose([1 - s for _, s in results], [d * d / 2 for _, d in expected], atol=1e-5)
+
+    def test_add_replaces_and_remove_drops(self):
+        new = random_embeddings(1, seed=9)[0]
+        self.index.add([5], [new])
+        self.assertEqual(len(self.index), 2000)
+        self.assertEqual(self.index.search(new, k=1, nprobe=self.index.nlist)[0][0], 5)
+
+        self.assertTrue(self.index.remove(5))
+        self.assertFalse(self.index.remove(5))
+        self.assertNotIn(5, self.index)
+        # the row moved into the freed slot is still found where it now lives
+        for uid in (1, 2, 3, 4, 6, 2000):
+            self.assertEqual(self.index.search(self.vecs[uid - 1], k=1, nprobe=self.index.nlist)[0][0], uid)
+
+    def test_save_load_round_trip(self):
+        self.index.remove(7)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "index.npz")
+            self.index.save(path)
+            loaded = IVFIndex.load(path, nprobe=8)
+
+        self.assertEqual(sorted(loaded.ids()), sorted(self.index.ids()))
+        np.testing.assert_array_equal(loaded.centroids, self.index.centroids)
+        for probe in self.probes[:20]:
+            self.assertEqual(loaded.search(probe, k=5), self.index.search(probe, k=5))
+
+    def test_gallery_index_catches_up_with_users(self):
+        vecs = random_embeddings(20)
+        users = [create_user(f"ann{i}", vec) for i, vec in enumerate(vecs)]
+        with tempfile.TemporaryDirectory() as tmp, override_settings(
+                FACE_ANN_ENABLED=True, FACE_ANN_INDEX_PATH=os.path.join(tmp, "index.npz"),
+                FACE_GALLERY_SYNC_INTERVAL=None, FACE_GALLERY_QUANTIZATION=""):
+            gallery.build_ann_index(nlist=4).save(gallery.ann_index_path())
+            users[0].delete()
+            late = create_user("late", random_embeddings(1, seed=4)[0])
+
+            index = gallery.load_ann_index()
+            self.assertEqual(set(index.ids()), {u.pk for u in users[1:]} | {late.pk})
+
+            g = EmbeddingGallery()
+            g.load()
+            self.assertEqual(g.search(late.get_embedding(), k=1)[0][0], late.pk)
+
+    def test_gallery_index_replays_changed_embeddings(self):
+        vecs = random_embeddings(40, seed=7)
+        users = [create_user(f"ann{i}", vec) for i, vec in enumerate(vecs[:20])]
+        with tempfile.TemporaryDirectory() as tmp, override_settings(
+                FACE_ANN_ENABLED=True, FACE_ANN_INDEX_PATH=os.path.join(tmp, "index.npz"),
+                FACE_GALLERY_SYNC_INTERVAL=None, FACE_GALLERY_QUANTIZATION=""):
+            gallery.build_ann_index(nlist=4).save(gallery.ann_index_path())
+            user = users[0]
+            with self.captureOnCommitCallbacks(execute=True):
+                user.set_embedding(vecs[30])
+                user.save()
+
+            index = gallery.load_ann_index()
+            self.assertEqual(index.search(vecs[30], k=1, nprobe=index.nlist)[0][0], user.pk)
+            self.assertNotEqual(index.search(vecs[0], k=1, nprobe=index.nlist)[0][0], user.pk)
+
+            g = EmbeddingGallery()
+            g.load()
+            found, distance = g.search(vecs[30], k=1)[0]
+            self.assertEqual(found, user.pk)
+            self.assertAlmostEqual(distance, 0.0, places=3)
+
+    def test_gallery_index_without_version_is_retrained(self):
+        users = [create_user(f"ann{i}", vec) for i, vec in enumerate(random_embeddings(10))]
+        with tempfile.TemporaryDirectory() as tmp, override_settings(
+                FACE_ANN_ENABLED=True, FACE_ANN_INDEX_PATH=os.path.join(tmp, "index.npz")):
+            path = gallery.ann_index_path()
+            gallery.build_ann_index(nlist=2).save(path)
+            # a file written before the change version was stored
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files if name != "change_version"}
+            with open(path, "wb") as f:
+                np.savez(f, **arrays)
+            self.assertEqual(IVFIndex.load(path).change_version, -1)
+            with mock.patch.object(gallery, "build_ann_index", wraps=gallery.build_ann_index) as build:
+                index = gallery.load_ann_index()
+            build.assert_called_once()
+            self.assertEqual(set(index.ids()), {u.pk for u in users})
+
+
+class WarmUpTests(TestCase):
+    def setUp(self):
+        for name, value in [("_ready", inference.threading.Event()), ("_warm_thread", None),
+                            ("_status", {"state": "cold", "error": None, "seconds": None})]:
+            patcher = mock.patch.object(inference, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_ready_without_warm_up(self):
+        with override_settings(FACE_WARMUP_ON_START=False):
+            response = self.client.get("/api/health/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["ready"])
+
+    def test_health_is_503_until_warm(self):
+        model = mock.Mock()
+        with override_settings(FACE_WARMUP_ON_START=True):
+            self.assertEqual(self.client.get("/api/health/").status_code, 503)
+            with mock.patch.object(inference, "HAS_DEEPFACE", True), \
+                    mock.patch.object(inference, "_deepface", return_value=model), \
+                    mock.patch.object(gallery.EmbeddingGallery, "ensure_loaded") as ensure_loaded:
+                self.assertTrue(inference.warm_up())
+                self.assertTrue(inference.warm_up())
+            response = self.client.get("/api/health/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["state"], "ready")
+        model.build_model.assert_called_once()
+        model.represent.assert_called_once()
+        ensure_loaded.assert_called_once()
+
+    def test_failed_warm_up_stays_unready(self):
+        model = mock.Mock()
+        model.build_model.side_effect = RuntimeError("no weights")
+        with override_settings(FACE_WARMUP_ON_START=True), \
+                mock.patch.object(inference, "HAS_DEEPFACE", True), \
+                mock.patch.object(inference, "_deepface", return_value=model):
+            self.assertFalse(inference.warm_up())
+            response = self.client.get("/api/health/")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()["state"], "failed")
+        self.assertEqual(response.json()["error"], "no weights")
+
+    def test_missing_deepface_is_reported(self):
+        with mock.patch.object(inference, "HAS_DEEPFACE", False):
+            self.assertFalse(inference.warm_up())
+        self.assertEqual(inference.status()["state"], "unavailable")
+
+
+class MediaTestCase(TestCase):
+    """Uploaded photos go to a temporary MEDIA_ROOT."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.media_root = tmp.name
+        media = override_settings(MEDIA_ROOT=tmp.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+
+@override_settings(FACE_GALLERY_SYNC_INTERVAL=None, FACE_GALLERY_QUANTIZATION="", FACE_PREFILTER={},
+                   FACE_PUNCH_BUFFER_SIZE=0, FACE_SCOPE_FALLBACK=True)
+class RecognitionTestCase(TestCase):
+    """Recognition views against a fresh gallery, with the model mocked out."""
+
+    def setUp(self):
+        for target, name, value in [(gallery, "_gallery", EmbeddingGallery()), (views, "HAS_DEEPFACE", True),
+                                    (views, "get_embedding_cache", lambda: None)]:
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.vecs = random_embeddings(6)
+        self.users = [create_user(f"face{i}", vec) for i, vec in enumerate(self.vecs)]
+        self.kiosk = create_user("kiosk")
+        self.headers = bearer(self.kiosk)
+
+    def post_json(self, url, payload, **headers):
+        return self.client.post(url, payload, content_type="application/json", **dict(self.headers, **headers))
+
+
+class BatchRecognitionTests(RecognitionTestCase):
+    def test_batch_results_in_request_order(self):
+        images = [data_url(jpeg(10)), "not an image", data_url(jpeg(20)), data_url(jpeg(30))]
+        reps = [faces(self.vecs[0]), faces(self.vecs[1]), []]
+        with mock.patch.object(views, "represent_batch", return_value=reps) as represent_batch:
+            response = self.post_json("/api/start/batch/", {"images": images})
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual([r["index"] for r in results], [0, 1, 2, 3])
+        self.assertEqual((results[0]["action"], results[0]["name"]), ("login", "face0"))
+        self.assertEqual(results[1]["status"], "error")
+        self.assertEqual((results[2]["action"], results[2]["name"]), ("login", "face1"))
+        self.assertEqual(results[3]["status"], "failed")
+        # one forward pass for every decodable frame
+        represent_batch.assert_called_once()
+        self.assertEqual(len(represent_batch.call_args[0][0]), 3)
+
+    def test_batch_size_is_limited(self):
+        with override_settings(FACE_BATCH_MAX_IMAGES=2):
+            response = self.post_json("/api/start/batch/", {"images": [data_url(jpeg())] * 3})
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_requires_token(self):
+        response = self.client.post("/api/start/batch/", {"images": []}, content_type="application/json",
+                                    HTTP_AUTHORIZATION="Bearer nonsense")
+        self.assertEqual(response.status_code, 401)
+
+
+class MicroBatcherTests(TestCase):
+    def test_concurrent_submits_share_a_batch(self):
+        release = threading.Event()
+        calls = []
+
+        def double(items):
+            release.wait(5)
+            calls.append(list(items))
+            return [2 * x for x in items]
+
+        batcher = MicroBatcher(double, max_batch_size=4, max_wait_ms=200)
+        with ThreadPoolExecutor(8) as pool:
+            futures = [pool.submit(batcher.submit, i, 5) for i in range(8)]
+            release.set()
+            self.assertEqual([f.result() for f in futures], [2 * i for i in range(8)])
+
+        self.assertEqual(sorted(x for call in calls for x in call), list(range(8)))
+        self.assertTrue(all(len(call) <= 4 for call in calls))
+        stats = batcher.stats()
+        self.assertEqual(stats["requests"], 8)
+        self.assertEqual(stats["batches"], len(calls))
+        self.assertLess(stats["batches"], 8)
+
+    def test_errors_reach_every_caller(self):
+        batcher = MicroBatcher(lambda items: items[:-1], max_batch_size=1, max_wait_ms=1)
+        with self.assertRaises(RuntimeError):
+            batcher.submit("frame", timeout=5)
+
+        def fail(items):
+            raise ValueError("model crashed")
+
+        batcher = MicroBatcher(fail, max_batch_size=2, max_wait_ms=1)
+        with self.assertRaisesMessage(ValueError, "model crashed"):
+            batcher.submit("frame", timeout=5)
+        self.assertEqual(batcher.stats()["errors"], 1)
+        # the worker thread survives a failed batch
+        batcher._fn = lambda items: items
+        self.assertEqual(batcher.submit("next", timeout=5), "next")
+
+    def test_represent_uses_batcher_for_frames(self):
+        batcher = mock.Mock()
+        batcher.submit.return_value = faces(np.ones(128))
+        frame = np.zeros((8, 8, 3), dtype=np.uint8)
+        with override_settings(FACE_BATCHING_ENABLED=True, FACE_INFERENCE_SOCKET=""), \
+                mock.patch.object(inference, "_batcher", batcher):
+            self.assertEqual(inference.represent(frame), batcher.submit.return_value)
+        batcher.submit.assert_called_once_with(frame)
+
+
+class InferenceServiceTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.address = os.path.join(tmp.name, "inference.sock")
+        self.listener = Listener(self.address, authkey=inference_service.service_authkey())
+        self.addCleanup(self.listener.close)
+        threading.Thread(target=self._serve, daemon=True).start()
+        self.client = inference_service.InferenceClient(self.address, inference_service.service_authkey(), timeout=5)
+        self.addCleanup(self.client._drop)
+
+    def _serve(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=inference_service._handle_connection, args=(conn,), daemon=True).start()
+
+    def test_calls_are_answered_by_the_service(self):
+        rep = faces(np.ones(128))
+        with mock.patch.object(inference, "represent", return_value=rep) as represent:
+            self.assertEqual(self.client.call("ping"), os.getpid())
+            self.assertEqual(self.client.call("represent", "frame"), rep)
+        represent.assert_called_once_with("frame")
+
+    def test_failures_raise_in_the_client(self):
+        # the service looks its operations up once per connection
+        with mock.patch.object(inference, "represent_batch", side_effect=ValueError("bad frame")):
+            with self.assertRaisesMessage(inference_service.InferenceError, "unknown operation 'train'"):
+                self.client.call("train")
+            with self.assertRaisesMessage(inference_service.InferenceError, "ValueError: bad frame"):
+                self.client.call("represent_batch", [])
+            # the connection is still usable afterwards
+            self.assertEqual(self.client.call("ping"), os.getpid())
+
+    def test_client_reconnects_after_a_dropped_connection(self):
+        self.assertEqual(self.client.call("ping"), os.getpid())
+        self.client._local.conn.close()
+        self.client._local.conn = mock.Mock(send=mock.Mock(side_effect=BrokenPipeError))
+        self.assertEqual(self.client.call("ping"), os.getpid())
+
+    def test_inference_routes_through_the_client(self):
+        client = mock.Mock()
+        client.call.return_value = [[]]
+        with override_settings(FACE_INFERENCE_SOCKET=self.address), \
+                mock.patch.object(inference_service, "_client", client):
+            self.assertEqual(inference.search([None], k=3), [[]])
+        client.call.assert_called_once_with("search", [None], 3, None)
+
+    def test_address_and_cpu_split(self):
+        with override_settings(FACE_INFERENCE_SOCKET="127.0.0.1:7000"):
+            self.assertEqual(inference_service.service_address(), ("127.0.0.1", 7000))
+        with override_settings(FACE_INFERENCE_SOCKET="/run/face.sock"):
+            self.assertEqual(inference_service.service_address(), "/run/face.sock")
+        self.assertEqual(inference_service.split_cpus([0, 1, 2, 3, 4], 2), [{0, 2, 4}, {1, 3}])
+        self.assertEqual(inference_service.split_cpus([], 2), [None, None])
+
+
+class MultiFaceTests(RecognitionTestCase):
+    def start(self, rep, **settings):
+        with override_settings(**settings), mock.patch.object(views, "represent", return_value=rep):
+            response = self.post_json("/api/start/", {"image": data_url(jpeg()), "multi": True})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_each_face_is_matched_and_punched_once(self):
+        noisy = self.vecs[0] + 0.05 * random_embeddings(1, seed=8)[0]
+        stranger = -self.vecs[2]
+        # faces() makes later faces larger; results come largest first
+        body = self.start(faces(self.vecs[0], noisy, self.vecs[1], stranger))
+
+        results = body["faces"]
+        self.assertEqual(body["status"], "success")
+        self.assertEqual([r["status"] for r in results], ["failed", "success", "duplicate", "success"])
+        self.assertEqual([r.get("name") for r in results[1:]], ["face1", "face0", "face0"])
+        self.assertEqual(results[3]["distance"], 0.0)
+        self.assertEqual(results[0]["box"]["w"], 13)
+        self.assertEqual(User.objects.get(pk=self.users[0].pk).attendance_set.count(), 1)
+
+    def test_faces_are_capped(self):
+        body = self.start(faces(*self.vecs[:4]), FACE_MULTI_MAX_FACES=2)
+        self.assertEqual([r["name"] for r in body["faces"]], ["face3", "face2"])
+
+    def test_frame_without_faces(self):
+        body = self.start([])
+        self.assertEqual((body["status"], body["faces"]), ("failed", []))
+
+
+class EmbeddingCacheTests(TestCase):
+    def setUp(self):
+        self.compute = mock.Mock(side_effect=lambda frame: faces(np.ones(128)))
+
+    def test_same_bytes_are_computed_once(self):
+        cache = EmbeddingCache(max_entries=4)
+        first = cache.get_or_compute(b"image-a", None, self.compute)
+        self.assertIs(cache.get_or_compute(b"image-a", None, self.compute), first)
+        cache.get_or_compute(b"image-b", None, self.compute)
+        self.assertEqual(self.compute.call_count, 2)
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    def test_empty_results_are_not_cached(self):
+        cache = EmbeddingCache()
+        compute = mock.Mock(return_value=[])
+        cache.get_or_compute(b"blank", None, compute)
+        cache.get_or_compute(b"blank", None, compute)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = EmbeddingCache(max_entries=2)
+        for data in (b"a", b"b", b"a", b"c"):
+            cache.get_or_compute(data, None, self.compute)
+        cache.get_or_compute(b"a", None, self.compute)
+        self.assertEqual(self.compute.call_count, 3)
+        cache.get_or_compute(b"b", None, self.compute)
+        self.assertEqual(self.compute.call_count, 4)
+        self.assertEqual(cache.stats()["evictions"], 2)
+
+    def test_entries_expire(self):
+        cache = EmbeddingCache(ttl=10)
+        with mock.patch("faceapp.cache.time.monotonic", return_value=100.0):
+            cache.get_or_compute(b"a", None, self.compute)
+        with mock.patch("faceapp.cache.time.monotonic", return_value=111.0):
+            cache.get_or_compute(b"a", None, self.compute)
+        self.assertEqual(self.compute.call_count, 2)
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_perceptual_hash_matches_reencoded_frame(self):
+        rng = np.random.default_rng(0)
+        frame = cv2.resize(rng.integers(0, 255, (9, 12, 3), dtype=np.uint8), (180, 240), interpolation=cv2.INTER_LINEAR)
+        reencoded = cv2.imdecode(cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 70])[1], cv2.IMREAD_COLOR)
+        cache = EmbeddingCache(use_perceptual_hash=True)
+        cache.get_or_compute(b"original", frame, self.compute)
+        cache.get_or_compute(b"re-encoded", reencoded, self.compute)
+        self.assertEqual(self.compute.call_count, 1)
+        self.assertEqual(cache.stats()["perceptual_hits"], 1)
+
+
+class CachedRecognitionTests(RecognitionTestCase):
+    def test_repeated_upload_skips_the_model(self):
+        with mock.patch.object(views, "get_embedding_cache", return_value=EmbeddingCache()), \
+                mock.patch.object(views, "represent", return_value=faces(self.vecs[2])) as represent:
+            actions = [self.post_json("/api/start/", {"image": data_url(jpeg(77))}).json()["action"]
+                       for _ in range(2)]
+        self.assertEqual(actions, ["login", "logout"])
+        represent.assert_called_once()
+
+
+class PrefilterTests(RecognitionTestCase):
+    def test_blank_frame_is_rejected(self):
+        blank = np.full((480, 640, 3), 90, dtype=np.uint8)
+        with override_settings(FACE_PREFILTER={"start": True}):
+            self.assertTrue(prefilter.rejects(blank, "start"))
+            self.assertFalse(prefilter.rejects(blank, "verify"))
+
+    def test_detection_runs_on_a_small_copy(self):
+        cascade = mock.Mock()
+        cascade.detectMultiScale.return_value = [(1, 2, 30, 30)]
+        with override_settings(FACE_PREFILTER_MAX_SIDE=160), \
+                mock.patch.object(prefilter, "_cascade", return_value=cascade):
+            self.assertTrue(prefilter.face_present(np.zeros((480, 640, 3), dtype=np.uint8)))
+        self.assertEqual(cascade.detectMultiScale.call_args[0][0].shape, (120, 160))
+
+    def test_broken_cascade_does_not_block(self):
+        with override_settings(FACE_PREFILTER={"start": True}, FACE_PREFILTER_CASCADE="/nonexistent.xml"), \
+                mock.patch.object(prefilter._local, "cascade", None, create=True):
+            self.assertFalse(prefilter.rejects(np.zeros((64, 64, 3), dtype=np.uint8), "start"))
+
+    def test_rejected_frame_skips_the_model(self):
+        with override_settings(FACE_PREFILTER={"start": True}), \
+                mock.patch.object(views, "represent") as represent:
+            response = self.post_json("/api/start/", {"image": data_url(jpeg())})
+        self.assertEqual(response.json(), views.NO_FACE_RESULT)
+        represent.assert_not_called()
+
+
+class ImageDecodeTests(RecognitionTestCase):
+    def test_reduction_keeps_longest_side_above_limit(self):
+        self.assertEqual(reduction_factor((4000, 3000), 640), 4)
+        self.assertEqual(reduction_factor((1280, 720), 640), 2)
+        self.assertEqual(reduction_factor((1279, 720), 640), 1)
+        self.assertEqual(reduction_factor((20000, 10), 640), 8)
+
+    def test_decoded_frame_is_bounded(self):
+        data = jpeg(size=(1200, 1600))
+        self.assertEqual(decode_image(data, limit=640).shape, (480, 640, 3))
+        self.assertEqual(decode_image(data, limit=0).shape, (1200, 1600, 3))
+        ok, png = cv2.imencode(".png", np.zeros((300, 900, 3), dtype=np.uint8))
+        self.assertEqual(decode_image(png.tobytes(), limit=300).shape, (100, 300, 3))
+
+    def test_garbage_is_rejected(self):
+        for data in (b"", b"not an image"):
+            with self.assertRaises(ValueError):
+                decode_image(data)
+
+    def test_raw_jpeg_body(self):
+        with mock.patch.object(views, "represent", return_value=faces(self.vecs[3])) as represent:
+            response = self.client.post("/api/start/", jpeg(size=(960, 1280)),
+                                        content_type="image/jpeg", **self.headers)
+        self.assertEqual(response.json()["name"], "face3")
+        self.assertEqual(represent.call_args[0][0].shape, (480, 640, 3))
+
+    def test_multipart_upload(self):
+        upload = SimpleUploadedFile("frame.jpg", jpeg(), content_type="image/jpeg")
+        with mock.patch.object(views, "represent", return_value=faces(self.vecs[4])):
+            response = self.client.post("/api/start/file/", {"image": upload}, **self.headers)
+        self.assertEqual(response.json()["name"], "face4")
+
+
+@override_settings(FACE_EMBEDDING_ASYNC=True)
+class RecomputeEmbeddingsTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.vectors = {10: random_embeddings(1, seed=10)[0], 60: random_embeddings(1, seed=60)[0]}
+        self.first = create_user_with_photo("first", 10)
+        self.second = create_user_with_photo("second", 60)
+        self.no_photo = create_user("nophoto")
+        self.checkpoint = os.path.join(self.media_root, "checkpoint.json")
+
+    def recompute(self, *args):
+        out = io.StringIO()
+        with mock.patch.object(recompute_embeddings, "HAS_DEEPFACE", True), \
+                mock.patch.object(recompute_embeddings, "represent_batch",
+                                  side_effect=embed_by_grey(self.vectors)) as represent_batch:
+            call_command("recompute_embeddings", "--checkpoint", self.checkpoint, "--batch-size", "1", *args, stdout=out)
+        return represent_batch, out.getvalue()
+
+    def test_embeds_changed_photos_only(self):
+        represent_batch, out = self.recompute("--workers", "2")
+        self.assertEqual(represent_batch.call_count, 2)
+        self.assertIn("updated=2", out)
+        self.assertIn("no_photo=1", out)
+        for user, grey in ((self.first, 10), (self.second, 60)):
+            user = User.objects.get(pk=user.pk)
+            self.assertEqual(user.embedding_status, EMBEDDING_READY)
+            np.testing.assert_allclose(user.get_embedding(), self.vectors[grey], rtol=1e-6)
+        self.assertEqual(
+            set(EmbeddingChange.objects.values_list("user_id", flat=True)), {self.first.pk, self.second.pk})
+
+        represent_batch, out = self.recompute()
+        represent_batch.assert_not_called()
+        self.assertIn("unchanged=2", out)
+
+        represent_batch, out = self.recompute("--force")
+        self.assertEqual(represent_batch.call_count, 2)
+
+    def test_resume_after_checkpoint(self):
+        self.recompute()
+        User.objects.filter(pk=self.first.pk).update(embedding=None, embedding_dim=None)
+        represent_batch, out = self.recompute("--resume")
+        represent_batch.assert_not_called()
+        self.assertIn("Processed 0 users", out)
+        self.assertIsNone(User.objects.get(pk=self.first.pk).get_embedding())
+
+
+@override_settings(FACE_EMBEDDING_ASYNC=True, FACE_EMBEDDING_JOB_MAX_ATTEMPTS=2)
+class EmbeddingJobTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.vectors = {10: random_embeddings(1, seed=10)[0], 60: random_embeddings(1, seed=60)[0]}
+
+    def run_queue(self, represent_batch=None):
+        represent_batch = represent_batch or mock.Mock(side_effect=embed_by_grey(self.vectors))
+        with mock.patch.object(inference, "represent_batch", represent_batch):
+            claimed = jobs.claim_jobs()
+            if claimed:
+                jobs.run_jobs(claimed)
+        return claimed
+
+    def test_photo_upload_queues_one_job(self):
+        user = create_user_with_photo("queued", 10)
+        self.assertEqual(user.embedding_status, EMBEDDING_PENDING)
+        user.name = "renamed"
+        user.save()
+        user.embedding = None
+        user.save()
+        self.assertEqual(EmbeddingJob.objects.filter(user=user, status=EmbeddingJob.PENDING).count(), 1)
+        self.assertIsNone(user.get_embedding())
+
+    def test_worker_embeds_queued_photos(self):
+        users = [create_user_with_photo("a", 10), create_user_with_photo("b", 60)]
+        represent_batch = mock.Mock(side_effect=embed_by_grey(self.vectors))
+        out = io.StringIO()
+        with mock.patch.object(run_embedding_worker, "HAS_DEEPFACE", True), \
+                mock.patch.object(run_embedding_worker, "close_old_connections"), \
+                mock.patch.object(inference, "represent_batch", represent_batch):
+            call_command("run_embedding_worker", "--once", stdout=out)
+
+        self.assertIn("Processed 2 embedding jobs", out.getvalue())
+        represent_batch.assert_called_once()
+        for user, grey in zip(users, (10, 60)):
+            user = User.objects.get(pk=user.pk)
+            self.assertEqual(user.embedding_status, EMBEDDING_READY)
+            np.testing.assert_allclose(user.get_embedding(), self.vectors[grey], rtol=1e-6)
+        self.assertEqual(set(EmbeddingJob.objects.values_list("status", flat=True)), {EmbeddingJob.DONE})
+
+    def test_failed_jobs_are_retried_then_given_up(self):
+        user = create_user_with_photo("flaky", 10)
+        broken = mock.Mock(side_effect=RuntimeError("model crashed"))
+        self.run_queue(broken)
+        job = EmbeddingJob.objects.get(user=user)
+        self.assertEqual((job.status, job.attempts), (EmbeddingJob.PENDING, 1))
+        self.assertIn("model crashed", job.last_error)
+
+        self.run_queue(broken)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (EmbeddingJob.FAILED, 2))
+        self.assertEqual(User.objects.get(pk=user.pk).embedding_status, EMBEDDING_FAILED)
+        self.assertEqual(self.run_queue(broken), [])
+
+    def test_stale_running_job_is_reclaimed(self):
+        user = create_user_with_photo("orphan", 60)
+        claimed = jobs.claim_jobs()
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(jobs.claim_jobs(), [])
+
+        EmbeddingJob.objects.filter(pk=claimed[0].pk).update(
+            started_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual([job.pk for job in self.run_queue()], [claimed[0].pk])
+        self.assertEqual(User.objects.get(pk=user.pk).embedding_status, EMBEDDING_READY)
+
+    def test_inline_mode_embeds_on_save(self):
+        with override_settings(FACE_EMBEDDING_ASYNC=False), \
+                mock.patch.object(inference, "represent_batch", side_effect=embed_by_grey(self.vectors)):
+            user = create_user_with_photo("inline", 60)
+        user = User.objects.get(pk=user.pk)
+        self.assertEqual(user.embedding_status, EMBEDDING_READY)
+        np.testing.assert_allclose(user.get_embedding(), self.vectors[60], rtol=1e-6)
+
+
+class ScopedSearchTests(RecognitionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.north = Department.objects.create(department_name="North", location="Oslo")
+        self.south = Department.objects.create(department_name="South", location="Rome")
+        for user, department in zip(self.users, [self.north] * 3 + [self.south] * 3):
+            user.department = department
+            user.save()
+
+    def test_scope_limits_candidates(self):
+        g = gallery.get_gallery()
+        for scope, expected in ((("department", self.north.pk), self.users[:3]),
+                                (("location", "Rome"), self.users[3:])):
+            results = g.search_batch([self.vecs[0], self.vecs[5]], k=6, scope=scope)
+            for candidates in results:
+                self.assertEqual({uid for uid, _ in candidates}, {u.pk for u in expected})
+
+    def test_department_move_updates_shards(self):
+        g = gallery.get_gallery()
+        g.ensure_loaded()
+        scope = ("department", self.north.pk)
+        self.assertEqual(len(g.shard(scope)[0]), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[5].department = self.north
+            self.users[5].save()
+        self.assertEqual(g.search(self.vecs[5], k=1, scope=scope)[0][0], self.users[5].pk)
+
+    def test_embedding_change_keeps_unrelated_shards(self):
+        g = gallery.get_gallery()
+        g.ensure_loaded()
+        north, oslo, rome = g.shard(("department", self.north.pk)), g.shard(("location", "Oslo")), \
+            g.shard(("location", "Rome"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[4].set_embedding(self.vecs[0])
+            self.users[4].save()
+        self.assertIs(g.shard(("department", self.north.pk)), north)
+        self.assertIs(g.shard(("location", "Oslo")), oslo)
+        self.assertIsNot(g.shard(("location", "Rome")), rome)
+
+    def test_department_location_change_moves_its_staff(self):
+        g = gallery.get_gallery()
+        g.ensure_loaded()
+        self.assertEqual(len(g.shard(("location", "Oslo"))[0]), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.south.location = "Oslo"
+            self.south.save()
+        self.assertEqual(len(g.shard(("location", "Oslo"))[0]), 6)
+        self.assertEqual(len(g.shard(("location", "Rome"))[0]), 0)
+        # logged for the other workers
+        self.assertEqual(set(EmbeddingChange.objects.values_list("user_id", flat=True)),
+                         {u.pk for u in self.users[3:]})
+
+    def test_malformed_scope_sources_are_ignored(self):
+        request = RequestFactory().get("/api/start/", {"location": "Rome"})
+        self.assertEqual(views.search_scope(request, ["location", "Oslo"]), ("location", "Rome"))
+        request.token_claims = {"kiosk": "lobby"}
+        self.assertEqual(views.search_scope(request, {"department": self.north.pk}),
+                         ("department", self.north.pk))
+
+    def start(self, vec, headers, **settings):
+        with override_settings(**settings), mock.patch.object(views, "represent", return_value=faces(vec)):
+            return self.post_json("/api/start/", {"image": data_url(jpeg())}, **headers).json()
+
+    def test_kiosk_token_falls_back_to_whole_company(self):
+        headers = bearer(self.kiosk, kiosk={"department": self.north.pk})
+        self.assertEqual(self.start(self.vecs[1], headers)["name"], "face1")
+        with self.assertLogs("faceapp.views", "DEBUG"):
+            self.assertEqual(self.start(self.vecs[4], headers)["name"], "face4")
+        self.assertEqual(self.start(self.vecs[4], headers, FACE_SCOPE_FALLBACK=False)["status"], "failed")
+
+    def test_scope_from_request_parameter(self):
+        with override_settings(FACE_SCOPE_FALLBACK=False), \
+                mock.patch.object(views, "represent", return_value=faces(self.vecs[4])):
+            response = self.post_json("/api/start/", {"image": data_url(jpeg()), "location": "Rome"})
+            self.assertEqual(response.json()["name"], "face4")
+            response = self.post_json("/api/start/", {"image": data_url(jpeg()), "location": "Oslo"})
+            self.assertEqual(response.json()["status"], "failed")
+
+
+@override_settings(FACE_GALLERY_SYNC_INTERVAL=None)
+class QuantizedGalleryTests(TestCase):
+    def setUp(self):
+        self.vecs = clustered_embeddings(300)
+        self.users = [create_user(f"q{i}", vec) for i, vec in enumerate(self.vecs)]
+        self.ids = np.array([u.pk for u in self.users])
+        rng = np.random.default_rng(3)
+        probes = self.vecs[:20] + 0.06 * rng.standard_normal((20, 128)).astype(np.float32)
+        self.probes = probes / np.linalg.norm(probes, axis=1, keepdims=True)
+
+    def load(self, kind):
+        with override_settings(FACE_GALLERY_QUANTIZATION=kind):
+            g = EmbeddingGallery()
+            g.load()
+        return g
+
+    def test_results_match_float32_within_quantization_error(self):
+        for kind, atol in (("float16", 1e-3), ("int8", 2e-2)):
+            g = self.load(kind)
+            self.assertIsInstance(g._state.matrix, QuantizedMatrix)
+            for probe, results in zip(self.probes, g.search_batch(list(self.probes), k=3)):
+                expected = brute_force(self.ids, self.vecs, probe, 3)
+                self.assertEqual(results[0][0], expected[0][0])
+                np.testing.assert_allclose(results[0][1], expected[0][1], atol=atol)
+
+    def test_no_float32_copy_is_kept(self):
+        g = self.load("int8")
+        matrix = g._state.matrix
+        self.assertEqual(matrix.codes.dtype, np.int8)
+        self.assertLess(matrix.nbytes, self.vecs.nbytes / 3)
+        self.assertFalse(hasattr(g._state, "exact"))
+
+    def test_search_does_not_query_the_database(self):
+        g = self.load("int8")
+        with self.assertNumQueries(0):
+            g.search_batch(list(self.probes), k=5)
+
+    def test_changes_and_compaction(self):
+        g = self.load("int8")
+        ids = self.ids.tolist()
+        new = random_embeddings(30, seed=12)
+        g.remove(ids[0])
+        with mock.patch.object(gallery, "OVERLAY_COMPACT_MIN", 16), \
+                mock.patch.object(gallery, "OVERLAY_COMPACT_RATIO", 0.05):
+            g.apply(upserts=dict(zip(ids[1:31], new)))
+        state = g._state
+        self.assertEqual(state.extra_count, 0)
+        self.assertEqual(len(state.matrix), len(state.ids))
+
+        expected = np.concatenate([new, self.vecs[31:]])
+        with self.assertNumQueries(0):
+            for probe in list(new[:5]) + list(self.probes[-5:]):
+                (user_id, distance), = g.search(probe, k=1)
+                (expected_id, expected_distance), = brute_force(self.ids[1:], expected, probe, 1)
+                self.assertEqual(user_id, expected_id)
+                # sqrt(2 - 2s) magnifies the int8 error right next to distance 0
+                self.assertAlmostEqual(distance, expected_distance, delta=5e-2)
+
+    def test_scores_in_blocks(self):
+        compact = QuantizedMatrix.encode(self.vecs, "float16")
+        with mock.patch("faceapp.quantization.BLOCK_ROWS", 64):
+            blocked = compact.scores(self.probes)
+        np.testing.assert_allclose(blocked, self.probes @ compact.decode().T, rtol=1e-5, atol=1e-6)
+
+
+@override_settings(FACE_GALLERY_SNAPSHOT=True, FACE_GALLERY_SNAPSHOT_CHECK=0, FACE_GALLERY_SYNC_INTERVAL=None,
+                   FACE_GALLERY_QUANTIZATION="")
+class GallerySnapshotTests(MediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = os.path.join(self.media_root, "snapshots")
+        snapshots = override_settings(FACE_GALLERY_SNAPSHOT_DIR=self.directory)
+        snapshots.enable()
+        self.addCleanup(snapshots.disable)
+        self.vecs = random_embeddings(20)
+        self.users = [create_user(f"s{i}", vec) for i, vec in enumerate(self.vecs)]
+
+    def write(self):
+        call_command("write_gallery_snapshot", stdout=io.StringIO())
+        return current_version(self.directory)
+
+    def test_gallery_maps_the_current_snapshot(self):
+        self.assertEqual(self.write(), "v000001")
+        g = EmbeddingGallery()
+        g.load()
+        self.assertEqual(g.version, "v000001")
+        self.assertFalse(g._state.matrix.flags.writeable)
+        self.assertEqual(len(g), 20)
+        probe = random_embeddings(1, seed=4)[0]
+        self.assertEqual(g.search(probe, k=3), brute_force(np.array([u.pk for u in self.users]), self.vecs, probe, 3))
+
+    def test_changes_after_the_snapshot_are_replayed(self):
+        self.write()
+        moved = self.users[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            moved.set_embedding(random_embeddings(1, seed=30)[0])
+            moved.save()
+            late = create_user("late", random_embeddings(1, seed=31)[0])
+            self.users[1].delete()
+
+        g = EmbeddingGallery()
+        g.load()
+        self.assertEqual(g.version, "v000001")
+        self.assertEqual(len(g), 20)
+        self.assertEqual(g.search(late.get_embedding(), k=1)[0][0], late.pk)
+        self.assertEqual(g.search(moved.get_embedding(), k=1)[0][0], moved.pk)
+        self.assertNotIn(self.users[1].pk, {uid for uid, _ in g.search(self.vecs[1], k=20)})
+
+    def test_newer_snapshot_is_picked_up(self):
+        self.write()
+        g = EmbeddingGallery()
+        g.load()
+        create_user("late", random_embeddings(1, seed=31)[0])
+        self.assertEqual(self.write(), "v000002")
+        g.ensure_loaded()
+        self.assertEqual(g.version, "v000002")
+        self.assertEqual(len(g), 21)
+
+    def test_old_versions_are_deleted(self):
+        for _ in range(4):
+            write_snapshot(np.arange(3), random_embeddings(3), self.directory, keep=2)
+        self.assertEqual(sorted(d for d in os.listdir(self.directory) if d.startswith("v")),
+                         ["v000003", "v000004"])
+
+    def test_snapshot_of_another_model_is_ignored(self):
+        write_snapshot(np.arange(3), random_embeddings(3), self.directory)
+        meta = os.path.join(self.directory, "v000001", "meta.json")
+        with open(meta) as fh:
+            data = fh.read().replace('"model": "', '"model": "Other')
+        with open(meta, "w") as fh:
+            fh.write(data)
+        g = EmbeddingGallery()
+        g.load()
+        self.assertIsNone(g.version)
+        self.assertEqual(len(g), 20)
+
+
+@override_settings(FACE_GALLERY_SYNC_INTERVAL=None, FACE_GALLERY_QUANTIZATION="")
+class GalleryChangeLogTests(TestCase):
+    def setUp(self):
+        self.vecs = random_embeddings(10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users = [create_user(f"c{i}", vec) for i, vec in enumerate(self.vecs)]
+        self.local = EmbeddingGallery()
+        patcher = mock.patch.object(gallery, "_gallery", self.local)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.local.load()
+        self.other = EmbeddingGallery()
+        self.other.load()
+        self.new = random_embeddings(2, seed=50)
+
+    def change(self, user, vec):
+        user.set_embedding(vec)
+        user.save()
+
+    def best(self, g, vec):
+        return g.search(vec, k=1)[0][0]
+
+    def test_change_committed_late_is_not_skipped(self):
+        first, second = self.users[0], self.users[1]
+        # first's transaction writes before second's but commits after it
+        with self.captureOnCommitCallbacks() as pending:
+            self.change(first, self.new[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.change(second, self.new[1])
+        self.assertEqual(self.other.sync(), 1)
+        self.assertEqual(self.best(self.other, self.new[1]), second.pk)
+
+        for callback in pending:
+            callback()
+        self.assertEqual(self.other.sync(), 1)
+        self.assertEqual(self.best(self.other, self.new[0]), first.pk)
+        versions = dict(EmbeddingChange.objects.filter(user_id__in=[first.pk, second.pk])
+                        .order_by("version").values_list("user_id", "version"))
+        self.assertGreater(versions[first.pk], versions[second.pk])
+        self.assertEqual(self.other.synced_version, versions[first.pk])
+        self.assertEqual(gallery.latest_change_version(), versions[first.pk])
+
+    def test_rolled_back_change_leaves_no_trace(self):
+        user = self.users[2]
+        before = EmbeddingChange.objects.count()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.change(user, self.new[0])
+                raise RuntimeError("save failed")
+        self.assertEqual(callbacks, [])
+        self.assertEqual(EmbeddingChange.objects.count(), before)
+        self.assertEqual(self.best(self.local, self.vecs[2]), user.pk)
+        self.assertNotEqual(self.best(self.local, self.new[0]), user.pk)
+
+    def test_commit_patches_local_gallery(self):
+        user = self.users[3]
+        user_id = user.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.change(user, self.new[0])
+            user.delete()
+            self.assertEqual(len(self.local), 10)
+        self.assertEqual(len(self.local), 9)
+        self.assertEqual(self.other.sync(), 1)
+        self.assertEqual(len(self.other), 9)
+        # created, changed, deleted
+        self.assertEqual(EmbeddingChange.objects.filter(user_id=user_id).count(), 3)
+
+    def test_counter(self):
+        self.assertEqual(read_counter("test"), 0)
+        self.assertEqual(bump_counter("test"), 1)
+        self.assertEqual(bump_counter("test"), 2)
+        self.assertEqual(Counter.objects.get(pk="test").value, 2)
+        version = gallery.latest_change_version()
+        gallery.record_changes([])
+        self.assertEqual(gallery.latest_change_version(), version)
+
+
+@override_settings(FACE_TOKEN_CACHE_TTL=30)
+class TokenCacheTests(TestCase):
+    """Each TokenCache stands in for the cache of one worker process."""
+
+    def setUp(self):
+        self.user = create_user("kiosk")
+        self.headers = bearer(self.user)
+
+    def whoami(self, worker, headers=None):
+        with mock.patch.object(token_cache, "_cache", worker):
+            return self.client.get("/api/whoami/", **(headers or self.headers))
+
+    def test_cached_token_costs_one_query(self):
+        worker = token_cache.TokenCache()
+        with self.assertNumQueries(3):
+            self.assertEqual(self.whoami(worker).status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.whoami(worker).json()["user"]["email"], "kiosk@example.com")
+        self.assertEqual(worker.stats()["hits"], 1)
+
+    def test_logout_revokes_on_every_worker(self):
+        first, second = token_cache.TokenCache(), token_cache.TokenCache()
+        other = bearer(create_user("other"))
+        for worker in (first, second):
+            self.assertEqual(self.whoami(worker).status_code, 200)
+            self.assertEqual(self.whoami(worker, other).status_code, 200)
+
+        with mock.patch.object(token_cache, "_cache", first):
+            self.client.post("/api/logout/", **self.headers)
+        response = self.whoami(second)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["error"], "Token revoked or expired")
+        # other tokens are re-validated once, then cached again
+        self.assertEqual(self.whoami(second, other).status_code, 200)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.whoami(second, other).status_code, 200)
+
+    def test_deleted_user_is_dropped_everywhere(self):
+        worker = token_cache.TokenCache()
+        self.assertEqual(self.whoami(worker).status_code, 200)
+        self.user.delete()
+        self.assertEqual(self.whoami(worker).json()["error"], "User not found")
+
+    def test_entries_do_not_outlive_the_token(self):
+        worker = token_cache.TokenCache(ttl=30)
+        worker.put("key", self.user, expires_at=timezone.now() - datetime.timedelta(seconds=1), version=0)
+        self.assertIsNone(worker.get("key", 0))
+        worker.put("key", self.user, version=0)
+        self.assertEqual(worker.get("key", 0), self.user)
+        self.assertIsNone(worker.get("key", 1))
+
+
+class APITokenTests(TestCase):
+    def setUp(self):
+        # tokens minted in the same second are identical: don't reuse another test's cache entries
+        patcher = mock.patch.object(token_cache, "_cache", token_cache.TokenCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = create_user("staff")
+        self.user.set_password("secret")
+        self.user.save()
+
+    def test_login_stores_only_the_digest(self):
+        response = self.client.post("/api/login/", {"email": "staff@example.com", "password": "secret"},
+                                    content_type="application/json")
+        token = response.json()["token"]
+        stored = APIToken.objects.get(user=self.user)
+        self.assertEqual(stored.key_hash, token_digest(token))
+        self.assertEqual(len(stored.key_hash), 64)
+        self.assertNotIn(token, stored.key_hash)
+        self.assertEqual(APIToken.for_token(token).get(), stored)
+
+        response = self.client.get("/api/whoami/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(response.json()["user"]["user_id"], self.user.pk)
+
+    def test_unknown_token_is_rejected(self):
+        token = create_token(self.user)
+        response = self.client.get("/api/whoami/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["error"], "Token not recognized")
+
+    def make_tokens(self, n, **fields):
+        APIToken.objects.bulk_create([
+            APIToken(key_hash=token_digest(f"{fields}-{i}"), user=self.user, **fields) for i in range(n)])
+
+    def test_prune_deletes_dead_tokens_in_batches(self):
+        past = timezone.now() - datetime.timedelta(hours=1)
+        future = timezone.now() + datetime.timedelta(hours=1)
+        self.make_tokens(5, expires_at=past)
+        self.make_tokens(3, expires_at=future, revoked=True)
+        self.make_tokens(2, expires_at=future)
+        self.make_tokens(1, expires_at=None)
+
+        self.assertEqual(prune_tokens(batch_size=3, max_batches=1), 3)
+        out = io.StringIO()
+        call_command("prune_api_tokens", "--batch-size", "2", "--pause", "0", stdout=out)
+        self.assertIn("Deleted 5 expired/revoked tokens", out.getvalue())
+        self.assertEqual(APIToken.objects.count(), 3)
+        self.assertFalse(APIToken.objects.filter(revoked=True).exists())
+
+    def test_login_prunes_occasionally(self):
+        self.make_tokens(2, expires_at=timezone.now() - datetime.timedelta(hours=1))
+        with override_settings(FACE_TOKEN_PRUNE_PROBABILITY=0):
+            maybe_prune_tokens()
+        self.assertEqual(APIToken.objects.count(), 2)
+        with override_settings(FACE_TOKEN_PRUNE_PROBABILITY=1):
+            maybe_prune_tokens()
+        self.assertEqual(APIToken.objects.count(), 0)
+
+
+def at(hour, minute=0, day=1):
+    return datetime.datetime(2026, 3, day, hour, minute, tzinfo=datetime.timezone.utc)
+
+
+class PunchTests(TestCase):
+    def setUp(self):
+        self.user = create_user("worker")
+
+    def day(self, day=1):
+        return Attendance.objects.get(user=self.user, date=datetime.date(2026, 3, day))
+
+    def check_login_then_logout(self):
+        self.assertEqual(attendance.punch(self.user, at(8, 0)), (attendance.LOGIN, None))
+        self.assertEqual(attendance.punch(self.user, at(12, 30)), (attendance.LOGOUT, 4.5))
+        self.assertEqual(attendance.punch(self.user, at(17, 15), kiosk="gate", distance=0.4), (attendance.LOGOUT, 9.25))
+
+        row = self.day()
+        self.assertEqual((row.login_time, row.logout_time, row.working_hours), (at(8, 0), at(17, 15), 9.25))
+        self.assertEqual(PunchEvent.objects.filter(user=self.user).count(), 3)
+        self.assertEqual(PunchEvent.objects.get(timestamp=at(17, 15)).kiosk, "gate")
+
+        # the next day starts a new row
+        self.assertEqual(attendance.punch(self.user, at(9, 0, day=2)), (attendance.LOGIN, None))
+        self.assertEqual(Attendance.objects.filter(user=self.user).count(), 2)
+
+    def test_upsert_login_then_logout(self):
+        self.assertIn(connection.vendor, attendance._HOURS_SQL)
+        self.check_login_then_logout()
+
+    def test_locking_fallback_for_other_databases(self):
+        with mock.patch.object(attendance, "_HOURS_SQL", {}):
+            self.check_login_then_logout()
+
+    def test_row_without_login_gets_one(self):
+        Attendance.objects.create(user=self.user, date=datetime.date(2026, 3, 1))
+        self.assertEqual(attendance.punch(self.user, at(7, 45)), (attendance.LOGIN, None))
+        self.assertEqual(self.day().login_time, at(7, 45))
+        self.assertIsNone(self.day().logout_time)
+
+    def test_kiosk_response(self):
+        user = self.user
+        self.assertEqual(views.punch_attendance(user, 0.3)["action"], "login")
+        result = views.punch_attendance(user, 0.3)
+        self.assertEqual((result["action"], result["working_hours"]), ("logout", 0.0))
+
+    def test_written_through_by_default(self):
+        with mock.patch.object(attendance, "_buffer", None):
+            self.assertIsNone(attendance.get_punch_buffer())
+        attendance.punch(self.user, at(8, 0))
+        self.assertEqual(self.day().login_time, at(8, 0))
+
+
+class PunchBufferTests(TestCase):
+    def setUp(self):
+        self.user = create_user("worker")
+        # long interval: only explicit flushes write
+        self.buffer = attendance.PunchBuffer(max_events=50, interval=3600, max_pending=3)
+
+    def day(self):
+        return Attendance.objects.get(user=self.user, date=datetime.date(2026, 3, 1))
+
+    def event(self, hour, minute=0):
+        return PunchEvent(user=self.user, timestamp=at(hour, minute), date=datetime.date(2026, 3, 1))
+
+    def test_write_events_merges_with_stored_row(self):
+        attendance.punch(self.user, at(10, 0))
+        attendance.write_events([self.event(8, 0), self.event(12, 0)])
+        row = self.day()
+        self.assertEqual((row.login_time, row.logout_time, row.working_hours), (at(8, 0), at(12, 0), 4.0))
+
+        # an event inside the stored span changes nothing
+        attendance.write_events([self.event(11, 0)])
+        row = self.day()
+        self.assertEqual((row.login_time, row.logout_time, row.working_hours), (at(8, 0), at(12, 0), 4.0))
+        self.assertEqual(PunchEvent.objects.filter(user=self.user).count(), 4)
+
+    def test_buffered_punches_are_answered_and_flushed(self):
+        with mock.patch.object(attendance, "get_punch_buffer", return_value=self.buffer):
+            self.assertEqual(attendance.punch(self.user, at(8, 0)), (attendance.LOGIN, None))
+            self.assertEqual(attendance.punch(self.user, at(9, 30)), (attendance.LOGOUT, 1.5))
+        self.assertFalse(Attendance.objects.filter(user=self.user).exists())
+
+        self.assertEqual(self.buffer.flush(), 2)
+        row = self.day()
+        self.assertEqual((row.login_time, row.logout_time, row.working_hours), (at(8, 0), at(9, 30), 1.5))
+        self.assertEqual(self.buffer.stats()["pending"], 0)
+
+    def test_failed_flush_keeps_at_most_max_pending(self):
+        for hour in (8, 9):
+            self.buffer.add(self.event(hour))
+        with mock.patch.object(attendance, "write_events", side_effect=RuntimeError("db down")):
+            self.assertEqual(self.buffer.flush(), 0)
+            for hour in (10, 11):
+                self.buffer.add(self.event(hour))
+            self.assertEqual(self.buffer.flush(), 0)
+        stats = self.buffer.stats()
+        self.assertEqual((stats["pending"], stats["errors"], stats["dropped"]), (3, 2, 1))
+        self.assertEqual(stats["last_error"], "RuntimeError: db down")
+
+        # the oldest event was dropped, the rest are written on recovery
+        self.assertEqual(self.buffer.flush(), 3)
+        row = self.day()
+        self.assertEqual((row.login_time, row.logout_time), (at(9, 0), at(11, 0)))
+
+
+class ReportTests(TestCase):
+    def setUp(self):
+        self.sales = Department.objects.create(department_name="Sales")
+        self.admin = create_user("admin", is_admin=True)
+        self.users = [create_user(f"staff{n}", department=self.sales) for n in range(3)]
+        self.headers = bearer(self.admin)
+
+    def get(self, url, **params):
+        return self.client.get(url, params, **self.headers)
+
+    def pages(self, url, **params):
+        """Every page of a keyset-paged report, following next_cursor."""
+        pages, cursor = [], None
+        while True:
+            query = dict(params, cursor=cursor) if cursor else params
+            response = self.get(url, **query)
+            self.assertEqual(response.status_code, 200, response.content)
+            body = response.json()
+            pages.append(body["results"])
+            cursor = body["next_cursor"]
+            if cursor is None:
+                return pages
+
+    def test_history_pages_newest_first(self):
+        user = self.users[0]
+        for day in range(1, 6):
+            attendance.punch(user, at(9, 0 if day % 2 else 45, day=day))
+        pages = self.pages("/api/reports/history/", user_id=user.pk, limit=2, **{"from": "2026-03-01", "to": "2026-03-31"})
+        self.assertEqual([[row["date"] for row in page] for page in pages],
+                         [["2026-03-05", "2026-03-04"], ["2026-03-03", "2026-03-02"], ["2026-03-01"]])
+
+        totals = self.get("/api/reports/history/", user_id=user.pk, **{"from": "2026-03-01", "to": "2026-03-31"}).json()["totals"]
+        self.assertEqual((totals["days"], totals["late"]), (5, 2))
+
+    def test_department_daily_pages_by_date_then_department(self):
+        other = Department.objects.create(department_name="Support")
+        create_user("helper", department=other)
+        for day in (1, 2):
+            attendance.punch(self.users[0], at(9, day=day))
+            attendance.punch(User.objects.get(name="helper"), at(9, day=day))
+        pages = self.pages("/api/reports/departments/", limit=3, **{"from": "2026-03-01", "to": "2026-03-02"})
+        self.assertEqual(
+            [(row["date"], row["department_id"]) for page in pages for row in page],
+            [("2026-03-01", self.sales.pk), ("2026-03-01", other.pk),
+             ("2026-03-02", self.sales.pk), ("2026-03-02", other.pk)])
+        self.assertEqual([len(page) for page in pages], [3, 1])
+
+    def test_late_and_absent_lists(self):
+        attendance.punch(self.users[0], at(9, 45))
+        attendance.punch(self.users[1], at(9, 15))
+        late = self.pages("/api/reports/late/", date="2026-03-01", limit=1)
+        self.assertEqual([row["user_id"] for page in late for row in page], [self.users[0].pk])
+        absent = self.pages("/api/reports/absent/", date="2026-03-01", limit=1)
+        self.assertEqual([row["user_id"] for page in absent for row in page], [self.admin.pk, self.users[2].pk])
+
+    @override_settings(TIME_ZONE="Asia/Kolkata")
+    def test_late_is_judged_in_local_time(self):
+        # 04:15 UTC is 09:45 in Kolkata, 03:45 UTC is 09:15
+        attendance.punch(self.users[0], at(4, 15))
+        attendance.punch(self.users[1], at(3, 45))
+        rows, _ = reports.late_list(datetime.date(2026, 3, 1))
+        self.assertEqual([row["user_id"] for row in rows], [self.users[0].pk])
+
+    def test_malformed_cursor_is_rejected(self):
+        dates = {"from": "2026-03-01", "to": "2026-03-31"}
+        for url, cursor in [
+            ("/api/reports/history/", "WyJ4Il0="),  # ["x"]
+            ("/api/reports/history/", reports.encode_cursor([])),
+            ("/api/reports/history/", "not base64!"),
+            ("/api/reports/departments/", reports.encode_cursor(["2026-03-01"])),
+            ("/api/reports/departments/", reports.encode_cursor(["2026-03-01", "x"])),
+            ("/api/reports/departments/monthly/", reports.encode_cursor([1, 2])),
+            ("/api/reports/users/monthly/", reports.encode_cursor([True])),
+            ("/api/reports/absent/", reports.encode_cursor(["1"])),
+        ]:
+            with self.subTest(url=url, cursor=cursor):
+                response = self.get(url, cursor=cursor, **dates)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()["message"], "Invalid cursor")
+
+
+class SummaryTests(TestCase):
+    def setUp(self):
+        self.sales = Department.objects.create(department_name="Sales")
+        self.support = Department.objects.create(department_name="Support")
+        self.users = [create_user("ann", department=self.sales), create_user("bob", department=self.sales),
+                      create_user("cid", department=self.support), create_user("dee")]
+
+    def summaries(self):
+        def rows(model, *key):
+            return {
+                tuple(row.pop(field) for field in key): row
+                for row in model.objects.values(*key, *(f.name for f in model._meta.fields
+                                                        if f.name not in key + ("id",)))
+            }
+        return (rows(DepartmentDaySummary, "date", "department_id"),
+                rows(DepartmentMonthSummary, "month", "department_id"),
+                rows(UserMonthSummary, "user", "month"))
+
+    def assertMatchesRebuild(self):
+        incremental = self.summaries()
+        summaries.rebuild(datetime.date(2026, 3, 1), datetime.date(2026, 4, 30))
+        rebuilt = self.summaries()
+        for got, expected in zip(incremental, rebuilt):
+            self.assertEqual(got.keys(), expected.keys())
+            for key, row in expected.items():
+                self.assertAlmostEqual(got[key].pop("total_hours"), row.pop("total_hours"), msg=key)
+                self.assertEqual(got[key], row, key)
+
+    def test_deltas_match_a_rebuild(self):
+        ann, bob, cid, dee = self.users
+        attendance.punch(ann, at(8, 0))
+        attendance.punch(ann, at(12, 0))
+        attendance.punch(ann, at(17, 30))
+        attendance.punch(bob, at(9, 45))  # late
+        attendance.punch(cid, at(10, 0, day=2))
+        attendance.punch(dee, at(8, 0, day=31))
+        attendance.punch(dee, at(9, 0, day=31))
+        attendance.write_events([
+            PunchEvent(user=bob, timestamp=at(7, 0), date=datetime.date(2026, 3, 1)),
+            PunchEvent(user=cid, timestamp=at(8, 0, day=3), date=datetime.date(2026, 3, 3)),
+        ])
+        self.assertMatchesRebuild()
+
+        # admin edits: move a day into April, fix hours, delete a row
+        row = Attendance.objects.get(user=dee)
+        row.date = datetime.date(2026, 4, 1)
+        row.save()
+        row = Attendance.objects.get(user=cid, date=datetime.date(2026, 3, 2))
+        row.logout_time = at(18, 0, day=2)
+        row.calculate_working_hours()
+        Attendance.objects.get(user=bob).delete()
+        self.assertMatchesRebuild()
+
+        day = DepartmentDaySummary.objects.get(date=datetime.date(2026, 3, 1), department_id=self.sales.pk)
+        self.assertEqual((day.present, day.late, day.total_hours), (1, 0, 9.5))
+        self.assertFalse(DepartmentMonthSummary.objects.filter(department_id=0, month=datetime.date(2026, 3, 1)).exists())
+
+    def test_punch_applies_deltas_without_aggregating(self):
+        ann = self.users[0]
+        attendance.punch(ann, at(8, 0))
+        with CaptureQueriesContext(connection) as queries:
+            attendance.punch(ann, at(16, 0))
+        sql = " ".join(q["sql"].upper() for q in queries.captured_queries)
+        self.assertNotIn("GROUP BY", sql)
+        self.assertNotIn("COUNT(", sql)
+        month = UserMonthSummary.objects.get(user=ann)
+        self.assertEqual((month.days, month.total_hours), (1, 8.0))
+
+    def test_department_move_carries_the_day_over(self):
+        ann = self.users[0]
+        attendance.punch(ann, at(8, 0, day=2))
+        attendance.punch(ann, at(9, 45))  # late, logged in while in Sales
+        ann.department = self.support
+        ann.save()
+        attendance.punch(ann, at(17, 30))  # logged out while in Support
+        self.assertMatchesRebuild()
+        self.assertFalse(DepartmentDaySummary.objects.filter(department_id=self.sales.pk).exists())
+        day = DepartmentDaySummary.objects.get(date=datetime.date(2026, 3, 1), department_id=self.support.pk)
+        self.assertEqual((day.present, day.late, day.total_hours), (1, 1, 7.75))
+
+        ann.department = None
+        ann.save()
+        self.assertMatchesRebuild()
+
+    def test_dropped_deltas_are_reported(self):
+        ann = self.users[0]
+        attendance.punch(ann, at(8, 0))
+        DepartmentDaySummary.objects.all().delete()
+        with mock.patch("builtins.print") as log:
+            attendance.punch(ann, at(16, 0))
+        self.assertIn("rebuild_attendance_summaries", " ".join(str(c) for c in log.call_args_list))
+
+    def test_migration_backfills_existing_attendance(self):
+        attendance.punch(self.users[0], at(8, 0))
+        attendance.punch(self.users[2], at(10, 0, day=2))
+        expected = self.summaries()
+        for model in (DepartmentDaySummary, DepartmentMonthSummary, UserMonthSummary):
+            model.objects.all().delete()
+
+        backfill = importlib.import_module("faceapp.migrations.0013_backfill_attendance_summaries")
+        backfill.backfill_summaries(django_apps, None)
+        self.assertEqual(self.summaries(), expected)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        sales = Department.objects.create(department_name="Sales")
+        self.admin = create_user("admin", is_admin=True)
+        self.staff = create_user("staff", department=sales)
+        attendance.punch(self.staff, at(8, 0))
+        attendance.punch(self.staff, at(16, 30))
+        attendance.punch(self.staff, at(9, 0, day=5))
+        self.headers = bearer(self.admin)
+
+    def export(self, url, **params):
+        response = self.client.get(url, params, **self.headers)
+        self.assertEqual(response.status_code, 200, getattr(response, "content", b""))
+        return response, b"".join(response.streaming_content)
+
+    def test_users_csv(self):
+        response, body = self.export("/api/exports/users/")
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="users.csv"')
+        lines = list(csv.reader(io.StringIO(body.decode("utf-8"))))
+        self.assertEqual(lines[0], exports.USER_HEADER)
+        self.assertEqual([line[:3] for line in lines[1:]],
+                         [["admin", "admin@example.com", ""], ["staff", "staff@example.com", "Sales"]])
+
+    def test_attendance_json_in_range_and_gzip(self):
+        _, body = self.export("/api/exports/attendance/", format="json", **{"from": "2026-03-01", "to": "2026-03-02"})
+        rows = json.loads(body)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]["Department"], rows[0]["Login Time"], rows[0]["Working Hours"]),
+                         ("Sales", "2026-03-01 08:00:00", 8.5))
+
+        response, body = self.export("/api/exports/attendance/", gzip="1", **{"from": "2026-03-01", "to": "2026-03-31"})
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        lines = gzip.decompress(body).decode("utf-8").splitlines()
+        self.assertEqual(len(lines), 3)
+
+    def test_chunked_output_matches(self):
+        rows = [[f"user{n}", f"user{n}@example.com", "", "2026-03-01 08:00:00"] for n in range(5000)]
+        with mock.patch.object(exports, "CHUNK_BYTES", 1024):
+            chunks = list(exports.csv_chunks(exports.USER_HEADER, iter(rows)))
+        self.assertGreater(len(chunks), 10)
+        self.assertEqual(list(csv.reader(io.StringIO("".join(chunks))))[1:], rows)
+
+    def test_admin_only(self):
+        response = self.client.get("/api/exports/users/", **bearer(self.staff))
+        self.assertEqual(response.status_code, 403)
+
+
+class LockedCSVWriterTests(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "exports", "attendance.csv")
+
+    def read(self):
+        with open(self.path, newline="", encoding="utf-8") as f:
+            return list(csv.reader(f))
+
+    def test_each_row_is_on_disk_immediately(self):
+        writer = utils.LockedCSVWriter(self.path, ["Name", "Time"])
+        writer.writerow(["ann", "08:00"])
+        self.assertEqual(self.read(), [["Name", "Time"], ["ann", "08:00"]])
+        writer.writerow(["bob, jr", "08:01"])
+        self.assertEqual(self.read()[-1], ["bob, jr", "08:01"])
+
+    def test_concurrent_writers_never_interleave(self):
+        # two instances stand in for two worker processes sharing the file
+        writers = [utils.LockedCSVWriter(self.path, ["Name", "Time"]) for _ in range(2)]
+        rows = [[f"user{n}" * 50, str(n)] for n in range(400)]
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda item: writers[item[0] % 2].writerow(item[1]), enumerate(rows)))
+        lines = self.read()
+        self.assertEqual(lines[0], ["Name", "Time"])
+        self.assertCountEqual(lines[1:], rows)
+
+
+class EnrollmentTests(MediaTestCase):
+    CSV = ("name,email,department,photo\n"
+           "Ann,ann@example.com,Sales,\n"
+           "Bob,bob@example.com,1,bob.png\n"
+           "Cid,cid@example.com,Nowhere,\n"
+           "Dup,ann@example.com,,\n"
+           "Eve,eve@example.com,,\n")
+
+    def setUp(self):
+        super().setUp()
+        self.sales = Department.objects.create(department_name="Sales")
+        self.admin = create_user("admin", is_admin=True)
+        self.vectors = {10: random_embeddings(1, seed=10)[0], 60: random_embeddings(1, seed=60)[0]}
+
+    def archive(self, photos=None):
+        photos = photos or {"people/ann@example.com.jpg": jpeg(10), "bob.png": jpeg(60), "cid@example.com.jpg": jpeg(10)}
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as zf:
+            for name, data in photos.items():
+                zf.writestr(name, data)
+        return buf.getvalue()
+
+    def stored_photos(self):
+        return sorted(name for _, _, names in os.walk(self.media_root) for name in names)
+
+    def post(self, **extra):
+        return self.client.post("/api/admin/enroll/", {
+            "csv": SimpleUploadedFile("people.csv", self.CSV.replace(",1,", f",{self.sales.pk},").encode()),
+            "photos": SimpleUploadedFile("photos.zip", self.archive()),
+            **extra,
+        }, **bearer(self.admin))
+
+    def test_endpoint_queues_embeddings(self):
+        with mock.patch.object(inference, "represent_batch", side_effect=AssertionError("model ran")):
+            response = self.post()
+        self.assertEqual(response.status_code, 200, response.content)
+        body = response.json()
+        self.assertEqual((body["created"], body["queued"]), (2, True))
+        self.assertEqual([(f["line"], f["error"]) for f in body["failures"]], [
+            (4, "unknown department 'Nowhere'"),
+            (5, "duplicate email in CSV"),
+            (6, "photo not found in archive"),
+        ])
+        users = User.objects.filter(pk__in=body["user_ids"]).order_by("name")
+        self.assertEqual([(u.name, u.embedding_status, u.department_id) for u in users],
+                         [("Ann", EMBEDDING_PENDING, self.sales.pk), ("Bob", EMBEDDING_PENDING, self.sales.pk)])
+        self.assertEqual(set(EmbeddingJob.objects.values_list("user_id", flat=True)), set(body["user_ids"]))
+        self.assertEqual(Department.objects.get(pk=self.sales.pk).total_employees, 2)
+        self.assertEqual(len(self.stored_photos()), 2)
+
+    @override_settings(FACE_ENROLL_MAX_ROWS=4)
+    def test_endpoint_rejects_too_many_rows(self):
+        with mock.patch("faceapp.enrollment.make_password", side_effect=AssertionError("hashed")):
+            response = self.post()
+        self.assertEqual(response.status_code, 413, response.content)
+        self.assertIn("enroll_users", response.json()["message"])
+        self.assertEqual(User.objects.count(), 1)
+        self.assertEqual(self.stored_photos(), [])
+
+    def test_photos_are_read_one_at_a_time(self):
+        read, live = enrollment.PhotoSource.read, []
+
+        class Photo(bytes):
+            def __del__(self):
+                live.remove(id(self))
+
+        def read_one(source, name):
+            self.assertEqual(live, [])  # the previous photo was released
+            photo = Photo(read(source, name))
+            live.append(id(photo))
+            return photo
+
+        with mock.patch.object(enrollment.PhotoSource, "read", autospec=True, side_effect=read_one):
+            result = enrollment.enroll(self.CSV.replace(",1,", f",{self.sales.pk},").encode(),
+                                       io.BytesIO(self.archive()), queue=True, log=lambda *a: None)
+        self.assertEqual(result["created"], 2)
+
+    def test_failed_insert_leaves_no_photos(self):
+        with mock.patch.object(enrollment, "_insert", side_effect=RuntimeError("database went away")):
+            response = self.post()
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.stored_photos(), [])
+        self.assertFalse(User.objects.filter(email="ann@example.com").exists())
+
+    def test_colliding_row_is_reported_and_its_photo_removed(self):
+        insert = enrollment._insert
+
+        def racing_insert(users, queue):
+            # another request enrolled Bob between the email check and the insert
+            insert(users, queue)
+            if any(u.email == "bob@example.com" for u in users):
+                raise IntegrityError("duplicate key value violates unique constraint")
+
+        with mock.patch.object(enrollment, "_insert", side_effect=racing_insert):
+            result = enrollment.enroll(self.CSV.replace(",1,", f",{self.sales.pk},").encode(),
+                                       io.BytesIO(self.archive()), queue=True, log=lambda *a: None)
+        self.assertEqual(result["created"], 1)
+        self.assertIn((3, "bob@example.com"), [(f["line"], f["email"]) for f in result["failures"]])
+        self.assertEqual(User.objects.get(pk=result["user_ids"][0]).email, "ann@example.com")
+        self.assertEqual(len(self.stored_photos()), 1)
+        self.assertEqual(Department.objects.get(pk=self.sales.pk).total_employees, 1)
+        self.assertEqual(EmbeddingJob.objects.count(), 1)
+
+    def test_command_embeds_inline(self):
+        directory = os.path.join(self.media_root, "incoming")
+        os.makedirs(directory)
+        csv_path = os.path.join(directory, "people.csv")
+        with open(csv_path, "w") as fh:
+            fh.write("name,email\nAnn,ann@example.com\nBob,bob@example.com\n")
+        for name, grey in (("ann@example.com.jpg", 10), ("bob@example.com.jpg", 60)):
+            with open(os.path.join(directory, name), "wb") as fh:
+                fh.write(jpeg(grey))
+
+        with mock.patch.object(inference, "represent_batch", side_effect=embed_by_grey(self.vectors)), \
+                mock.patch("faceapp.management.commands.enroll_users.HAS_DEEPFACE", True), \
+                self.captureOnCommitCallbacks(execute=True):
+            call_command("enroll_users", csv_path, directory, stdout=io.StringIO())
+        for email, grey in (("ann@example.com", 10), ("bob@example.com", 60)):
+            user = User.objects.get(email=email)
+            self.assertEqual(user.embedding_status, EMBEDDING_READY)
+            np.testing.assert_allclose(user.get_embedding(), self.vectors[grey], rtol=1e-6)
+        self.assertEqual(EmbeddingChange.objects.count(), 2)
+        self.assertFalse(EmbeddingJob.objects.exists())
@@ -0,0 +1,124 @@
+# faceapp/token_cache.py
+"""
+Short-lived in-process cache of validated API tokens.
+
+Kiosks call ``/api/start/`` every few seconds with the same bearer token;
+without a cache every call costs an APIToken and a User query before the
+view runs. A validated token maps to its user for ``FACE_TOKEN_CACHE_TTL``
+seconds (never past the token's own expiry).
+
+Revocation: ``logout_api`` (and deleting a user) drops the entry locally
+and bumps a revocation version kept in a ``Counter`` row. Each request
+reads that row once, a primary-key lookup instead of the two token
+queries, and entries cached under an older version are re-checked against
+the database, so a logout takes effect on every worker immediately.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+# Counter row bumped on every revocation
+REVOCATION_COUNTER = "token-revocations"
+
+
+def revocation_version():
+    from .models import read_counter
+    return read_counter(REVOCATION_COUNTER)
+
+
+def bump_revocation_version():
+    from .models import bump_counter
+    with transaction.atomic():
+        return bump_counter(REVOCATION_COUNTER)
+
+
+class TokenCache:
+    def __init__(self, max_entries=1024, ttl=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, version, user)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        """
+        Cached user for the token ``key``, or None (also when stale or
+        cached before revocation ``version``).
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < now or item[1] != version:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[2]
+
+    def put(self, key, user, expires_at=None, version=None):
+        """
+        Cache ``user`` for ``key``. ``version`` must be the revocation
+        version read *before* the token was validated, so a revocation
+        that races with validation is not cached over.
+        """
+        ttl = self.ttl
+        if expires_at is not None:
+            ttl = min(ttl, (expires_at - timezone.now()).total_seconds())
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, version, user)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    """The process-wide cache, or None when ``FACE_TOKEN_CACHE_TTL`` is 0."""
+    global _cache
+    if _cache is None:
+        ttl = getattr(settings, "FACE_TOKEN_CACHE_TTL", 30)
+        if not ttl:
+            return None
+        with _cache_lock:
+            if _cache is None:
+                _cache = TokenCache(max_entries=getattr(settings, "FACE_TOKEN_CACHE_SIZE", 1024), ttl=ttl)
+    return _cache
+
+
+def revoke(key):
+    """Forget ``key`` here and invalidate cached tokens in every worker."""
+    tokens = get_token_cache()
+    if tokens is not None:
+        tokens.discard(key)
+    bump_revocation_version()
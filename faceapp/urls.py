@@ -8,10 +8,23 @@ urlpatterns = [
     path('api/login/', views.login_api),
     path('api/logout/', views.logout_api),
     path('api/start/', views.start_attendance),
+    path('api/start/batch/', views.start_attendance_batch),
+    path('api/start/file/', views.start_attendance_file),
     path('api/verify-face/', views.verify_face),
     path('api/departments/', views.get_departments),
     path('api/departments/add/', views.add_department),
     # admin helper endpoints for delete etc if you need
     path('api/whoami/', views.whoami),
+    path('api/health/', views.health),
+    path('api/metrics/', views.metrics),
+    path('api/reports/history/', views.report_history),
+    path('api/reports/departments/', views.report_departments),
+    path('api/reports/departments/monthly/', views.report_departments_monthly),
+    path('api/reports/users/monthly/', views.report_users_monthly),
+    path('api/reports/late/', views.report_late),
+    path('api/reports/absent/', views.report_absent),
+    path('api/exports/users/', views.export_users),
+    path('api/exports/attendance/', views.export_attendance),
+    path('api/admin/enroll/', views.enroll_users),
 
 ]
@@ -1,12 +1,66 @@
 # faceapp/utils.py
 import os
 import csv
+import io
+import tempfile
+import threading
 from django.conf import settings
-from .models import User, Attendance
+from .exports import USER_HEADER, user_rows
+
+try:
+    import fcntl  # POSIX only: serialises appends across gunicorn workers
+except ImportError:
+    fcntl = None
 
 EXPORT_DIR = os.path.join(settings.BASE_DIR, 'exports')
 USERS_CSV = os.path.join(EXPORT_DIR, 'users.csv')
 ATTENDANCE_CSV = os.path.join(EXPORT_DIR, 'attendance.csv')
+ATTENDANCE_HEADER = ['Name', 'Email', 'Department', 'Timestamp']
+
+
+class LockedCSVWriter:
+    """
+    CSV appender that is safe across threads and processes.
+
+    Each row is appended as soon as it is written, as one write under an
+    exclusive ``flock`` on the file, so concurrent workers never
+    interleave partial lines and a killed worker loses nothing. The
+    header is written, under the same lock, when the file is empty.
+    """
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self._lock = threading.Lock()
+
+    def writerow(self, row):
+        buf = io.StringIO()
+        csv.writer(buf).writerow(row)
+        with self._lock:
+            self._append(buf.getvalue())
+
+    def ensure_file(self):
+        """Create the file with its header if it does not exist yet."""
+        self._append('')
+
+    def _append(self, text):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', newline='', encoding='utf-8') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0, os.SEEK_END)
+                if f.tell() == 0:
+                    csv.writer(f).writerow(self.header)
+                f.write(text)
+                f.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+_attendance_writer = LockedCSVWriter(ATTENDANCE_CSV, ATTENDANCE_HEADER)
+
 
 def ensure_csv_files():
     os.makedirs(EXPORT_DIR, exist_ok=True)
@@ -14,33 +68,30 @@ def ensure_csv_files():
     if not os.path.exists(USERS_CSV):
         with open(USERS_CSV, 'w', newline='', encoding='utf-8') as f:
             w = csv.writer(f)
-            w.writerow(['Name', 'Email', 'Department', 'Created At'])
+            w.writerow(USER_HEADER)
     # attendance.csv
     if not os.path.exists(ATTENDANCE_CSV):
-        with open(ATTENDANCE_CSV, 'w', newline='', encoding='utf-8') as f:
-            w = csv.writer(f)
-            w.writerow(['Name', 'Email', 'Department', 'Timestamp'])
+        _attendance_writer.ensure_file()
 
 def update_users_csv():
-    ensure_csv_files()
-    with open(USERS_CSV, 'w', newline='', encoding='utf-8') as f:
-        w = csv.writer(f)
-        w.writerow(['Name', 'Email', 'Department', 'Created At'])
-        for u in User.objects.select_related('department').all():
-            w.writerow([
-                u.name,
-                u.email,
-                u.department.department_name if u.department else '',
-                u.created_at.strftime('%Y-%m-%d %H:%M:%S')
-            ])
+    """Rewrite users.csv from a streamed query; readers never see a partial file."""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=EXPORT_DIR, prefix='.users-', suffix='.csv')
+    try:
+        with os.fdopen(fd, 'w', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            w.writerow(USER_HEADER)
+            w.writerows(user_rows())
+        os.replace(tmp, USERS_CSV)
+    except BaseException:
+        os.unlink(tmp)
+        raise
 
 def add_attendance_to_csv(user, timestamp):
-    ensure_csv_files()
-    with open(ATTENDANCE_CSV, 'a', newline='', encoding='utf-8') as f:
-        w = csv.writer(f)
-        w.writerow([
-            user.name,
-            user.email,
-            user.department.department_name if user.department else '',
-            timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        ])
+    """Append one line to attendance.csv (under a file lock)."""
+    _attendance_writer.writerow([
+        user.name,
+        user.email,
+        user.department.department_name if user.department else '',
+        timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+    ])
@@ -1,22 +1,48 @@
 # faceapp/views.py
-import json, io, base64, os
+import json, io, base64, os, logging
 from datetime import date
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from django.conf import settings
-from PIL import Image
+from django.db import transaction
 import numpy as np
 import cv2
 import datetime
 
-from .auth import create_token, ACCESS_TOKEN_HOURS
+from .auth import create_token, maybe_prune_tokens, token_digest, ACCESS_TOKEN_HOURS
 from .models import User, Attendance, Department, APIToken
+from .cache import get_embedding_cache
+from . import attendance, enrollment, exports, reports, token_cache
+from .embeddings import normalize
+from .imaging import decode_image, is_binary_request
+
+logger = logging.getLogger(__name__)
 
 
 def home(request):
     return HttpResponse("Face Attendance Backend. Use /api/... endpoints")
 
+
+def health(request):
+    """Load balancer probe: 503 until this worker's model is warm."""
+    state = inference.status()
+    return JsonResponse(state, status=200 if state["ready"] else 503)
+
+
+def metrics(request):
+    """Counters for tuning inference: readiness, micro-batching, caching."""
+    cache = get_embedding_cache()
+    tokens = token_cache.get_token_cache()
+    punches = attendance.get_punch_buffer()
+    return JsonResponse({
+        "inference": inference.status(),
+        "batching": inference.batching_stats(),
+        "embedding_cache": cache.stats() if cache is not None else None,
+        "token_cache": tokens.stats() if tokens is not None else None,
+        "punch_buffer": punches.stats() if punches is not None else None,
+    })
+
 # ---------------------------
 # Departments (public)
 # ---------------------------
@@ -39,12 +65,9 @@ def add_department(request):
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
 
-# DeepFace optional
-try:
-    from deepface import DeepFace
-    HAS_DEEPFACE = True
-except Exception:
-    HAS_DEEPFACE = False
+# DeepFace optional (see faceapp/inference.py)
+from .inference import HAS_DEEPFACE, represent, represent_batch
+from . import inference, prefilter
 
 
 # ---------------------------
@@ -97,20 +120,14 @@ def register_user(request):
             # default password if not provided
             user.set_password(email.split("@")[0] + "123")
 
+        # queues the embedding job for the photo (faceapp/jobs.py)
         user.save()
 
-        # Create embedding if photo saved
-        if HAS_DEEPFACE and getattr(user, 'photo', None):
-            try:
-                img_path = os.path.join(settings.MEDIA_ROOT, str(user.photo))
-                rep = DeepFace.represent(img_path=img_path, model_name='Facenet', enforce_detection=False)
-                if rep and isinstance(rep, list) and "embedding" in rep[0]:
-                    user.embedding = json.dumps(rep[0]["embedding"])
-                    user.save(update_fields=['embedding'])
-            except Exception as e:
-                print('Embedding creation failed:', e)
-
-        return JsonResponse({"message": "User registered successfully"}, status=201)
+        return JsonResponse({
+            "message": "User registered successfully",
+            "user_id": user.id,
+            "embedding_status": user.embedding_status,
+        }, status=201)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
 
@@ -137,12 +154,22 @@ def login_api(request):
         if not user.check_password(password):
             return JsonResponse({"error": "Invalid credentials"}, status=401)
 
-        token = create_token(user)
+        # optional: bind the token to a kiosk site (scoped face searches)
+        kiosk = {}
+        if data.get("kiosk_department"):
+            if not Department.objects.filter(department_id=data["kiosk_department"]).exists():
+                return JsonResponse({"error": "Invalid kiosk department"}, status=400)
+            kiosk["department"] = int(data["kiosk_department"])
+        elif data.get("kiosk_location"):
+            kiosk["location"] = str(data["kiosk_location"])
+
+        token = create_token(user, kiosk=kiosk or None)
 
         # Persist token server-side so it can be revoked/audited (Postgres)
         try:
             expires = timezone.now() + datetime.timedelta(hours=ACCESS_TOKEN_HOURS)
-            APIToken.objects.create(key=token, user=user, expires_at=expires)
+            APIToken.objects.create(key_hash=token_digest(token), user=user, expires_at=expires)
+            maybe_prune_tokens()
         except Exception as e:
             # do not fail login if DB logging of token fails, but log for debug
             print("Warning: could not persist APIToken:", e)
@@ -170,55 +197,190 @@ def login_api(request):
 # ---------------------------
 # Face Recognition Helper
 # ---------------------------
-def recognize_face_from_frame(frame):
-    try:
-        rep = DeepFace.represent(frame, model_name='Facenet', enforce_detection=False)
+# max euclidean distance between unit embeddings to accept a match
+MATCH_THRESHOLD = 1.10
 
-        if not rep or not isinstance(rep, list) or "embedding" not in rep[0]:
-            return None, None
 
-        uploaded_emb = np.array(rep[0]["embedding"], dtype=float)
-        if uploaded_emb.size == 0 or not np.isfinite(uploaded_emb).all():
-            return None, None
-        uploaded_norm = np.linalg.norm(uploaded_emb)
-        if uploaded_norm == 0:
-            return None, None
-        uploaded_emb = uploaded_emb / uploaded_norm
+def bytes_from_data_url(image_data):
+    """Decode a base64 (optionally data-URL prefixed) image into file bytes."""
+    if ',' in image_data:
+        image_data = image_data.split(',', 1)[1]
+    return base64.b64decode(image_data)
 
-        candidates = []
 
-        for u in User.objects.exclude(embedding=None).exclude(embedding=""):
-            try:
-                stored_arr = np.array(json.loads(u.embedding), dtype=float)
-                if stored_arr.shape != uploaded_emb.shape:
-                    continue
-                if not np.isfinite(stored_arr).all():
-                    continue
-                stored_norm = np.linalg.norm(stored_arr)
-                if stored_norm == 0:
-                    continue
-                stored_emb = stored_arr / stored_norm
-                dist = float(np.linalg.norm(stored_emb - uploaded_emb))
-                candidates.append((u, dist))
-            except Exception:
-                continue
+def frame_from_bytes(image_bytes):
+    """Decode image file bytes into a BGR array (see faceapp/imaging.py)."""
+    return decode_image(image_bytes)
 
-        if not candidates:
-            return None, None
 
-        candidates.sort(key=lambda x: x[1])
+def frame_from_data_url(image_data):
+    """Decode a base64 (optionally data-URL prefixed) image into a BGR array."""
+    return frame_from_bytes(bytes_from_data_url(image_data))
+
+
+def represent_frame(frame, image_bytes=None):
+    """
+    ``represent(frame)``, served from the embedding cache when the encoded
+    ``image_bytes`` (or, with FACE_EMBEDDING_CACHE_PHASH, a near-identical
+    frame) were embedded recently.
+    """
+    cache = get_embedding_cache()
+    if cache is None or image_bytes is None:
+        return represent(frame)
+    return cache.get_or_compute(image_bytes, frame, represent)
+
+
+def search_scope(request, params=None):
+    """
+    Gallery shard to search first: the kiosk claim of the token, else a
+    ``department`` or ``location`` request parameter (``params`` = parsed
+    JSON body or form, then the query string). None = whole gallery.
+    """
+    source = (getattr(request, "token_claims", None) or {}).get("kiosk")
+    if not isinstance(source, dict) or not source:
+        params = params if isinstance(params, dict) else {}
+        source = {key: params.get(key) or request.GET.get(key) for key in ("department", "location")}
+    if source.get("department"):
+        try:
+            return ("department", int(source["department"]))
+        except (TypeError, ValueError):
+            return None
+    if source.get("location"):
+        return ("location", str(source["location"]))
+    return None
+
+
+def match_embeddings(embeddings, scope=None):
+    """
+    Identify raw embeddings against the gallery in one batched search.
+    Returns a ``(user, distance)`` pair per input, ``(None, None)`` when
+    there is no usable candidate.
+
+    With a ``scope`` only that shard is searched; probes whose best local
+    distance misses MATCH_THRESHOLD are retried against the whole gallery
+    (``FACE_SCOPE_FALLBACK``).
+    """
+    results = inference.search(embeddings, k=5, scope=scope)
+    if scope is not None and getattr(settings, "FACE_SCOPE_FALLBACK", True):
+        retry = [i for i, candidates in enumerate(results)
+                 if embeddings[i] is not None and (not candidates or candidates[0][1] > MATCH_THRESHOLD)]
+        if retry:
+            logger.debug("Scope %s: no local match for %d of %d faces, searching globally",
+                         scope, len(retry), len(results))
+            for i, candidates in zip(retry, inference.search([embeddings[i] for i in retry], k=5)):
+                results[i] = candidates
+    users = User.objects.in_bulk({uid for candidates in results for uid, _ in candidates})
+
+    matches = []
+    for candidates in results:
+        if not candidates:
+            matches.append((None, None))
+            continue
         # log top candidates for debugging
-        top = [(c[0].id, c[0].name, c[1]) for c in candidates[:5]]
+        top = [(uid, users[uid].name, dist) for uid, dist in candidates if uid in users]
         print("Recognition candidates (id,name,dist):", top)
 
-        best, min_dist = candidates[0]
-        return best, min_dist
+        best_id, min_dist = candidates[0]
+        best = users.get(best_id)
+        matches.append((best, min_dist) if best is not None else (None, None))
+    return matches
+
+
+def first_embedding(rep):
+    if not rep or not isinstance(rep, list) or "embedding" not in rep[0]:
+        return None
+    return rep[0]["embedding"]
+
+
+def recognize_face_from_frame(frame, image_bytes=None, scope=None):
+    try:
+        embedding = first_embedding(represent_frame(frame, image_bytes))
+        if embedding is None:
+            return None, None
+        return match_embeddings([embedding], scope)[0]
 
     except Exception as e:
         print("DeepFace error:", e)
         return None, None
 
 
+def recognize_faces_from_frame(frame, image_bytes=None, scope=None):
+    """
+    Identify every face in ``frame``. One detection pass finds the faces,
+    DeepFace embeds them in one batch, and all embeddings are matched in a
+    single gallery search. Returns ``[(user, distance, box), ...]`` for up
+    to ``FACE_MULTI_MAX_FACES`` faces, largest first.
+    """
+    rep = represent_frame(frame, image_bytes)
+    if not rep or not isinstance(rep, list):
+        return []
+    faces = [f for f in rep if "embedding" in f]
+    faces.sort(key=lambda f: f.get("facial_area", {}).get("w", 0) * f.get("facial_area", {}).get("h", 0), reverse=True)
+    faces = faces[:getattr(settings, "FACE_MULTI_MAX_FACES", 10)]
+
+    matches = match_embeddings([f["embedding"] for f in faces], scope)
+    return [(user, distance, face.get("facial_area")) for face, (user, distance) in zip(faces, matches)]
+
+
+def multi_attendance_result(frame, image_bytes=None, scope=None, kiosk=""):
+    """
+    Punch every recognised face in ``frame`` in one transaction. A person
+    seen twice in the same frame is punched once (closest match).
+    """
+    faces = recognize_faces_from_frame(frame, image_bytes, scope)
+    if not faces:
+        return {"status": "failed", "message": "No face found", "faces": []}
+
+    results = [None] * len(faces)
+    punched = set()
+    # closest matches first, so a duplicate keeps its best face
+    order = sorted(range(len(faces)), key=lambda i: faces[i][1] if faces[i][1] is not None else float("inf"))
+    with transaction.atomic():
+        for i in order:
+            user, distance, box = faces[i]
+            if user is not None and user.pk in punched and distance <= MATCH_THRESHOLD:
+                result = {"status": "duplicate", "message": f"{user.name} already punched in this frame", "name": user.name}
+            else:
+                result = attendance_result(user, distance, kiosk)
+                if result["status"] == "success":
+                    punched.add(user.pk)
+            result["box"] = box
+            if distance is not None:
+                result["distance"] = float(distance)
+            results[i] = result
+
+    status = "success" if punched else "failed"
+    return {"status": status, "message": f"{len(punched)} of {len(faces)} faces recognised", "faces": results}
+
+
+def punch_attendance(user, distance=None, kiosk=""):
+    """Record login (first punch of the day) or logout for ``user``."""
+    action, hours = attendance.punch(user, kiosk=kiosk, distance=distance)
+    if action == attendance.LOGIN:
+        return {"status": "success", "action": "login", "message": f"Login recorded for {user.name}", "name": user.name}
+    return {"status": "success", "action": "logout", "message": f"Logout recorded for {user.name}", "working_hours": hours, "name": user.name}
+
+
+NO_FACE_RESULT = {"status": "no_face", "message": "No face detected"}
+
+
+def kiosk_name(request):
+    """Recorded on each PunchEvent: the account the kiosk is logged in as."""
+    user = getattr(request, "user", None)
+    return getattr(user, "email", "") or ""
+
+
+def attendance_result(user, distance, kiosk=""):
+    """Response payload for one recognition attempt, punching on a match."""
+    if not user or distance is None:
+        return {"status": "failed", "message": "Face not recognised"}
+
+    if distance > MATCH_THRESHOLD:
+        return {"status": "failed", "message": "Face not recognised", "distance": float(distance)}
+
+    return punch_attendance(user, float(distance), kiosk)
+
+
 # ---------------------------
 # Start Attendance (PROTECTED)
 # ---------------------------
@@ -234,41 +396,95 @@ def start_attendance(request):
         return JsonResponse({"status": "error", "message": "DeepFace not installed"}, status=501)
 
     try:
-        payload = json.loads(request.body.decode('utf-8'))
-        image_data = payload.get('image')
+        if is_binary_request(request):
+            # raw image/jpeg body; options go in the query string
+            image_bytes = request.body
+            multi = request.GET.get('multi') in ('1', 'true', 'True')
+            scope = search_scope(request)
+        else:
+            payload = json.loads(request.body.decode('utf-8'))
+            image_data = payload.get('image')
+            image_bytes = bytes_from_data_url(image_data) if image_data else None
+            multi = payload.get('multi')
+            scope = search_scope(request, payload)
 
-        if not image_data:
+        if not image_bytes:
             return JsonResponse({"status": "error", "message": "No image data provided"}, status=400)
 
-        # decode base64
-        if ',' in image_data:
-            image_data = image_data.split(',', 1)[1]
+        frame = frame_from_bytes(image_bytes)
 
-        image_bytes = base64.b64decode(image_data)
-        img = Image.open(io.BytesIO(image_bytes)).convert('RGB')
-        frame = np.array(img)[:, :, ::-1]
+        if prefilter.rejects(frame, "start"):
+            return JsonResponse(NO_FACE_RESULT)
 
-        user, distance = recognize_face_from_frame(frame)
+        if multi:
+            return JsonResponse(multi_attendance_result(frame, image_bytes, scope, kiosk_name(request)))
+
+        user, distance = recognize_face_from_frame(frame, image_bytes, scope)
         print("DISTANCE:", distance)
 
-        if not user or distance is None:
-            return JsonResponse({"status": "failed", "message": "Face not recognised"})
+        return JsonResponse(attendance_result(user, distance, kiosk_name(request)))
+
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=500)
 
-        if distance > 1.10:
-            return JsonResponse({"status": "failed", "message": "Face not recognised", "distance": float(distance)})
 
-        today = timezone.localdate()
-        record, created = Attendance.objects.get_or_create(user=user, date=today)
-        now = timezone.now()
+# ---------------------------
+# Start Attendance, several frames per call (PROTECTED)
+# ---------------------------
+@csrf_exempt
+def start_attendance_batch(request):
+    """
+    POST JSON ``{"images": ["<base64>", ...]}`` or multipart with several
+    ``images`` files. All frames go through one batched Facenet pass and
+    one gallery search; the response has a result per image, in order.
+    """
+    if not getattr(request, "user", None):
+        return JsonResponse({"status": "error", "message": "Authentication required"}, status=401)
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "Invalid method"}, status=405)
+    if not HAS_DEEPFACE:
+        return JsonResponse({"status": "error", "message": "DeepFace not installed"}, status=501)
 
-        if not record.login_time:
-            record.login_time = now
-            record.save()
-            return JsonResponse({"status": "success", "action": "login", "message": f"Login recorded for {user.name}", "name": user.name})
+    try:
+        if request.content_type.startswith('multipart/'):
+            items = request.FILES.getlist('images')
+            decode = lambda f: frame_from_bytes(f.read())
+            scope = search_scope(request, request.POST)
         else:
-            record.logout_time = now
-            record.calculate_working_hours()
-            return JsonResponse({"status": "success", "action": "logout", "message": f"Logout recorded for {user.name}", "working_hours": record.working_hours, "name": user.name})
+            payload = json.loads(request.body.decode('utf-8'))
+            items = payload.get('images') or []
+            scope = search_scope(request, payload)
+            if not isinstance(items, list):
+                return JsonResponse({"status": "error", "message": "images must be a list"}, status=400)
+            decode = frame_from_data_url
+
+        if not items:
+            return JsonResponse({"status": "error", "message": "No images provided"}, status=400)
+        max_images = getattr(settings, "FACE_BATCH_MAX_IMAGES", 16)
+        if len(items) > max_images:
+            return JsonResponse({"status": "error", "message": f"At most {max_images} images per request"}, status=400)
+
+        results = [None] * len(items)
+        frames, positions = [], []
+        for i, item in enumerate(items):
+            try:
+                frame = decode(item)
+            except Exception as e:
+                results[i] = {"status": "error", "message": f"Could not decode image: {e}"}
+                continue
+            if prefilter.rejects(frame, "start_batch"):
+                results[i] = dict(NO_FACE_RESULT)
+                continue
+            frames.append(frame)
+            positions.append(i)
+
+        embeddings = [first_embedding(rep) for rep in represent_batch(frames)]
+        for i, (user, distance) in zip(positions, match_embeddings(embeddings, scope)):
+            results[i] = attendance_result(user, distance, kiosk_name(request))
+
+        for i, result in enumerate(results):
+            result["index"] = i
+        return JsonResponse({"status": "success", "results": results})
 
     except Exception as e:
         return JsonResponse({"status": "error", "message": str(e)}, status=500)
@@ -288,11 +504,17 @@ def verify_face(request):
         return JsonResponse({"error": "DeepFace not installed"}, status=501)
 
     try:
-        data = json.loads(request.body.decode('utf-8'))
-        email = data.get("email")
-        image_data = data.get("image")
+        if is_binary_request(request):
+            # raw image/jpeg body, ?email=... in the query string
+            email = request.GET.get("email")
+            image_bytes = request.body
+        else:
+            data = json.loads(request.body.decode('utf-8'))
+            email = data.get("email")
+            image_data = data.get("image")
+            image_bytes = bytes_from_data_url(image_data) if image_data else None
 
-        if not email or not image_data:
+        if not email or not image_bytes:
             return JsonResponse({"error": "email and image required"}, status=400)
 
         try:
@@ -300,37 +522,28 @@ def verify_face(request):
         except User.DoesNotExist:
             return JsonResponse({"error": "User not found"}, status=404)
 
-        if not user.embedding:
+        stored_emb = user.get_embedding()
+        if stored_emb is None:
             return JsonResponse({"error": "User has no embedding saved"}, status=400)
 
-        if ',' in image_data:
-            image_data = image_data.split(",", 1)[1]
+        frame = frame_from_bytes(image_bytes)
 
-        img_bytes = base64.b64decode(image_data)
-        img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-        frame = np.array(img)[:, :, ::-1]
+        if prefilter.rejects(frame, "verify"):
+            return JsonResponse({"error": "No face detected", "status": "no_face"}, status=400)
 
-        rep = DeepFace.represent(frame, model_name='Facenet', enforce_detection=False)
+        rep = represent_frame(frame, image_bytes)
         if not rep or not isinstance(rep, list) or 'embedding' not in rep[0]:
             return JsonResponse({"error": "Could not compute embedding from image"}, status=400)
 
-        uploaded_emb = np.array(rep[0]['embedding'], dtype=float)
-        if uploaded_emb.size == 0 or not np.isfinite(uploaded_emb).all():
-            return JsonResponse({"error": "Invalid uploaded embedding"}, status=400)
-        uploaded_norm = np.linalg.norm(uploaded_emb)
-        if uploaded_norm == 0:
+        uploaded_emb = normalize(rep[0]['embedding'])
+        if uploaded_emb is None:
             return JsonResponse({"error": "Invalid uploaded embedding"}, status=400)
-        uploaded_emb = uploaded_emb / uploaded_norm
-
-        stored_arr = np.array(json.loads(user.embedding), dtype=float)
-        if stored_arr.shape != uploaded_emb.shape:
+        if stored_emb.shape != uploaded_emb.shape:
             return JsonResponse({"error": "Embedding dimension mismatch"}, status=400)
-        if not np.isfinite(stored_arr).all():
-            return JsonResponse({"error": "Stored embedding invalid"}, status=400)
-        stored_emb = stored_arr / np.linalg.norm(stored_arr)
 
-        distance = float(np.linalg.norm(stored_emb - uploaded_emb))
-        match = distance < 1.10
+        # both are unit vectors: |a - b| = sqrt(2 - 2 a.b)
+        distance = float(np.sqrt(max(0.0, 2.0 - 2.0 * float(stored_emb @ uploaded_emb))))
+        match = distance < MATCH_THRESHOLD
 
         return JsonResponse({"match": match, "distance": distance})
 
@@ -372,10 +585,11 @@ def logout_api(request):
     if auth.startswith("Bearer "):
         key = auth.split(None, 1)[1]
         try:
-            t = APIToken.objects.filter(key=key).first()
+            t = APIToken.for_token(key).first()
             if t:
                 t.revoked = True
                 t.save(update_fields=["revoked"])
+                token_cache.revoke(token_digest(key))
         except Exception:
             pass
 
@@ -426,27 +640,204 @@ def start_attendance_file(request):
         return JsonResponse({"status": "error", "message": "No file uploaded"}, status=400)
 
     try:
-        img = Image.open(f).convert('RGB')
-        frame = np.array(img)[:, :, ::-1]
-        user, distance = recognize_face_from_frame(frame)
+        image_bytes = f.read()
+        frame = frame_from_bytes(image_bytes)
+        if prefilter.rejects(frame, "start_file"):
+            return JsonResponse(NO_FACE_RESULT)
+        scope = search_scope(request, request.POST)
+        if request.POST.get('multi') in ('1', 'true', 'True'):
+            return JsonResponse(multi_attendance_result(frame, image_bytes, scope, kiosk_name(request)))
+        user, distance = recognize_face_from_frame(frame, image_bytes, scope)
+        return JsonResponse(attendance_result(user, distance, kiosk_name(request)))
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=500)
 
-        if not user or distance is None:
-            return JsonResponse({"status": "failed", "message": "Face not recognised"})
 
-        if distance > 1.10:
-            return JsonResponse({"status": "failed", "message": "Face not recognised", "distance": float(distance)})
+# ---------------------------
+# Reports (PROTECTED, see faceapp/reports.py)
+# ---------------------------
+def report_user(request):
+    """The JWT-authenticated User (not Django's AnonymousUser), or None."""
+    user = getattr(request, "user", None)
+    return user if isinstance(user, User) else None
 
-        today = timezone.localdate()
-        record, created = Attendance.objects.get_or_create(user=user, date=today)
-        now = timezone.now()
 
-        if not record.login_time:
-            record.login_time = now
-            record.save()
-            return JsonResponse({"status": "success", "action": "login", "message": f"Login recorded for {user.name}", "name": user.name})
-        else:
-            record.logout_time = now
-            record.calculate_working_hours()
-            return JsonResponse({"status": "success", "action": "logout", "message": f"Logout recorded for {user.name}", "working_hours": record.working_hours, "name": user.name})
+def optional_int(value, name):
+    if value in (None, ""):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+
+
+def report_view(admin_only=True):
+    """GET-only, authenticated (admin unless ``admin_only=False``), ValueError -> 400."""
+    def decorate(view):
+        def wrapper(request):
+            user = report_user(request)
+            if user is None:
+                return JsonResponse({"status": "error", "message": "Authentication required"}, status=401)
+            if admin_only and not user.is_admin:
+                return JsonResponse({"status": "error", "message": "Admin only"}, status=403)
+            if request.method != "GET":
+                return JsonResponse({"status": "error", "message": "Invalid method"}, status=405)
+            try:
+                return view(request, user)
+            except ValueError as e:
+                return JsonResponse({"status": "error", "message": str(e)}, status=400)
+        wrapper.__name__ = view.__name__
+        wrapper.__doc__ = view.__doc__
+        return wrapper
+    return decorate
+
+
+@report_view(admin_only=False)
+def report_history(request, user):
+    """
+    GET ?user_id=&from=&to=&limit=&cursor= : daily rows of one user, newest
+    first. Admins may pass any ``user_id``; others only see their own.
+    """
+    user_id = optional_int(request.GET.get("user_id"), "user_id") or user.id
+    if user_id != user.id and not user.is_admin:
+        return JsonResponse({"status": "error", "message": "Admin only"}, status=403)
+    start, end = reports.date_range(request.GET)
+    rows, totals, cursor = reports.user_history(
+        user_id, start, end, reports.page_limit(request.GET.get("limit")), request.GET.get("cursor"))
+    return JsonResponse({"status": "success", "user_id": user_id, "from": start, "to": end,
+                         "totals": totals, "results": rows, "next_cursor": cursor})
+
+
+@report_view()
+def report_departments(request, user):
+    """GET ?from=&to=&department=&limit=&cursor= : per-department daily totals."""
+    start, end = reports.date_range(request.GET)
+    rows, cursor = reports.department_daily(
+        start, end, optional_int(request.GET.get("department"), "department"),
+        reports.page_limit(request.GET.get("limit")), request.GET.get("cursor"))
+    return JsonResponse({"status": "success", "from": start, "to": end, "results": rows, "next_cursor": cursor})
+
+
+@report_view()
+def report_late(request, user):
+    """GET ?date=&department=&limit=&cursor= : logins after FACE_LATE_AFTER."""
+    day = reports.date_range({"to": request.GET.get("date")}, default_days=1)[1]
+    rows, cursor = reports.late_list(
+        day, optional_int(request.GET.get("department"), "department"),
+        reports.page_limit(request.GET.get("limit")), request.GET.get("cursor"))
+    return JsonResponse({"status": "success", "date": day, "late_after": reports.late_after(),
+                         "results": rows, "next_cursor": cursor})
+
+
+@report_view()
+def report_absent(request, user):
+    """GET ?date=&department=&limit=&cursor= : users with no attendance that day."""
+    day = reports.date_range({"to": request.GET.get("date")}, default_days=1)[1]
+    rows, cursor = reports.absent_list(
+        day, optional_int(request.GET.get("department"), "department"),
+        reports.page_limit(request.GET.get("limit")), request.GET.get("cursor"))
+    return JsonResponse({"status": "success", "date": day, "results": rows, "next_cursor": cursor})
+
+
+def report_month(request):
+    value = request.GET.get("month")
+    if not value:
+        return timezone.localdate().replace(day=1)
+    try:
+        return datetime.date.fromisoformat(value + "-01")
+    except ValueError:
+        raise ValueError(f"Invalid month {value!r}, expected YYYY-MM")
+
+
+@report_view()
+def report_departments_monthly(request, user):
+    """GET ?from=&to=&department=&limit=&cursor= : per-department month totals."""
+    start, end = reports.date_range(request.GET, default_days=365)
+    rows, cursor = reports.department_monthly(
+        start, end, optional_int(request.GET.get("department"), "department"),
+        reports.page_limit(request.GET.get("limit")), request.GET.get("cursor"))
+    return JsonResponse({"status": "success", "from": start, "to": end, "results": rows, "next_cursor": cursor})
+
+
+@report_view()
+def report_users_monthly(request, user):
+    """GET ?month=YYYY-MM&department=&limit=&cursor= : per-user month totals (payroll)."""
+    month = report_month(request)
+    rows, cursor = reports.user_monthly(
+        month, optional_int(request.GET.get("department"), "department"),
+        reports.page_limit(request.GET.get("limit")), request.GET.get("cursor"))
+    return JsonResponse({"status": "success", "month": month.strftime("%Y-%m"), "results": rows, "next_cursor": cursor})
+
+
+# ---------------------------
+# Exports (PROTECTED, admin; see faceapp/exports.py)
+# ---------------------------
+def export_response(request, name, header, rows):
+    """Stream ``rows`` as ?format=csv|json, gzip-compressed with ?gzip=1."""
+    fmt = request.GET.get("format", "csv")
+    if fmt not in exports.FORMATS:
+        raise ValueError("format must be csv or json")
+    encode_chunks, content_type = exports.FORMATS[fmt]
+    compress = request.GET.get("gzip") in ("1", "true", "True")
+    filename = f"{name}.{fmt}"
+    if compress:
+        content_type = "application/gzip"
+        filename += ".gz"
+    response = StreamingHttpResponse(exports.encode(encode_chunks(header, rows), compress), content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@report_view()
+def export_users(request, user):
+    """GET ?format=csv|json&gzip=1 : every user, streamed."""
+    return export_response(request, "users", exports.USER_HEADER, exports.user_rows())
+
+
+@report_view()
+def export_attendance(request, user):
+    """GET ?from=&to=&department=&format=csv|json&gzip=1 : attendance rows, streamed."""
+    start, end = reports.date_range(request.GET, max_days=None)
+    department = optional_int(request.GET.get("department"), "department")
+    return export_response(request, f"attendance_{start}_{end}", exports.ATTENDANCE_HEADER,
+                           exports.attendance_rows(start, end, department))
+
+
+# ---------------------------
+# Bulk enrollment (PROTECTED, admin; see faceapp/enrollment.py)
+# ---------------------------
+@csrf_exempt
+def enroll_users(request):
+    """
+    POST multipart: ``csv`` (name, email, department[, photo, password])
+    and ``photos`` (zip). Optional field ``create_departments``. Photos
+    are only checked here; ``run_embedding_worker`` embeds them (one
+    EmbeddingJob per user), so the request never runs the model. CSVs
+    over ``FACE_ENROLL_MAX_ROWS`` rows get 413. Returns counts and
+    per-row failures.
+    """
+    user = report_user(request)
+    if user is None:
+        return JsonResponse({"status": "error", "message": "Authentication required"}, status=401)
+    if not user.is_admin:
+        return JsonResponse({"status": "error", "message": "Admin only"}, status=403)
+    if request.method != "POST":
+        return JsonResponse({"status": "error", "message": "Invalid method"}, status=405)
+
+    csv_file = request.FILES.get("csv")
+    photos = request.FILES.get("photos")
+    if not csv_file or not photos:
+        return JsonResponse({"status": "error", "message": "csv and photos files are required"}, status=400)
+    create_departments = request.POST.get("create_departments") in ("1", "true", "True")
+
+    try:
+        result = enrollment.enroll(csv_file, photos, create_departments=create_departments,
+                                   queue=True, workers=getattr(settings, "FACE_ENROLL_WORKERS", 2),
+                                   max_rows=getattr(settings, "FACE_ENROLL_MAX_ROWS", 200))
+    except enrollment.TooManyRows as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=413)
+    except ValueError as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
     except Exception as e:
-        return JsonResponse({"status": "error", "message": str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({"status": "error", "message": str(e)}, status=500)
+    return JsonResponse({"status": "success", "queued": True, **result})
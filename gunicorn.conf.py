@@ -0,0 +1,23 @@
+# gunicorn.conf.py
+# Usage: gunicorn -c gunicorn.conf.py face_attendance_django.wsgi
+#
+# Each worker loads TensorFlow and Facenet in a background thread right after
+# it has loaded the app, and /api/health/ answers 503 until that is done, so
+# a load balancer health check only routes kiosks to warm workers. Running
+# it per worker (rather than with preload_app in the master) keeps
+# TensorFlow out of the forking process.
+import os
+
+wsgi_app = "face_attendance_django.wsgi:application"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+# >1 switches to gthread workers; needed for FACE_BATCHING_ENABLED to see
+# concurrent requests inside one worker
+threads = int(os.environ.get("GUNICORN_THREADS", "1"))
+# model loading can take a while on cold workers
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+
+
+def post_worker_init(worker):
+    from faceapp.inference import start_warm_up
+    start_warm_up()